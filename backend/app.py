@@ -1,116 +1,368 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, Response, stream_with_context
 from flask_cors import CORS
 import openai
 import os
 from dotenv import load_dotenv
+import logging
 import time
 import uuid
-from data_processor import get_data_processor
+import json
+from data_processor import (
+    get_data_processor,
+    peek_data_processor,
+    reload_data_processor,
+    start_warmup,
+    wait_for_data_processor,
+    warmup_status,
+    format_hits,
+)
+from cache import SemanticCache
+from context_builder import PASSAGE_TEMPLATE, create_context_builder
+from session_store import create_session_store, sync_client_messages
+from sharded_index import is_worker_process
+from embedding_store import SOURCE_NAMES
+from log_utils import configure_logging, sampled
+from metrics import REGISTRY, CONTENT_TYPE, STAGE_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL, start_spans, timed
 
 # 加载环境变量
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # 设置session密钥
 app.config['JSON_AS_ASCII'] = False  # 确保JSON响应中的中文正确显示
 CORS(app, supports_credentials=True)  # 启用跨域支持credentials
 
-# 修改用户会话的数据结构
-chat_sessions = {
-    # session_id: {
-    #     'messages': [],
-    #     'system_prompt': None,
-    #     'is_law_mode': False,  # 是否为法律助手模式
-    #     'law_cases_count': 3,  # 法条检索数量
-    #     'qa_cases_count': 3    # 问答检索数量
-    # }
-}
+# 用户会话存储：session_id -> 会话设置 + 与客户端同步的对话历史
+# SESSION_STORE=memory 为进程内 LRU（默认），sqlite 可在重启后保留并由多个工作进程共享
+chat_sessions = create_session_store()
+
+# 发送给模型的最大历史消息条数（包含本轮用户消息）
+MAX_HISTORY_MESSAGES = int(os.getenv('MAX_HISTORY_MESSAGES', 20))
 
 # 配置OpenAI
 openai.api_key = os.getenv('DEEPSEEK_API_KEY')
-openai.api_base = "https://api.deepseek.com/v1"
+openai.api_base = os.getenv('DEEPSEEK_API_BASE', "https://api.deepseek.com/v1")
+
+# 按 token 预算组装发送给模型的上下文
+context_builder = create_context_builder()
+
+# 语义答案缓存：法律模式下的单轮提问与之前的问题足够相似（且系统提示词、检索数量和语料版本相同）时，
+# 直接返回之前的回答和相关案例，不再检索和调用模型。会话可通过 /set-system-prompt 的 semantic_cache 关闭
+answer_cache = SemanticCache(
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600)),
+    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+)
+
+# 管理接口令牌，未设置时管理接口不可用
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# 延迟启动：LAZY_STARTUP=1 时服务立即可用，语料、嵌入模型和索引在后台线程中加载，
+# 加载完成前法律模式的请求最多等待 WARMUP_WAIT_SECONDS 秒，超时则不附带相关案例直接回答
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', '0').lower() in ('1', 'true', 'yes')
+WARMUP_WAIT_SECONDS = float(os.getenv('WARMUP_WAIT_SECONDS', 10))
+
+# 检索接口：/search/batch 每次请求最多的查询条数、JSON 分页的每页条数、NDJSON 流式输出时每批计算的条数
+SEARCH_MAX_QUERIES = int(os.getenv('SEARCH_MAX_QUERIES', 100000))
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 100))
+SEARCH_BATCH_SIZE = int(os.getenv('SEARCH_BATCH_SIZE', 256))
+# 单个来源最多返回的条数
+SEARCH_MAX_TOP_K = 100
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# 初始化数据处理器（语料热更新后 get_data_processor() 返回新的实例）
+# 以 python app.py 启动时，分片检索的工作进程会重新导入本模块，工作进程中不加载
+if is_worker_process():
+    pass
+elif LAZY_STARTUP:
+    logger.info("延迟启动：在后台加载数据处理器")
+    start_warmup()
+else:
+    logger.info("正在初始化数据处理器...")
+    get_data_processor()
+    logger.info("数据处理器初始化完成")
 
-# 初始化数据处理器
-print("正在初始化数据处理器...")
-data_processor = get_data_processor()
-print("数据处理器初始化完成")
+def register_metrics():
+    """注册导出时才读取的指标：活跃会话数、会话存储的消息规模、语料规模和缓存命中数"""
+    # 数据处理器加载完成前只导出会话数和就绪状态
+    def corpus_counts(count):
+        processor = peek_data_processor()
+        if processor is None:
+            return {}
+        return {(SOURCE_NAMES[source],): count(processor, source) for source in SOURCE_NAMES}
+    
+    def cache_counts(field):
+        counts = {('semantic_answer',): answer_cache.stats()[field]}
+        processor = peek_data_processor()
+        if processor is not None:
+            stats = processor.cache_stats()
+            counts.update({(name,): stats[name][field] for name in ('query_embedding', 'retrieval_result')})
+        return counts
+    
+    REGISTRY.gauge_callback('rag_ready', '数据处理器是否加载完成', lambda: int(peek_data_processor() is not None))
+    REGISTRY.gauge_callback('rag_active_sessions', '活跃会话数', lambda: len(chat_sessions))
+    REGISTRY.gauge_callback('rag_session_messages', '会话存储中保存的消息数', lambda: chat_sessions.stats()['messages'])
+    REGISTRY.gauge_callback('rag_session_content_chars', '会话存储中消息内容的总字符数',
+                            lambda: chat_sessions.stats()['content_chars'])
+    REGISTRY.gauge_callback('rag_corpus_rows', '语料行数', lambda: corpus_counts(
+        lambda processor, source: processor.corpus_size(source)), ('source',))
+    REGISTRY.gauge_callback('rag_corpus_chunks', '语料切分后的块数', lambda: corpus_counts(
+        lambda processor, source: len(processor.chunks[source])), ('source',))
+    REGISTRY.gauge_callback('rag_cache_hits_total', '缓存命中次数', lambda: cache_counts('hits'),
+                            ('cache',), kind='counter')
+    REGISTRY.gauge_callback('rag_cache_misses_total', '缓存未命中次数', lambda: cache_counts('misses'),
+                            ('cache',), kind='counter')
+
+register_metrics()
+
+def record_request(endpoint, status, start_time, spans):
+    """记录接口耗时和请求数，按 LOG_SAMPLE_RATE 采样输出各阶段耗时"""
+    elapsed = time.perf_counter() - start_time
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+    if sampled():
+        logger.info("%s %s 耗时 %.1f ms，各阶段（ms）：%s", endpoint, status, elapsed * 1000,
+                    {stage: round(seconds * 1000, 2) for stage, seconds in spans.items()})
 
 # 添加一个测试路由
 @app.route('/')
 def home():
     return "Chat API is running!"
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """就绪检查：数据处理器加载完成时返回 200，加载中或加载失败时返回 503 和当前进度"""
+    status = warmup_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    processor = peek_data_processor()
+    if processor is None:
+        return jsonify(warmup_status()), 503
+    return jsonify({**processor.cache_stats(), 'semantic_answer': answer_cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+def is_admin_request(req):
+    """校验管理接口令牌"""
+    return bool(ADMIN_TOKEN) and req.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.route('/admin/reload-corpus', methods=['POST'])
+def reload_corpus():
+    """增量更新语料（只计算新增或修改行的嵌入）并热替换数据处理器"""
+    if not is_admin_request(request):
+        return jsonify({'error': '无权限'}), 403
+    try:
+        start_time = time.time()
+        processor = reload_data_processor()
+        return jsonify({
+            "status": "success",
+            "corpus_version": processor.corpus_version,
+            "law_count": len(processor.law_data_index),
+            "qa_count": len(processor.law_qa_index),
+            "elapsed": time.time() - start_time
+        })
+    except Exception as e:
+        logger.exception("语料更新失败: %s", e)
+        return jsonify({'error': f"语料更新失败: {str(e)}"}), 500
+
+def parse_json_object(body):
+    """解析请求体，空请求体视为 {}；不是合法的 JSON 或不是 JSON 对象时抛出 ValueError"""
+    if not body or not body.strip():
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ValueError("请求体不是合法的 JSON")
+    if not isinstance(data, dict):
+        raise ValueError("请求体须为 JSON 对象")
+    return data
+
+def parse_search_params(data):
+    """解析检索参数，不合法时抛出 ValueError"""
+    params = {
+        'law_top_k': int(data.get('law_top_k', 3)),
+        'qa_top_k': int(data.get('qa_top_k', 3)),
+        'similarity_threshold': float(data.get('similarity_threshold', 0.3)),
+        'nprobe': int(data['nprobe']) if data.get('nprobe') is not None else None,
+    }
+    for name in ('law_top_k', 'qa_top_k'):
+        if not 0 <= params[name] <= SEARCH_MAX_TOP_K:
+            raise ValueError(f"{name} 须在 0 到 {SEARCH_MAX_TOP_K} 之间")
+    return params
+
+def parse_search_batch(data, accept=''):
+    """
+    解析 /search/batch 请求，不合法时抛出 ValueError
+    :return: (queries, offset, limit, params, ndjson)，ndjson 为 True 时流式返回 offset 之后的全部结果
+    """
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        raise ValueError("queries 须为字符串列表")
+    if len(queries) > SEARCH_MAX_QUERIES:
+        raise ValueError(f"每次最多 {SEARCH_MAX_QUERIES} 条查询")
+    offset = int(data.get('offset', 0))
+    limit = int(data.get('limit', SEARCH_PAGE_SIZE))
+    if offset < 0 or not 0 < limit <= SEARCH_PAGE_SIZE:
+        raise ValueError(f"offset 不能为负数，limit 须在 1 到 {SEARCH_PAGE_SIZE} 之间")
+    ndjson = data.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in (accept or '')
+    return queries, offset, limit, parse_search_params(data), ndjson
+
+def search_batches(queries, start, end=None):
+    """按 SEARCH_BATCH_SIZE 切分 queries[start:end]，产出 (起始位置, 查询列表)"""
+    end = len(queries) if end is None else min(end, len(queries))
+    for begin in range(start, end, SEARCH_BATCH_SIZE):
+        yield begin, queries[begin:min(begin + SEARCH_BATCH_SIZE, end)]
+
+def run_search_batch(processor, begin, queries, params):
+    """批量检索一批查询，返回 [{'index': 在请求中的位置, 'query': 查询, 'hits': 检索结果}]"""
+    with timed('retrieval'):
+        results = processor.retrieve_batch(queries, **params)
+    return [
+        {'index': begin + i, 'query': query, 'hits': hits}
+        for i, (query, hits) in enumerate(zip(queries, results))
+    ]
+
+def ndjson_line(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+@app.route('/search', methods=['POST'])
+def search():
+    """
+    检索单条查询，返回结构化结果
+    hits 中每一项为 {'source': 'law' / 'qa', 'row': 行号, 'score': 余弦相似度, 'text': 片段}
+    """
+    request_start = time.perf_counter()
+    spans = start_spans()
+    status = 'error'
+    try:
+        try:
+            data = parse_json_object(request.get_data())
+            query = data.get('query')
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("query 不能为空")
+            params = parse_search_params(data)
+        except (TypeError, ValueError) as e:
+            status = 'invalid'
+            return jsonify({'error': str(e)}), 400
+        processor = peek_data_processor()
+        if processor is None:
+            status = 'unavailable'
+            return jsonify(warmup_status()), 503
+        with timed('retrieval'):
+            hits = processor.retrieve(query, **params)
+        status = 'ok'
+        return jsonify({'query': query, 'hits': hits})
+    except Exception as e:
+        logger.exception("检索失败: %s", e)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        record_request('search', status, request_start, spans)
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    批量检索：查询一次批量计算嵌入，每个来源用一次矩阵乘法打分
+    默认返回 queries[offset:offset + limit] 的结果和 next_offset（没有更多结果时为 null）；
+    请求体 format 为 ndjson 或 Accept 包含 application/x-ndjson 时，按行流式返回 offset 之后的全部结果
+    """
+    try:
+        data = parse_json_object(request.get_data())
+        queries, offset, limit, params, ndjson = parse_search_batch(data, request.headers.get('Accept'))
+    except (TypeError, ValueError) as e:
+        REQUESTS_TOTAL.inc(endpoint='search_batch', status='invalid')
+        return jsonify({'error': str(e)}), 400
+    processor = peek_data_processor()
+    if processor is None:
+        REQUESTS_TOTAL.inc(endpoint='search_batch', status='unavailable')
+        return jsonify(warmup_status()), 503
+    
+    if not ndjson:
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        try:
+            results = []
+            for begin, batch in search_batches(queries, offset, offset + limit):
+                results.extend(run_search_batch(processor, begin, batch, params))
+            next_offset = offset + limit if offset + limit < len(queries) else None
+            status = 'ok'
+            return jsonify({'results': results, 'offset': offset, 'next_offset': next_offset, 'total': len(queries)})
+        except Exception as e:
+            logger.exception("批量检索失败: %s", e)
+            return jsonify({'error': str(e)}), 500
+        finally:
+            record_request('search_batch', status, request_start, spans)
+    
+    def generate():
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        try:
+            for begin, batch in search_batches(queries, offset):
+                for record in run_search_batch(processor, begin, batch, params):
+                    yield ndjson_line(record)
+            status = 'ok'
+        except Exception as e:
+            logger.exception("批量检索失败: %s", e)
+            yield ndjson_line({'error': str(e)})
+        finally:
+            record_request('search_batch', status, request_start, spans)
+    
+    return Response(stream_with_context(generate()), mimetype=NDJSON_CONTENT_TYPE,
+                    headers={'X-Accel-Buffering': 'no'})
+
+def create_session():
+    """创建新会话并返回会话ID"""
+    session_id = str(uuid.uuid4())
+    chat_sessions.create(session_id)
+    return session_id
+
+def update_session_settings(session_id, data):
+    """根据 /set-system-prompt 的请求内容更新会话设置"""
+    chat_sessions.update(
+        session_id,
+        system_prompt=data.get('system_prompt'),
+        is_law_mode=data.get('is_law_mode', False),
+        law_cases_count=data.get('law_cases_count', 3),
+        qa_cases_count=data.get('qa_cases_count', 3),
+        semantic_cache=data.get('semantic_cache', True)
+    )
+
 @app.route('/start-session', methods=['POST'])
 def start_session():
-    session_id = str(uuid.uuid4())
-    chat_sessions[session_id] = {
-        'messages': [],
-        'system_prompt': None,
-        'is_law_mode': False
-    }
-    return jsonify({"session_id": session_id})
+    return jsonify({"session_id": create_session()})
 
 @app.route('/set-system-prompt', methods=['POST'])
 def set_system_prompt():
     try:
-        data = request.json
+        try:
+            data = parse_json_object(request.get_data())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         session_id = data.get('session_id')
-        system_prompt = data.get('system_prompt')
-        is_law_mode = data.get('is_law_mode', False)
-        law_cases_count = data.get('law_cases_count', 3)
-        qa_cases_count = data.get('qa_cases_count', 3)
         
         if not session_id or session_id not in chat_sessions:
             return jsonify({'error': '无效的会话ID'}), 400
             
-        chat_sessions[session_id].update({
-            'system_prompt': system_prompt,
-            'is_law_mode': is_law_mode,
-            'law_cases_count': law_cases_count,
-            'qa_cases_count': qa_cases_count
-        })
+        update_session_settings(session_id, data)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    try:
-        data = request.json
-        session_id = data.get('session_id')
-        messages = data.get('messages', [])
-        deep_thinking = data.get('deep_thinking', False)
-        
-        if not session_id or session_id not in chat_sessions:
-            return jsonify({'error': '无效的会话ID'}), 400
-            
-        session = chat_sessions[session_id]
-        system_prompt = session['system_prompt']
-        is_law_mode = session['is_law_mode']
-        law_cases_count = session.get('law_cases_count', 3)
-        qa_cases_count = session.get('qa_cases_count', 3)
-        
-        relevant_cases = []
-        
-        if is_law_mode and deep_thinking and messages:
-            latest_user_message = None
-            for msg in reversed(messages):
-                if msg['role'] == 'user':
-                    latest_user_message = msg
-                    break
-            
-            if latest_user_message:
-                relevant_cases = data_processor.find_relevant_cases(
-                    latest_user_message['content'],
-                    law_top_k=law_cases_count,
-                    qa_top_k=qa_cases_count
-                )
-                
-                context = "搜索结果：\n\n"
-                for i, case in enumerate(relevant_cases, 1):
-                    context += f"[文件 {i} 开始]\n{case}\n[文件 {i} 结束]\n\n"
-                
-                enhanced_prompt = f"""用户问题: {latest_user_message['content']}\n\n{context}\n请根据以上搜索结果回答问题。记住：
+def build_enhanced_prompt(question, relevant_cases):
+    """将检索到的相关案例拼接进用户问题"""
+    context = "搜索结果：\n\n"
+    for i, case in enumerate(relevant_cases, 1):
+        context += PASSAGE_TEMPLATE.format(index=i, text=case)
+    
+    return f"""用户问题: {question}\n\n{context}\n请根据以上搜索结果回答问题。记住：
 1. 引用文件时使用 [citation:X] 格式
 2. 在回答中始终包含引用
 3. 如果信息来自多个文件，使用多个引用
@@ -120,69 +372,280 @@ def chat():
 
 请先在 <think> 标签之间解释你的思考过程，然后给出最终答案。"""
 
-                # 替换最后一条用户消息
-                messages_before = messages[:-1]
-                messages = messages_before + [{
-                    "role": "user",
-                    "content": enhanced_prompt
-                }]
-        
-        # 构建完整的消息列表
-        full_messages = []
-        if system_prompt:
-            full_messages.append({
-                "role": "system",
-                "content": system_prompt  # 使用会话中保存的system prompt
-            })
-        
-        # 只添加用户和助手的消息，不要重复添加system消息
-        for msg in messages:
-            if msg['role'] != 'system':  # 跳过消息列表中的system消息
-                full_messages.append(msg)
-        
-        # 更新会话历史
-        chat_sessions[session_id]['messages'] = messages
+def lookup_cached_answer(processor, session, question):
+    """
+    在语义答案缓存中查找问题
+    查询向量经查询嵌入缓存与随后的检索共用，未命中时不会重复计算
+    :return: {'scope', 'embedding', 'hit'}，hit 为 None 或 {'answer', 'related_cases', 'similarity'}
+    """
+    scope = SemanticCache.make_scope(
+        session['system_prompt'], session.get('law_cases_count', 3), session.get('qa_cases_count', 3),
+        processor.corpus_version
+    )
+    embedding = processor.embed_query(question)
+    cached = answer_cache.get(scope, embedding)
+    hit = dict(cached[0], similarity=cached[1]) if cached is not None else None
+    return {'scope': scope, 'embedding': embedding, 'hit': hit}
+
+def store_cached_answer(cache_lookup, answer, relevant_cases):
+    """模型回答完成后存入语义答案缓存（仅限本次查找未命中的单轮提问）"""
+    if cache_lookup is not None and cache_lookup['hit'] is None and answer:
+        answer_cache.set(cache_lookup['scope'], cache_lookup['embedding'],
+                         {'answer': answer, 'related_cases': relevant_cases})
+
+def is_single_turn(session_id, history):
+    """
+    会话中只有一轮用户提问，即只缓存单轮提问的回答（多轮对话的回答依赖之前的上下文）
+    按用户消息条数判断，忽略前端在提问前加入的欢迎语等助手消息
+    """
+    return (chat_sessions.appended_count(session_id) == len(history)
+            and sum(1 for msg in history if msg['role'] == 'user') == 1)
+
+def needs_retrieval(session, deep_thinking):
+    """法律模式下开启深度思考时才检索相关案例"""
+    return bool(session['is_law_mode'] and deep_thinking)
+
+def prepare_chat_messages(session_id, messages, deep_thinking, get_processor=None):
+    """
+    追加新消息到会话历史，检索相关案例并在 token 预算内构建发送给模型的完整消息列表
+    发送给模型的历史最多 MAX_HISTORY_MESSAGES 条，超出预算的更早对话压缩为摘要
+    :param get_processor: 需要检索时调用，返回数据处理器或 None（仍在加载），
+                          默认最多等待 WARMUP_WAIT_SECONDS 秒
+    :return: (full_messages, relevant_cases, context_report, retrieval_status, cache_lookup)，
+             relevant_cases 为实际装入提示词的案例，
+             retrieval_status 为 None（未检索）、ok、cached（命中语义答案缓存）
+             或 warming_up（数据处理器仍在加载，本次不附带相关案例），
+             cache_lookup 为 None（不使用语义答案缓存）或 lookup_cached_answer 的结果；
+             命中缓存时 full_messages 和 context_report 为 None，relevant_cases 为缓存的相关案例
+    """
+    session = chat_sessions.get_settings(session_id)
+    system_prompt = session['system_prompt']
+    law_cases_count = session.get('law_cases_count', 3)
+    qa_cases_count = session.get('qa_cases_count', 3)
+    
+    # 按客户端发送的历史更新会话历史（通常只追加新消息）
+    sync_client_messages(chat_sessions, session_id, messages)
+    messages = chat_sessions.get_history(session_id, limit=MAX_HISTORY_MESSAGES)
+    
+    passages = None
+    retrieval_status = None
+    cache_lookup = None
+    if needs_retrieval(session, deep_thinking) and messages and messages[-1]['role'] == 'user':
+        if get_processor is not None:
+            processor = get_processor()
+        else:
+            processor = wait_for_data_processor(WARMUP_WAIT_SECONDS)
+        if processor is None:
+            retrieval_status = 'warming_up'
+            logger.warning("数据处理器尚未加载完成，本次回答不附带相关案例")
+        else:
+            if (answer_cache.maxsize > 0 and session.get('semantic_cache', True)
+                    and is_single_turn(session_id, messages)):
+                with timed('answer_cache'):
+                    cache_lookup = lookup_cached_answer(processor, session, messages[-1]['content'])
+                if cache_lookup['hit'] is not None:
+                    return None, cache_lookup['hit']['related_cases'], None, 'cached', cache_lookup
+            retrieval_status = 'ok'
+            with timed('retrieval'):
+                hits = processor.retrieve(
+                    messages[-1]['content'],
+                    law_top_k=law_cases_count,
+                    qa_top_k=qa_cases_count
+                )
+            passages = list(zip(format_hits(hits), [hit['score'] for hit in hits]))
+    
+    # 按相关度装入检索案例，替换最后一条用户消息（只影响本次请求，会话历史中保留原始问题）
+    with timed('prompt_assembly'):
+        full_messages, relevant_cases, context_report = context_builder.build(
+            system_prompt, messages, passages, render_prompt=build_enhanced_prompt
+        )
+    return full_messages, relevant_cases, context_report, retrieval_status, cache_lookup
+
+def log_chat_request(full_messages, relevant_cases, context_report=None):
+    """
+    记录发送给模型的请求：完整内容只在 DEBUG 级别输出，
+    INFO 级别按 LOG_SAMPLE_RATE 采样输出消息条数、案例数和 token 占用
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "发送给Deepseek API的请求内容\n上下文 token 占用: %s\n系统提示词: %s\n用户最新消息: %s\n相关案例: %s\n完整消息列表: %s",
+            context_report,
+            full_messages[0] if full_messages and full_messages[0]['role'] == 'system' else "无",
+            full_messages[-1] if full_messages else "无",
+            relevant_cases,
+            full_messages
+        )
+    elif sampled():
+        logger.info("发送给Deepseek API：%d 条消息，%d 条相关案例，上下文 token 占用 %s",
+                    len(full_messages), len(relevant_cases), context_report.get('total') if context_report else None)
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    request_start = time.perf_counter()
+    spans = start_spans()
+    status = 'error'
+    try:
+        try:
+            data = parse_json_object(request.get_data())
+        except ValueError as e:
+            status = 'invalid'
+            return jsonify({'error': str(e)}), 400
+        session_id = data.get('session_id')
+        messages = data.get('messages', [])
+        deep_thinking = data.get('deep_thinking', False)
         
-        start_time = time.time()
+        if not session_id or session_id not in chat_sessions:
+            status = 'invalid'
+            return jsonify({'error': '无效的会话ID'}), 400
+            
+        is_law_mode = chat_sessions.get_settings(session_id)['is_law_mode']
+        full_messages, relevant_cases, context_report, retrieval_status, cache_lookup = prepare_chat_messages(
+            session_id, messages, deep_thinking
+        )
+        cache_hit = cache_lookup['hit'] if cache_lookup is not None else None
         
         try:
-            # 打印完整的请求内容
-            print("\n=== 发送给Deepseek API的请求内容 ===")
-            print("系统提示词:", full_messages[0] if full_messages and full_messages[0]['role'] == 'system' else "无")
-            print("\n用户最新消息:", messages[-1] if messages else "无")
-            print("\n相关案例:", relevant_cases)
-            print("\n完整消息列表:", full_messages)
-            print("================================\n")
-            
-            response = openai.ChatCompletion.create(
-                model="deepseek-chat",
-                messages=full_messages,
-                stream=False,
-                timeout=60
-            )
-            print(f"API响应时间: {time.time() - start_time}秒")
+            if cache_hit is not None:
+                content = cache_hit['answer']
+            else:
+                log_chat_request(full_messages, relevant_cases, context_report)
+                
+                with timed('llm_call'):
+                    response = openai.ChatCompletion.create(
+                        model="deepseek-chat",
+                        messages=full_messages,
+                        stream=False,
+                        timeout=60
+                    )
+                content = response.choices[0].message.content
+                store_cached_answer(cache_lookup, content, relevant_cases)
             
             assistant_message = {
                 "role": "assistant",
-                "content": response.choices[0].message.content
+                "content": content
             }
-            chat_sessions[session_id]['messages'].append(assistant_message)
+            chat_sessions.append_messages(session_id, [assistant_message])
             
             # 返回响应时包含相关案例
-            return jsonify({
-                "choices": [{
-                    "message": assistant_message
-                }],
-                "related_cases": relevant_cases if is_law_mode else []
-            })
+            with timed('serialization'):
+                result = jsonify({
+                    "choices": [{
+                        "message": assistant_message
+                    }],
+                    "related_cases": relevant_cases if is_law_mode else [],
+                    "retrieval_status": retrieval_status,
+                    "context_tokens": context_report,
+                    "answer_cache": {"similarity": cache_hit['similarity']} if cache_hit is not None else None
+                })
+            status = 'ok'
+            return result
             
         except Exception as e:
-            print(f"API调用错误: {str(e)}")
+            logger.error("API调用错误: %s", e)
             return jsonify({'error': f"API调用失败: {str(e)}"}), 500
             
     except Exception as e:
-        print(f"服务器错误: {str(e)}")
+        logger.exception("服务器错误: %s", e)
         return jsonify({'error': str(e)}), 500
+    finally:
+        record_request('chat', status, request_start, spans)
+
+def sse_event(data, event=None):
+    """格式化一条 server-sent event"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    流式对话：以 SSE 形式先返回相关案例，再逐段转发模型输出
+    事件依次为 related_cases、若干条无事件名的 {"content": ...}、done（或 error）
+    """
+    try:
+        data = parse_json_object(request.get_data())
+    except ValueError as e:
+        REQUESTS_TOTAL.inc(endpoint='chat_stream', status='invalid')
+        return jsonify({'error': str(e)}), 400
+    session_id = data.get('session_id')
+    messages = data.get('messages', [])
+    deep_thinking = data.get('deep_thinking', False)
+    
+    if not session_id or session_id not in chat_sessions:
+        REQUESTS_TOTAL.inc(endpoint='chat_stream', status='invalid')
+        return jsonify({'error': '无效的会话ID'}), 400
+    
+    def generate():
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        # 先发送一条注释，让客户端尽快收到响应头
+        yield ": stream-start\n\n"
+        try:
+            is_law_mode = chat_sessions.get_settings(session_id)['is_law_mode']
+            full_messages, relevant_cases, context_report, retrieval_status, cache_lookup = prepare_chat_messages(
+                session_id, messages, deep_thinking
+            )
+            cache_hit = cache_lookup['hit'] if cache_lookup is not None else None
+            yield sse_event({
+                "related_cases": relevant_cases if is_law_mode else [],
+                "retrieval_status": retrieval_status
+            }, event="related_cases")
+            
+            if cache_hit is not None:
+                # 命中语义答案缓存，整段回答作为一条内容事件返回
+                content_parts = [cache_hit['answer']]
+                yield sse_event({"content": cache_hit['answer']})
+            else:
+                log_chat_request(full_messages, relevant_cases, context_report)
+                with timed('llm_call'):
+                    llm_start = time.perf_counter()
+                    response = openai.ChatCompletion.create(
+                        model="deepseek-chat",
+                        messages=full_messages,
+                        stream=True,
+                        timeout=60
+                    )
+                    
+                    content_parts = []
+                    for chunk in response:
+                        delta = chunk.choices[0].delta.get('content') if chunk.choices else None
+                        if delta:
+                            if not content_parts:
+                                first_token = time.perf_counter() - llm_start
+                                STAGE_SECONDS.observe(first_token, stage='llm_first_token')
+                                spans['llm_first_token'] = first_token
+                            content_parts.append(delta)
+                            yield sse_event({"content": delta})
+                store_cached_answer(cache_lookup, "".join(content_parts), relevant_cases)
+            
+            # 完整回复写入会话历史
+            assistant_message = {
+                "role": "assistant",
+                "content": "".join(content_parts)
+            }
+            chat_sessions.append_messages(session_id, [assistant_message])
+            yield sse_event({
+                "message": assistant_message,
+                "context_tokens": context_report,
+                "answer_cache": {"similarity": cache_hit['similarity']} if cache_hit is not None else None
+            }, event="done")
+            status = 'ok'
+        except Exception as e:
+            logger.error("API调用错误: %s", e)
+            yield sse_event({"error": f"API调用失败: {str(e)}"}, event="error")
+        finally:
+            record_request('chat_stream', status, request_start, spans)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # 关闭 nginx 缓冲，保证逐条推送
+        }
+    )
 
 if __name__ == '__main__':
     # 修改监听地址和端口
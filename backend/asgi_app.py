@@ -0,0 +1,451 @@
+"""
+异步（ASGI）服务入口，提供与 app.py 相同的接口
+会话数据与检索逻辑复用 app.py；模型接口通过带连接池的 httpx.AsyncClient 非阻塞调用，
+检索等 CPU 密集的工作交给有界线程池执行，单个进程即可同时保持大量对话。
+
+启动方式（在 backend/ 目录下）：
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import httpx
+import openai
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from data_processor import peek_data_processor, reload_data_processor, start_warmup, warmup_status
+from metrics import REGISTRY, CONTENT_TYPE, STAGE_SECONDS, REQUESTS_TOTAL, start_spans, timed
+from app import (
+    NDJSON_CONTENT_TYPE,
+    WARMUP_WAIT_SECONDS,
+    chat_sessions,
+    is_admin_request,
+    create_session,
+    update_session_settings,
+    needs_retrieval,
+    prepare_chat_messages,
+    store_cached_answer,
+    answer_cache,
+    log_chat_request,
+    record_request,
+    sse_event,
+    parse_json_object,
+    parse_search_params,
+    parse_search_batch,
+    search_batches,
+    run_search_batch,
+    ndjson_line,
+)
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = "deepseek-chat"
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+# 到模型接口的最大并发连接数
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 100))
+# 检索线程池大小，限制同时进行的嵌入计算和相似度计算
+RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', 4))
+# 在事件循环中等待数据处理器加载完成时查询加载状态的间隔（秒）
+WARMUP_POLL_INTERVAL = 0.05
+
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix='retrieval')
+http_client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    http_client = httpx.AsyncClient(
+        base_url=openai.api_base,
+        headers={"Authorization": f"Bearer {openai.api_key}"},
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS
+        ),
+    )
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        retrieval_executor.shutdown(wait=False)
+
+
+async def run_in_retrieval_pool(func, *args):
+    # 在当前上下文的副本中执行，线程池中记录的阶段耗时计入当前请求
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(retrieval_executor, functools.partial(ctx.run, func, *args))
+
+
+async def wait_for_processor(timeout):
+    """
+    在事件循环中等待数据处理器加载完成，不占用检索线程池
+    尚未开始加载时启动后台预热；超时或加载失败时返回 None
+    """
+    processor = peek_data_processor()
+    if processor is None and warmup_status()['state'] == 'idle':
+        start_warmup()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while processor is None and warmup_status()['state'] == 'loading' and loop.time() < deadline:
+        await asyncio.sleep(WARMUP_POLL_INTERVAL)
+        processor = peek_data_processor()
+    return processor
+
+
+async def prepare_chat(session_id, messages, deep_thinking):
+    """
+    与 prepare_chat_messages 相同
+    等待数据处理器加载在事件循环中进行，只有检索交给线程池；不检索的对话不经过线程池，
+    预热期间法律模式的请求不会占满线程池而阻塞普通对话
+    """
+    if not needs_retrieval(chat_sessions.get_settings(session_id), deep_thinking):
+        return prepare_chat_messages(session_id, messages, deep_thinking)
+    processor = await wait_for_processor(WARMUP_WAIT_SECONDS)
+    return await run_in_retrieval_pool(prepare_chat_messages, session_id, messages, deep_thinking, lambda: processor)
+
+
+async def create_chat_completion(full_messages):
+    """非阻塞调用模型接口，返回回复内容"""
+    response = await http_client.post("/chat/completions", json={
+        "model": LLM_MODEL,
+        "messages": full_messages,
+        "stream": False,
+    })
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+
+async def stream_chat_completion(full_messages):
+    """非阻塞流式调用模型接口，逐段产出回复内容"""
+    async with http_client.stream("POST", "/chat/completions", json={
+        "model": LLM_MODEL,
+        "messages": full_messages,
+        "stream": True,
+    }) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+
+async def home(request):
+    return PlainTextResponse("Chat API is running!")
+
+
+async def ready(request):
+    status = warmup_status()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+
+async def cache_stats(request):
+    processor = peek_data_processor()
+    if processor is None:
+        return JSONResponse(warmup_status(), status_code=503)
+    return JSONResponse({**processor.cache_stats(), 'semantic_answer': answer_cache.stats()})
+
+
+async def metrics(request):
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+async def reload_corpus(request):
+    if not is_admin_request(request):
+        return JSONResponse({'error': '无权限'}, status_code=403)
+    try:
+        start_time = time.time()
+        processor = await run_in_retrieval_pool(reload_data_processor)
+        return JSONResponse({
+            "status": "success",
+            "corpus_version": processor.corpus_version,
+            "law_count": len(processor.law_data_index),
+            "qa_count": len(processor.law_qa_index),
+            "elapsed": time.time() - start_time
+        })
+    except Exception as e:
+        logger.exception("语料更新失败: %s", e)
+        return JSONResponse({'error': f"语料更新失败: {str(e)}"}, status_code=500)
+
+
+async def search(request):
+    """与 app.py 中的 /search 相同"""
+    request_start = time.perf_counter()
+    spans = start_spans()
+    status = 'error'
+    try:
+        try:
+            data = parse_json_object(await request.body())
+            query = data.get('query')
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError("query 不能为空")
+            params = parse_search_params(data)
+        except (TypeError, ValueError) as e:
+            status = 'invalid'
+            return JSONResponse({'error': str(e)}, status_code=400)
+        processor = peek_data_processor()
+        if processor is None:
+            status = 'unavailable'
+            return JSONResponse(warmup_status(), status_code=503)
+
+        def retrieve():
+            with timed('retrieval'):
+                return processor.retrieve(query, **params)
+
+        hits = await run_in_retrieval_pool(retrieve)
+        status = 'ok'
+        return JSONResponse({'query': query, 'hits': hits})
+    except Exception as e:
+        logger.exception("检索失败: %s", e)
+        return JSONResponse({'error': str(e)}, status_code=500)
+    finally:
+        record_request('search', status, request_start, spans)
+
+
+async def search_batch(request):
+    """与 app.py 中的 /search/batch 相同；NDJSON 模式下每批查询在检索线程池中计算，算完一批输出一批"""
+    try:
+        data = parse_json_object(await request.body())
+        queries, offset, limit, params, ndjson = parse_search_batch(data, request.headers.get('accept'))
+    except (TypeError, ValueError) as e:
+        REQUESTS_TOTAL.inc(endpoint='search_batch', status='invalid')
+        return JSONResponse({'error': str(e)}, status_code=400)
+    processor = peek_data_processor()
+    if processor is None:
+        REQUESTS_TOTAL.inc(endpoint='search_batch', status='unavailable')
+        return JSONResponse(warmup_status(), status_code=503)
+
+    if not ndjson:
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        try:
+            results = []
+            for begin, batch in search_batches(queries, offset, offset + limit):
+                results.extend(await run_in_retrieval_pool(run_search_batch, processor, begin, batch, params))
+            next_offset = offset + limit if offset + limit < len(queries) else None
+            status = 'ok'
+            return JSONResponse({'results': results, 'offset': offset, 'next_offset': next_offset, 'total': len(queries)})
+        except Exception as e:
+            logger.exception("批量检索失败: %s", e)
+            return JSONResponse({'error': str(e)}, status_code=500)
+        finally:
+            record_request('search_batch', status, request_start, spans)
+
+    async def generate():
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        try:
+            for begin, batch in search_batches(queries, offset):
+                for record in await run_in_retrieval_pool(run_search_batch, processor, begin, batch, params):
+                    yield ndjson_line(record)
+            status = 'ok'
+        except Exception as e:
+            logger.exception("批量检索失败: %s", e)
+            yield ndjson_line({'error': str(e)})
+        finally:
+            record_request('search_batch', status, request_start, spans)
+
+    return StreamingResponse(generate(), media_type=NDJSON_CONTENT_TYPE, headers={'X-Accel-Buffering': 'no'})
+
+
+async def start_session(request):
+    return JSONResponse({"session_id": create_session()})
+
+
+async def set_system_prompt(request):
+    try:
+        try:
+            data = parse_json_object(await request.body())
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        session_id = data.get('session_id')
+
+        if not session_id or session_id not in chat_sessions:
+            return JSONResponse({'error': '无效的会话ID'}, status_code=400)
+
+        update_session_settings(session_id, data)
+        return JSONResponse({"status": "success"})
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def chat(request):
+    request_start = time.perf_counter()
+    spans = start_spans()
+    status = 'error'
+    try:
+        try:
+            data = parse_json_object(await request.body())
+        except ValueError as e:
+            status = 'invalid'
+            return JSONResponse({'error': str(e)}, status_code=400)
+        session_id = data.get('session_id')
+        messages = data.get('messages', [])
+        deep_thinking = data.get('deep_thinking', False)
+
+        if not session_id or session_id not in chat_sessions:
+            status = 'invalid'
+            return JSONResponse({'error': '无效的会话ID'}, status_code=400)
+
+        is_law_mode = chat_sessions.get_settings(session_id)['is_law_mode']
+        full_messages, relevant_cases, context_report, retrieval_status, cache_lookup = await prepare_chat(
+            session_id, messages, deep_thinking
+        )
+        cache_hit = cache_lookup['hit'] if cache_lookup is not None else None
+
+        try:
+            if cache_hit is not None:
+                content = cache_hit['answer']
+            else:
+                log_chat_request(full_messages, relevant_cases, context_report)
+                with timed('llm_call'):
+                    content = await create_chat_completion(full_messages)
+                store_cached_answer(cache_lookup, content, relevant_cases)
+
+            assistant_message = {
+                "role": "assistant",
+                "content": content
+            }
+            chat_sessions.append_messages(session_id, [assistant_message])
+
+            with timed('serialization'):
+                result = JSONResponse({
+                    "choices": [{
+                        "message": assistant_message
+                    }],
+                    "related_cases": relevant_cases if is_law_mode else [],
+                    "retrieval_status": retrieval_status,
+                    "context_tokens": context_report,
+                    "answer_cache": {"similarity": cache_hit['similarity']} if cache_hit is not None else None
+                })
+            status = 'ok'
+            return result
+
+        except Exception as e:
+            logger.error("API调用错误: %s", e)
+            return JSONResponse({'error': f"API调用失败: {str(e)}"}, status_code=500)
+
+    except Exception as e:
+        logger.exception("服务器错误: %s", e)
+        return JSONResponse({'error': str(e)}, status_code=500)
+    finally:
+        record_request('chat', status, request_start, spans)
+
+
+async def chat_stream(request):
+    """与 app.py 中的 /chat/stream 相同的 SSE 事件格式"""
+    try:
+        data = parse_json_object(await request.body())
+    except ValueError as e:
+        REQUESTS_TOTAL.inc(endpoint='chat_stream', status='invalid')
+        return JSONResponse({'error': str(e)}, status_code=400)
+    session_id = data.get('session_id')
+    messages = data.get('messages', [])
+    deep_thinking = data.get('deep_thinking', False)
+
+    if not session_id or session_id not in chat_sessions:
+        REQUESTS_TOTAL.inc(endpoint='chat_stream', status='invalid')
+        return JSONResponse({'error': '无效的会话ID'}, status_code=400)
+
+    async def generate():
+        request_start = time.perf_counter()
+        spans = start_spans()
+        status = 'error'
+        yield ": stream-start\n\n"
+        try:
+            is_law_mode = chat_sessions.get_settings(session_id)['is_law_mode']
+            full_messages, relevant_cases, context_report, retrieval_status, cache_lookup = await prepare_chat(
+                session_id, messages, deep_thinking
+            )
+            cache_hit = cache_lookup['hit'] if cache_lookup is not None else None
+            yield sse_event({
+                "related_cases": relevant_cases if is_law_mode else [],
+                "retrieval_status": retrieval_status
+            }, event="related_cases")
+
+            if cache_hit is not None:
+                content_parts = [cache_hit['answer']]
+                yield sse_event({"content": cache_hit['answer']})
+            else:
+                log_chat_request(full_messages, relevant_cases, context_report)
+                with timed('llm_call'):
+                    llm_start = time.perf_counter()
+                    content_parts = []
+                    async for delta in stream_chat_completion(full_messages):
+                        if not content_parts:
+                            first_token = time.perf_counter() - llm_start
+                            STAGE_SECONDS.observe(first_token, stage='llm_first_token')
+                            spans['llm_first_token'] = first_token
+                        content_parts.append(delta)
+                        yield sse_event({"content": delta})
+                store_cached_answer(cache_lookup, "".join(content_parts), relevant_cases)
+
+            assistant_message = {
+                "role": "assistant",
+                "content": "".join(content_parts)
+            }
+            chat_sessions.append_messages(session_id, [assistant_message])
+            yield sse_event({
+                "message": assistant_message,
+                "context_tokens": context_report,
+                "answer_cache": {"similarity": cache_hit['similarity']} if cache_hit is not None else None
+            }, event="done")
+            status = 'ok'
+        except Exception as e:
+            logger.error("API调用错误: %s", e)
+            yield sse_event({"error": f"API调用失败: {str(e)}"}, event="error")
+        finally:
+            record_request('chat_stream', status, request_start, spans)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+
+app = Starlette(
+    routes=[
+        Route('/', home),
+        Route('/ready', ready),
+        Route('/cache-stats', cache_stats),
+        Route('/metrics', metrics),
+        Route('/admin/reload-corpus', reload_corpus, methods=['POST']),
+        Route('/search', search, methods=['POST']),
+        Route('/search/batch', search_batch, methods=['POST']),
+        Route('/start-session', start_session, methods=['POST']),
+        Route('/set-system-prompt', set_system_prompt, methods=['POST']),
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware, allow_origin_regex='.*', allow_credentials=True,
+            allow_methods=['*'], allow_headers=['*']
+        ),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,343 @@
+# benchmark.py
+"""
+离线检索基准测试
+在不同规模的语料上测量 find_relevant_cases 和向量检索的延迟分位数、批量嵌入吞吐量，
+近似索引（ivf）相对精确检索的 recall@k，以及量化存储（int8 / pq）的内存占用和召回损失。默认使用确定性的本地嵌入（HashingEmbedding），
+无需下载模型；--backend modelscope 时使用真实的 CoROM 模型。
+语料以 backend 目录下的 law_data_3k.csv / law_QA.csv 为基础按倍数扩充，文件不存在时使用合成语料。
+
+用法：
+    python benchmark.py
+    python benchmark.py --sizes 3000,30000,100000 --index ivf --nprobe 1,4,16 --json report.json
+    python benchmark.py --quantization float16,int8,pq --rerank 0,50
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from cache import ResultCache
+from data_processor import DataProcessor, embed_in_batches
+from embedding_backends import load_text_embedding, embed_sentences
+from embedding_store import EmbeddingStore, SOURCE_LAW, SOURCE_QA
+from log_utils import configure_logging
+from vector_index import FlatIndex, RerankIndex
+
+SYNTHETIC_TERMS = [
+    '劳动合同', '解除', '经济补偿', '用人单位', '劳动者', '工资', '试用期', '违约金', '房屋租赁', '离婚',
+    '抚养权', '继承', '遗嘱', '交通事故', '保险', '借款', '利息', '侵权', '赔偿', '竞业限制',
+]
+CHINESE_NUMERALS = '零一二三四五六七八九'
+
+
+def article_number(number):
+    """把 1~999 转为中文条文编号，如 23 -> 二十三"""
+    hundreds, tens, ones = number // 100, number // 10 % 10, number % 10
+    text = f"{CHINESE_NUMERALS[hundreds]}百" if hundreds else ''
+    if tens:
+        text += f"{CHINESE_NUMERALS[tens] if tens > 1 or hundreds else ''}十"
+    elif hundreds and ones:
+        text += '零'
+    return text + (CHINESE_NUMERALS[ones] if ones else '')
+
+
+def synthetic_corpus(law_count=3000, qa_count=1000, seed=0):
+    """生成合成的法条和问答语料"""
+    rng = random.Random(seed)
+
+    def sentence(words):
+        return ''.join(rng.choice(SYNTHETIC_TERMS) for _ in range(words)) + '。'
+
+    laws = [
+        f"第{article_number(i % 999 + 1)}条 " + ''.join(sentence(rng.randint(3, 8)) for _ in range(rng.randint(1, 4)))
+        for i in range(law_count)
+    ]
+    qas = [f"问：{sentence(rng.randint(2, 5))}答：{sentence(rng.randint(6, 14))}" for _ in range(qa_count)]
+    return laws, qas
+
+
+def load_base_corpus():
+    """读取 backend 目录下的语料，不存在时返回合成语料"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    law_path = os.path.join(current_dir, 'law_data_3k.csv')
+    qa_path = os.path.join(current_dir, 'law_QA.csv')
+    if os.path.exists(law_path) and os.path.exists(qa_path):
+        return (pd.read_csv(law_path)['data'].astype(str).tolist(),
+                pd.read_csv(qa_path)['data'].astype(str).tolist())
+    return synthetic_corpus()
+
+
+def scale_corpus(texts, size, seed=0):
+    """
+    将语料扩充（或截取）到 size 行
+    扩充的副本打乱句子顺序并加上编号，内容不完全重复，嵌入向量也不完全相同
+    """
+    if size <= len(texts):
+        return list(texts[:size])
+    rng = random.Random(seed)
+    scaled = list(texts)
+    copy = 1
+    while len(scaled) < size:
+        for text in texts[:size - len(scaled)]:
+            sentences = [part for part in text.split('。') if part]
+            rng.shuffle(sentences)
+            scaled.append('。'.join(sentences) + f'。（{copy}）')
+        copy += 1
+    return scaled
+
+
+def sample_queries(texts, count, seed=0):
+    """从语料中截取片段作为查询，模拟用户的提问"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        text = rng.choice(texts)
+        length = min(len(text), rng.randint(8, 24))
+        start = rng.randint(0, len(text) - length)
+        queries.append(text[start:start + length])
+    return queries
+
+
+def percentiles(samples):
+    """延迟样本（秒）的分位数，单位为毫秒"""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(samples)),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+    }
+
+
+def measure(fn, inputs, warmup=3):
+    """依次调用 fn(x)，返回每次调用的耗时（秒）"""
+    for item in inputs[:warmup]:
+        fn(item)
+    timings = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def embedding_throughput(processor, texts, batch_sizes):
+    """不同批大小下批量计算嵌入的吞吐量（句/秒）"""
+    results = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        processor.compute_embeddings(texts, batch_size=batch_size, desc=f"批大小 {batch_size}")
+        elapsed = time.perf_counter() - start
+        results[str(batch_size)] = {'sentences_per_second': len(texts) / elapsed if elapsed else float('inf')}
+    return results
+
+
+def embedding_latency(text_embedding, texts, batch_sizes):
+    """
+    单条查询计算嵌入的延迟分位数，以及不同批大小下的吞吐量（句/秒），
+    不经过 DataProcessor，用于比较不同嵌入后端本身的 CPU 推理速度
+    """
+    embed_texts = lambda batch: embed_sentences(text_embedding, batch)
+    throughput = {}
+    for batch_size in batch_sizes:
+        embed_texts(texts[:batch_size])
+        start = time.perf_counter()
+        embed_in_batches(embed_texts, texts, batch_size)
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = {'sentences_per_second': len(texts) / elapsed if elapsed else float('inf')}
+    return {
+        'query_latency': percentiles(measure(lambda text: embed_texts([text]), texts)),
+        'throughput': throughput,
+    }
+
+
+def exact_law_results(processor, query_embeddings, top_k):
+    """全精度向量上精确检索的法条结果，作为 recall 的基准"""
+    exact = FlatIndex(processor.load_embeddings('law_data_embeddings.npy'))
+    return [set(exact.search(query, top_k)[1].tolist()) for query in query_embeddings]
+
+
+def measure_recall(search, query_embeddings, expected, top_k):
+    """search(query, top_k) 相对 expected 的 recall@k 和检索延迟"""
+    hits = 0
+    timings = []
+    for query, truth in zip(query_embeddings, expected):
+        start = time.perf_counter()
+        _, indices = search(query, top_k)
+        timings.append(time.perf_counter() - start)
+        hits += len(truth & set(indices.tolist()))
+    total = sum(len(truth) for truth in expected)
+    return {'recall': hits / total if total else 1.0, 'latency': percentiles(timings)}
+
+
+def index_recall(processor, query_embeddings, top_k, nprobes):
+    """法条索引在不同 nprobe 下相对精确检索的 recall@k 和检索延迟"""
+    expected = exact_law_results(processor, query_embeddings, top_k)
+    return {
+        str(nprobe): measure_recall(
+            lambda query, k: processor.law_data_index.search(query, k, nprobe=nprobe), query_embeddings, expected, top_k
+        )
+        for nprobe in nprobes
+    }
+
+
+def quantization_report(processor, query_embeddings, top_k, dtypes, rerank_depths=(0,)):
+    """
+    不同存储精度下法条向量的内存占用，以及精确扫描相对全精度结果的 recall@k 和延迟
+    :param rerank_depths: 量化存储用全精度向量重排的候选数，0 表示不重排
+    """
+    full = processor.load_embeddings('law_data_embeddings.npy', mmap=True)
+    expected = exact_law_results(processor, query_embeddings, top_k)
+    baseline_bytes = full.shape[0] * full.shape[1] * 4
+    results = {}
+    for dtype in dtypes:
+        start = time.perf_counter()
+        store = EmbeddingStore.build({SOURCE_LAW: full, SOURCE_QA: full[:0]}, dtype=dtype)
+        build_seconds = time.perf_counter() - start
+        index = FlatIndex(store.segment(SOURCE_LAW), normalized=True)
+        for depth in rerank_depths if store.quantized else (0,):
+            searcher = RerankIndex(index, full, depth) if depth else index
+            result = measure_recall(searcher.search, query_embeddings, expected, top_k)
+            result.update({
+                'bytes': store.vectors.nbytes,
+                'compression': baseline_bytes / store.vectors.nbytes if store.vectors.nbytes else 1.0,
+                'build_seconds': build_seconds,
+            })
+            results[f"{dtype}+rerank{depth}" if depth else dtype] = result
+    return results
+
+
+def benchmark_size(size, base_law, base_qa, text_embedding, queries=200, top_k=3, index_type='flat',
+                   nprobes=(1, 4, 16), retrieval_mode='dense', batch_sizes=(1, 8, 32), work_dir=None,
+                   quantizations=(), rerank_depths=(0,)):
+    """
+    在 size 行法条（问答按相同比例扩充）的语料上运行一次基准测试
+    :return: 该规模的测量结果字典
+    """
+    qa_size = max(1, round(size * len(base_qa) / max(1, len(base_law))))
+    law_texts = scale_corpus(base_law, size)
+    qa_texts = scale_corpus(base_qa, qa_size)
+    data_dir = tempfile.mkdtemp(prefix=f'benchmark-{size}-', dir=work_dir)
+    try:
+        pd.DataFrame({'data': law_texts}).to_csv(os.path.join(data_dir, 'law_data_3k.csv'), index=False)
+        pd.DataFrame({'data': qa_texts}).to_csv(os.path.join(data_dir, 'law_QA.csv'), index=False)
+
+        start = time.perf_counter()
+        processor = DataProcessor(
+            index_type=index_type, text_embedding=text_embedding, retrieval_mode=retrieval_mode,
+            query_cache_size=0, data_dir=data_dir
+        )
+        build_seconds = time.perf_counter() - start
+        # 关闭检索结果缓存，测量的是完整的检索路径
+        processor.result_cache = ResultCache(maxsize=0, version=processor.corpus_version)
+
+        query_texts = sample_queries(law_texts + qa_texts, queries)
+        query_embeddings = processor.embed_texts(query_texts)
+        sequential = measure(lambda query: processor.find_relevant_cases(query, top_k, top_k), query_texts)
+        start = time.perf_counter()
+        processor.retrieve_batch(query_texts, top_k, top_k)
+        batch_seconds = time.perf_counter() - start
+        result = {
+            'law_rows': len(law_texts),
+            'qa_rows': len(qa_texts),
+            'chunks': len(processor.chunks[SOURCE_LAW]) + len(processor.chunks[SOURCE_QA]),
+            'build_seconds': build_seconds,
+            'find_relevant_cases': percentiles(sequential),
+            # 逐条检索与一次批量检索全部查询的吞吐量
+            'batch_retrieval': {
+                'queries': len(query_texts),
+                'sequential_qps': len(sequential) / max(sum(sequential), 1e-9),
+                'batch_qps': len(query_texts) / max(batch_seconds, 1e-9),
+            },
+            'vector_search': percentiles(measure(
+                lambda query: processor.law_data_index.search(query, top_k), list(query_embeddings)
+            )),
+        }
+        if batch_sizes:
+            result['embedding_throughput'] = embedding_throughput(processor, law_texts[:512], batch_sizes)
+        if index_type != 'flat':
+            result['recall'] = index_recall(processor, query_embeddings, top_k, nprobes)
+        if quantizations:
+            result['quantization'] = quantization_report(
+                processor, query_embeddings, top_k, quantizations, rerank_depths
+            )
+        return result
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def run_benchmark(sizes, backend='stub', **kwargs):
+    """对每个语料规模运行基准测试，返回 {规模: 结果}"""
+    base_law, base_qa = load_base_corpus()
+    text_embedding = load_text_embedding(backend)
+    return {str(size): benchmark_size(size, base_law, base_qa, text_embedding, **kwargs) for size in sizes}
+
+
+def format_report(report):
+    """将测量结果格式化为便于阅读的文本"""
+    lines = []
+    for size, result in report.items():
+        lines.append(f"== 法条 {result['law_rows']} 行 / 问答 {result['qa_rows']} 行 / 共 {result['chunks']} 块，"
+                     f"构建耗时 {result['build_seconds']:.1f}s")
+        for name in ('find_relevant_cases', 'vector_search'):
+            stats = result[name]
+            lines.append(f"  {name:<20} p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  "
+                         f"p99 {stats['p99_ms']:8.3f} ms")
+        batch = result['batch_retrieval']
+        lines.append(f"  批量检索 {batch['queries']} 条  逐条 {batch['sequential_qps']:10.1f} 条/秒  "
+                     f"批量 {batch['batch_qps']:10.1f} 条/秒")
+        for batch_size, stats in result.get('embedding_throughput', {}).items():
+            lines.append(f"  嵌入吞吐 batch={batch_size:<4} {stats['sentences_per_second']:10.1f} 句/秒")
+        for nprobe, stats in result.get('recall', {}).items():
+            lines.append(f"  nprobe={nprobe:<4} recall@k {stats['recall']:.3f}  p50 {stats['latency']['p50_ms']:.3f} ms")
+        for name, stats in result.get('quantization', {}).items():
+            lines.append(f"  {name:<16} {stats['bytes'] / 1024 / 1024:8.2f} MB（{stats['compression']:5.1f}x）"
+                         f"  recall@k {stats['recall']:.3f}  p50 {stats['latency']['p50_ms']:.3f} ms")
+    return "\n".join(lines)
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description="离线检索基准测试")
+    parser.add_argument('--sizes', default='3000,30000', help="法条行数，逗号分隔")
+    parser.add_argument('--queries', type=int, default=200, help="每个规模的查询数量")
+    parser.add_argument('--top-k', type=int, default=3, help="检索数量，同时用于 recall@k")
+    parser.add_argument('--index', default='ivf', help="向量索引类型 flat / ivf")
+    parser.add_argument('--nprobe', default='1,4,16', help="测量 recall 的 nprobe，逗号分隔")
+    parser.add_argument('--mode', default='dense', help="检索方式 dense / hybrid")
+    parser.add_argument('--batch-sizes', default='1,8,32', help="测量嵌入吞吐量的批大小，逗号分隔，为空时跳过")
+    parser.add_argument('--quantization', default='float16,int8,pq',
+                        help="测量内存占用和召回损失的存储精度，逗号分隔，为空时跳过")
+    parser.add_argument('--rerank', default='0,50', help="量化存储用全精度向量重排的候选数，逗号分隔")
+    parser.add_argument('--backend', default='stub', help="嵌入后端 stub / modelscope / onnx / torchscript")
+    parser.add_argument('--json', default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        [int(size) for size in args.sizes.split(',')],
+        backend=args.backend,
+        queries=args.queries,
+        top_k=args.top_k,
+        index_type=args.index,
+        nprobes=[int(value) for value in args.nprobe.split(',')],
+        retrieval_mode=args.mode,
+        batch_sizes=[int(value) for value in args.batch_sizes.split(',') if value],
+        quantizations=[value for value in args.quantization.split(',') if value],
+        rerank_depths=[int(value) for value in args.rerank.split(',') if value],
+    )
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# build_index.py
+"""
+离线构建嵌入向量和索引
+语料块按 --shard-rows 切分为分片，由进程池中的工作进程（各自加载一份嵌入模型）并行计算，
+每个分片算完即保存为检查点；中断后重新运行时已完成的分片直接读取检查点。
+所有文件先在暂存目录中构建（未修改的块复用当前已发布的向量），完成后原子发布：
+embeddings/ 是指向 embeddings-builds/ 下某个版本目录的符号链接，发布时替换该链接，
+服务进程看到的要么是旧版本、要么是完整的新版本。
+embeddings/ 是服务端生成的普通目录时不能原子地替换为链接，须先停止服务运行一次 --migrate-legacy。
+
+用法：
+    python build_index.py
+    python build_index.py --workers 4 --shard-rows 4096
+    python build_index.py --full --reload-url http://localhost:5000/admin/reload-corpus
+    python build_index.py --migrate-legacy
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+from dotenv import load_dotenv
+from corpus_manifest import MANIFEST_FILENAME
+from data_processor import DataProcessor, embed_in_batches
+from embedding_backends import load_text_embedding, embedding_model_id, embed_sentences
+from file_utils import atomic_save_npy
+from ingest import notify_reload
+from log_utils import configure_logging
+from sharded_index import default_start_method
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# 每个分片的语料块数
+DEFAULT_SHARD_ROWS = 2048
+# 发布后保留的版本数（包括当前版本），便于回滚
+DEFAULT_KEEP_VERSIONS = 2
+VERSION_PREFIX = 'v-'
+
+# 工作进程中加载的嵌入模型
+_worker_embedding = None
+
+
+def _init_worker(backend, threads):
+    global _worker_embedding
+    if threads:
+        # 须在导入 torch 之前设置，避免多个工作进程各自占满全部 CPU 核；
+        # onnxruntime 不读取 OMP / MKL 的设置，导出模型的线程数由 EMBEDDING_THREADS 指定
+        os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+        os.environ.setdefault('MKL_NUM_THREADS', str(threads))
+        os.environ.setdefault('EMBEDDING_THREADS', str(threads))
+    _worker_embedding = load_text_embedding(backend)
+
+
+def _worker_model_id():
+    return embedding_model_id(_worker_embedding)
+
+
+def _embed_shard(texts, batch_size):
+    return embed_in_batches(lambda batch: embed_sentences(_worker_embedding, batch), texts, batch_size)
+
+
+def shard_key(model_id, texts):
+    """分片的检查点文件名：由模型标识和分片内每一块的文本决定，语料或模型变化后不会误用旧检查点"""
+    digest = hashlib.blake2b(model_id.encode('utf-8'), digest_size=16)
+    for text in texts:
+        encoded = text.encode('utf-8')
+        digest.update(len(encoded).to_bytes(8, 'little'))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ParallelEmbeddingBuilder:
+    """
+    在进程池中分片计算嵌入向量，每个分片完成后保存检查点
+    作为 DataProcessor 的 embedding_builder 使用；调用方式与 modelscope pipeline 相同时也可计算少量文本的嵌入。
+    """
+
+    def __init__(self, checkpoint_dir, workers=1, shard_rows=DEFAULT_SHARD_ROWS, backend=None, start_method=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.shard_rows = max(1, int(shard_rows))
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        workers = max(1, int(workers))
+        context = multiprocessing.get_context(start_method or default_start_method())
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(backend, max(1, (os.cpu_count() or 1) // workers))
+        )
+        self.model_id = self.executor.submit(_worker_model_id).result()
+        self.computed_shards = 0
+
+    def __call__(self, inputs):
+        sentences = inputs['source_sentence'] if isinstance(inputs, dict) else [inputs]
+        return {'text_embedding': self.executor.submit(_embed_shard, [str(text) for text in sentences], len(sentences)).result()}
+
+    def checkpoint_path(self, texts):
+        return os.path.join(self.checkpoint_dir, f'{shard_key(self.model_id, texts)}.npy')
+
+    def build(self, texts, batch_size=32, desc="计算嵌入"):
+        """
+        计算 texts 的嵌入向量，已有检查点的分片直接读取
+        :return: 形状为 (len(texts), dim) 的 float32 矩阵，行顺序与 texts 一致
+        """
+        texts = [str(text) for text in texts]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        shards = [texts[start:start + self.shard_rows] for start in range(0, len(texts), self.shard_rows)]
+        results = {}
+        futures = {}
+        for number, shard in enumerate(shards):
+            path = self.checkpoint_path(shard)
+            if os.path.exists(path):
+                results[number] = np.load(path)
+            else:
+                futures[self.executor.submit(_embed_shard, shard, max(1, int(batch_size or 32)))] = number
+        logger.info("%s：%d 个分片，已有检查点 %d 个，待计算 %d 个", desc, len(shards), len(results), len(futures))
+
+        start_time = time.perf_counter()
+        done_rows = 0
+        for future in as_completed(futures):
+            number = futures[future]
+            results[number] = future.result()
+            atomic_save_npy(self.checkpoint_path(shards[number]), results[number])
+            self.computed_shards += 1
+            done_rows += len(shards[number])
+            logger.info("%s：分片 %d 完成，进度 %d/%d，%.1f 条/秒", desc, number, len(results), len(shards),
+                        done_rows / max(time.perf_counter() - start_time, 1e-9))
+        return np.concatenate([results[number] for number in range(len(shards))])
+
+    def clear_checkpoints(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def link_or_copy(source, target):
+    """硬链接已发布的文件到暂存目录；所有写入都是先写临时文件再替换，不会改动已发布的文件"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def seed_staging(current_dir, staging_dir, full=False):
+    """以当前已发布的文件初始化暂存目录，full 时不复用已有的嵌入向量"""
+    os.makedirs(staging_dir)
+    if not os.path.isdir(current_dir):
+        return
+    for name in os.listdir(current_dir):
+        source = os.path.join(current_dir, name)
+        if not os.path.isfile(source) or '.tmp.' in name:
+            continue
+        if full and (name.endswith('_embeddings.npy') or name == MANIFEST_FILENAME):
+            continue
+        link_or_copy(source, os.path.join(staging_dir, name))
+
+
+def new_version_path(builds_dir, label):
+    """版本目录路径，按时间命名"""
+    base = os.path.join(builds_dir, f"{VERSION_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{label}")
+    path, suffix = base, 1
+    while os.path.exists(path):
+        path, suffix = f"{base}-{suffix}", suffix + 1
+    return path
+
+
+def supports_symlinks(directory):
+    """directory 所在的文件系统能否创建符号链接"""
+    os.makedirs(directory, exist_ok=True)
+    probe = os.path.join(directory, f'.symlink-probe.{os.getpid()}')
+    try:
+        os.symlink('.', probe, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        return False
+    os.remove(probe)
+    return True
+
+
+def check_layout(embeddings_dir, builds_dir):
+    """
+    embeddings 是服务端生成的普通目录时，目录不能原子地替换为符号链接（两次改名之间 embeddings 不存在），
+    拒绝发布并提示先停止服务迁移一次；不支持符号链接的系统上普通目录即正常布局
+    """
+    if os.path.isdir(embeddings_dir) and not os.path.islink(embeddings_dir) and supports_symlinks(builds_dir):
+        data_dir = os.path.dirname(os.path.abspath(embeddings_dir))
+        raise RuntimeError(
+            f"{embeddings_dir} 是普通目录，无法原子地切换为版本链接。"
+            f"请先停止服务，运行一次 python build_index.py --migrate-legacy --data-dir {data_dir}，再重新构建"
+        )
+
+
+def migrate_legacy_layout(embeddings_dir, builds_dir):
+    """
+    把普通目录 embeddings 移入 builds_dir 作为一个版本，并把 embeddings 改为指向它的符号链接
+    移动目录和创建链接之间 embeddings 短暂不存在，须在服务停止时运行
+    :return: 版本目录，embeddings 已经是链接时返回 None
+    """
+    if os.path.islink(embeddings_dir) or not os.path.isdir(embeddings_dir):
+        return None
+    os.makedirs(builds_dir, exist_ok=True)
+    version_dir = new_version_path(builds_dir, 'legacy')
+    os.replace(embeddings_dir, version_dir)
+    os.symlink(os.path.relpath(version_dir, os.path.dirname(embeddings_dir)), embeddings_dir, target_is_directory=True)
+    return version_dir
+
+
+def publish(staging_dir, embeddings_dir, builds_dir, keep=DEFAULT_KEEP_VERSIONS):
+    """
+    把构建好的暂存目录发布为当前版本
+    暂存目录先改名为版本目录，再用 os.replace 把 embeddings 符号链接原子地指向它。
+    embeddings 是普通目录时拒绝发布（见 check_layout）；不支持符号链接时逐个替换文件（清单最后替换）。
+    :return: 新版本目录
+    """
+    check_layout(embeddings_dir, builds_dir)
+    version_dir = new_version_path(builds_dir, os.getpid())
+    os.replace(staging_dir, version_dir)
+    tmp_link = f"{embeddings_dir}.tmp.{os.getpid()}"
+    try:
+        os.symlink(os.path.relpath(version_dir, os.path.dirname(embeddings_dir)), tmp_link, target_is_directory=True)
+    except (OSError, NotImplementedError) as e:
+        logger.warning("无法创建符号链接（%s），改为逐个替换文件发布", e)
+        os.makedirs(embeddings_dir, exist_ok=True)
+        names = sorted(os.listdir(version_dir), key=lambda name: name == MANIFEST_FILENAME)
+        for name in names:
+            os.replace(os.path.join(version_dir, name), os.path.join(embeddings_dir, name))
+        shutil.rmtree(version_dir, ignore_errors=True)
+        return embeddings_dir
+    os.replace(tmp_link, embeddings_dir)
+    remove_old_versions(builds_dir, version_dir, keep)
+    return version_dir
+
+
+def remove_old_versions(builds_dir, current_dir, keep):
+    """只保留最近的 keep 个版本；已被服务进程 mmap 的旧文件删除后仍可继续读取"""
+    versions = sorted(
+        (os.path.join(builds_dir, name) for name in os.listdir(builds_dir) if name.startswith(VERSION_PREFIX)),
+        key=os.path.getmtime, reverse=True
+    )
+    old = [path for path in versions if path != current_dir][max(0, keep - 1):]
+    for path in old:
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info("删除旧版本: %s", os.path.basename(path))
+
+
+def build(data_dir=None, workers=1, shard_rows=DEFAULT_SHARD_ROWS, batch_size=None, full=False,
+          backend=None, keep_versions=DEFAULT_KEEP_VERSIONS, start_method=None):
+    """
+    构建并发布嵌入向量、存储、索引和文本列，检索配置（存储精度、索引类型、切分参数等）与服务端相同，读取环境变量
+    :return: {'version_dir': 新版本目录, 'corpus_version': 语料版本号, 'computed_shards': 本次计算的分片数}
+    """
+    data_dir = data_dir or os.path.dirname(os.path.abspath(__file__))
+    embeddings_dir = os.path.join(data_dir, 'embeddings')
+    builds_dir = os.path.join(data_dir, 'embeddings-builds')
+    staging_dir = os.path.join(builds_dir, f'staging.{os.getpid()}')
+    # 计算之前检查目录布局，避免构建完成后才发现无法发布
+    check_layout(embeddings_dir, builds_dir)
+    builder = ParallelEmbeddingBuilder(
+        os.path.join(builds_dir, 'checkpoints'), workers=workers, shard_rows=shard_rows,
+        backend=backend, start_method=start_method
+    )
+    try:
+        seed_staging(embeddings_dir, staging_dir, full=full)
+        # 构造时在暂存目录中完成增量同步、存储和索引的构建，不启动分片检索进程池
+        processor = DataProcessor(
+            batch_size=batch_size, data_dir=data_dir, embeddings_dir=staging_dir, text_embedding=builder,
+            embedding_builder=builder.build, search_shards=1
+        )
+        corpus_version = processor.corpus_version
+        processor.close()
+    except BaseException:
+        # 保留检查点，重新运行时从已完成的分片继续
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        builder.close()
+        raise
+    builder.close()
+    version_dir = publish(staging_dir, embeddings_dir, builds_dir, keep=keep_versions)
+    builder.clear_checkpoints()
+    logger.info("已发布 %s，本次计算 %d 个分片，语料版本：%s", version_dir, builder.computed_shards, corpus_version)
+    return {'version_dir': version_dir, 'corpus_version': corpus_version, 'computed_shards': builder.computed_shards}
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description="离线并行构建嵌入向量和索引，支持断点续算和原子发布")
+    parser.add_argument('--data-dir', default=None, help="数据目录（含 law_data_3k.csv、law_QA.csv），默认为本文件所在目录")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BUILD_WORKERS', 2)), help="计算嵌入的进程数")
+    parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS, help="每个检查点分片的语料块数")
+    parser.add_argument('--batch-size', type=int, default=None, help="每批计算的句子数量")
+    parser.add_argument('--full', action='store_true', help="不复用已发布的向量，全部重新计算")
+    parser.add_argument('--backend', default=None, help="嵌入后端 modelscope / stub，默认读取 EMBEDDING_BACKEND")
+    parser.add_argument('--keep-versions', type=int, default=DEFAULT_KEEP_VERSIONS, help="保留的版本数（包括当前版本）")
+    parser.add_argument('--reload-url', default=None, help="发布后通知服务热加载的地址")
+    parser.add_argument('--migrate-legacy', action='store_true',
+                        help="把服务端生成的普通 embeddings 目录迁移为版本链接后退出（须先停止服务）")
+    args = parser.parse_args()
+
+    if args.migrate_legacy:
+        data_dir = args.data_dir or os.path.dirname(os.path.abspath(__file__))
+        version_dir = migrate_legacy_layout(os.path.join(data_dir, 'embeddings'), os.path.join(data_dir, 'embeddings-builds'))
+        print(f"已迁移：{version_dir}" if version_dir else "embeddings 已经是版本链接，无需迁移")
+        return
+
+    result = build(
+        args.data_dir, workers=args.workers, shard_rows=args.shard_rows, batch_size=args.batch_size,
+        full=args.full, backend=args.backend, keep_versions=args.keep_versions
+    )
+    print(f"已发布：{result['version_dir']}")
+    print(f"语料版本：{result['corpus_version']}")
+    if args.reload_url:
+        notify_reload(args.reload_url, os.getenv('ADMIN_TOKEN'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+
+def normalize_query_text(text):
+    """规范化查询文本作为缓存键：全角转半角、去掉首尾空白、合并连续空白、英文转小写"""
+    text = unicodedata.normalize('NFKC', str(text))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，支持过期时间，并统计命中/未命中次数
+    maxsize 为 0 时不缓存任何内容
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param maxsize: 最大条目数
+        :param ttl: 条目存活秒数，None 或 0 表示不过期
+        """
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl) if ttl else None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """返回命中统计，用于评估缓存大小是否合适"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+
+class ResultCache:
+    """
+    检索结果缓存
+    内存中一层 LRU，可选一层 SQLite 磁盘缓存（重启后仍然有效，同一主机的多个进程共享）。
+    缓存键包含语料版本号，语料或嵌入向量文件变化后旧结果自动失效。
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, sqlite_path=None, version=''):
+        """
+        :param maxsize: 内存缓存最大条目数
+        :param ttl: 条目存活秒数，None 或 0 表示不过期
+        :param sqlite_path: SQLite 文件路径，为空时只使用内存缓存
+        :param version: 语料版本号（例如语料内容哈希）
+        """
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = float(ttl) if ttl else None
+        self.sqlite_path = sqlite_path
+        self.version = version
+        self.disk_hits = 0
+        self.disk_misses = 0
+        if self.sqlite_path:
+            self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.sqlite_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        directory = os.path.dirname(os.path.abspath(self.sqlite_path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # 清理旧版本语料和已过期的结果
+            conn.execute("DELETE FROM result_cache WHERE version != ?", (self.version,))
+            if self.ttl:
+                conn.execute("DELETE FROM result_cache WHERE created_at < ?", (time.time() - self.ttl,))
+
+    def make_key(self, query, *params):
+        """由规范化后的查询文本、检索参数和语料版本号生成缓存键"""
+        raw = json.dumps([self.version, normalize_query_text(query), *params], ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or not self.sqlite_path:
+            return value
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM result_cache WHERE key = ? AND version = ?",
+                (key, self.version)
+            ).fetchone()
+        if row is None or (self.ttl and row[1] < time.time() - self.ttl):
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        value = json.loads(row[0])
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.sqlite_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, version, value, created_at) VALUES (?, ?, ?, ?)",
+                    (key, self.version, json.dumps(value, ensure_ascii=False), time.time())
+                )
+
+    def clear(self):
+        self.memory.clear()
+        if self.sqlite_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM result_cache")
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['version'] = self.version
+        if self.sqlite_path:
+            stats['disk_hits'] = self.disk_hits
+            stats['disk_misses'] = self.disk_misses
+        return stats
+
+
+class SemanticCache:
+    """
+    语义缓存：按向量的余弦相似度查找之前存入的条目
+    只在同一 scope（例如系统提示词、检索参数和语料版本相同）内比较，最相似的条目相似度不低于 threshold 时命中。
+    所有 scope 的条目总数不超过 maxsize，超出时淘汰最久未使用的条目；条目超过 ttl 秒后过期。
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, threshold=0.95):
+        """
+        :param maxsize: 最大条目数，0 表示不缓存任何内容
+        :param ttl: 条目存活秒数，None 或 0 表示不过期
+        :param threshold: 命中所需的最低余弦相似度
+        """
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl) if ttl else None
+        self.threshold = float(threshold)
+        # 条目编号 -> (scope, 归一化向量, 值, 过期时间)，按最近使用排序
+        self._entries = OrderedDict()
+        # scope -> 条目编号集合
+        self._scopes = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_scope(*parts):
+        """由系统提示词、检索参数等生成 scope，只有 scope 相同的条目才会互相命中"""
+        raw = json.dumps(parts, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _remove(self, entry_id):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes[scope]
+        ids.discard(entry_id)
+        if not ids:
+            del self._scopes[scope]
+
+    def _best_match(self, scope, embedding):
+        """scope 内与 embedding 最相似的未过期条目，返回 (条目编号, 相似度)，没有条目时返回 (None, -1)"""
+        now = time.monotonic()
+        ids = []
+        for entry_id in list(self._scopes.get(scope, ())):
+            expires_at = self._entries[entry_id][3]
+            if expires_at is not None and expires_at <= now:
+                self._remove(entry_id)
+            else:
+                ids.append(entry_id)
+        if not ids:
+            return None, -1.0
+        similarities = np.stack([self._entries[entry_id][1] for entry_id in ids]) @ embedding
+        best = int(np.argmax(similarities))
+        return ids[best], float(similarities[best])
+
+    def get(self, scope, embedding):
+        """
+        查找 scope 内与 embedding 足够相似的条目
+        :return: (值, 相似度)，未命中时返回 None
+        """
+        embedding = self._normalize(embedding)
+        with self._lock:
+            entry_id, similarity = self._best_match(scope, embedding)
+            if entry_id is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id][2], min(similarity, 1.0)
+
+    def set(self, scope, embedding, value):
+        """存入条目；scope 内已有足够相似的条目时替换该条目，同义的问题只占一个位置"""
+        if self.maxsize <= 0:
+            return
+        embedding = self._normalize(embedding)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            entry_id, similarity = self._best_match(scope, embedding)
+            if entry_id is not None and similarity >= self.threshold:
+                self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, embedding, value, expires_at)
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """返回命中统计，用于评估相似度阈值和缓存大小是否合适"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'threshold': self.threshold,
+            }
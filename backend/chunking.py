@@ -0,0 +1,130 @@
+import re
+import numpy as np
+
+# 句末标点，切分点在标点之后
+SENTENCE_END_PATTERN = re.compile(r'[。！？；!?;\n]+')
+# 位于行首或空白之后的条文编号（如"第二十三条"）视为新条文的开始；正文中引用的条文编号不切分
+ARTICLE_PATTERN = re.compile(r'(?:^|(?<=\s))第[一二三四五六七八九十百千零〇两\d]+条')
+
+
+def sentence_spans(text):
+    """按句末标点和条文编号把文本切分为句子，返回首尾相接、覆盖全文的 [(start, end)]"""
+    boundaries = {0, len(text)}
+    boundaries.update(match.end() for match in SENTENCE_END_PATTERN.finditer(text))
+    boundaries.update(match.start() for match in ARTICLE_PATTERN.finditer(text))
+    points = sorted(boundaries)
+    return [(start, end) for start, end in zip(points, points[1:]) if end > start]
+
+
+def chunk_spans(text, max_chars=256, overlap=32):
+    """
+    将一行文本切分为若干块
+    块由完整的句子组成，长度不超过 max_chars 个字符（超长的单句按 max_chars 硬切分）；
+    相邻块之间重叠不超过 overlap 个字符的完整句子，避免答案恰好落在切分点上。
+    :param max_chars: 每块最大字符数，小于等于 0 时不切分
+    :return: [(start, end)]，为原文中的字符区间
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [(0, len(text))]
+
+    pieces = []
+    for start, end in sentence_spans(text):
+        while end - start > max_chars:
+            pieces.append((start, start + max_chars))
+            start += max_chars
+        pieces.append((start, end))
+
+    chunks = []
+    first = 0
+    while first < len(pieces):
+        start = pieces[first][0]
+        last = first
+        while last + 1 < len(pieces) and pieces[last + 1][1] - start <= max_chars:
+            last += 1
+        chunks.append((start, pieces[last][1]))
+        if last + 1 >= len(pieces):
+            break
+        # 下一块从本块末尾 overlap 个字符以内的句子开始，并保证向前推进
+        next_first = last + 1
+        while next_first - 1 > first and pieces[last][1] - pieces[next_first - 1][0] <= overlap:
+            next_first -= 1
+        first = next_first
+    return chunks
+
+
+class ChunkTable:
+    """
+    语料块表
+    第 i 块是第 parents[i] 行文本的 starts[i]:ends[i] 字符区间，只保存区间不复制文本。
+    同一行的块按顺序相邻存放。
+    """
+
+    def __init__(self, parents, starts, ends, row_count):
+        self.parents = parents
+        self.starts = starts
+        self.ends = ends
+        self.row_count = row_count
+
+    @classmethod
+    def build(cls, texts, max_chars=256, overlap=32):
+        parents, starts, ends = [], [], []
+        row_count = 0
+        for row, text in enumerate(texts):
+            row_count += 1
+            for start, end in chunk_spans(str(text), max_chars, overlap):
+                parents.append(row)
+                starts.append(start)
+                ends.append(end)
+        return cls(
+            np.asarray(parents, dtype=np.int32),
+            np.asarray(starts, dtype=np.int32),
+            np.asarray(ends, dtype=np.int32),
+            row_count,
+        )
+
+    def __len__(self):
+        return len(self.parents)
+
+    @property
+    def is_identity(self):
+        """每行恰好一块（未切分任何行）"""
+        return len(self) == self.row_count
+
+    def chunk_texts(self, row_texts):
+        """
+        由各块所属行的文本得到块文本
+        :param row_texts: 与 self.parents 一一对应的行文本
+        """
+        return [
+            str(text)[start:end]
+            for text, start, end in zip(row_texts, self.starts.tolist(), self.ends.tolist())
+        ]
+
+    def group_by_parent(self, chunk_ids, top_k):
+        """
+        按排名把命中的块归并到所属的行，同一行只返回一次
+        同一行中相邻或重叠的块合并为一个区间。
+        :param chunk_ids: 按相关度从高到低排序的块编号
+        :param top_k: 最多返回的行数
+        :return: [(row, [(start, end), ...])]，行按其最佳块的排名排序，区间按原文顺序排列
+        """
+        groups = {}
+        for chunk_id in np.asarray(chunk_ids).tolist():
+            row = int(self.parents[chunk_id])
+            if row not in groups:
+                if len(groups) >= top_k:
+                    continue
+                groups[row] = []
+            groups[row].append((int(self.starts[chunk_id]), int(self.ends[chunk_id])))
+
+        result = []
+        for row, spans in groups.items():
+            spans.sort()
+            merged = [list(spans[0])]
+            for start, end in spans[1:]:
+                if start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            result.append((row, [tuple(span) for span in merged]))
+        return result
@@ -0,0 +1,192 @@
+import os
+import re
+
+# 汉字、中文标点和全角字符
+CJK_PATTERN = re.compile(r'[　-〿㐀-鿿＀-￯]')
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+# 每条消息的角色和分隔符大约占用的 token 数
+MESSAGE_OVERHEAD = 4
+# 增强提示词中每个检索片段的外层格式，占用的 token 数按此模板计数
+PASSAGE_TEMPLATE = "[文件 {index} 开始]\n{text}\n[文件 {index} 结束]\n\n"
+# 更早对话摘要中每个问题保留的字符数
+SUMMARY_QUESTION_CHARS = 60
+
+
+class TokenCounter:
+    """
+    本地 token 计数
+    指定 tokenizer（HuggingFace 格式的目录或模型名）时使用 transformers 分词器精确计数；
+    否则按字符估算：每个汉字和中文标点计 1 个，英文单词和数字每 4 个字符计 1 个，其余非空白字符各计 1 个。
+    """
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = None
+        if tokenizer:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        cjk = len(CJK_PATTERN.findall(text))
+        words = WORD_PATTERN.findall(text)
+        word_chars = sum(len(word) for word in words)
+        others = len(text) - cjk - word_chars - sum(1 for char in text if char.isspace())
+        return cjk + sum((len(word) + 3) // 4 for word in words) + max(0, others)
+
+    def count_message(self, message):
+        return self.count(message['content']) + MESSAGE_OVERHEAD
+
+    def truncate(self, text, max_tokens):
+        """截取不超过 max_tokens 个 token 的最长前缀"""
+        if self.count(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+
+class ContextBuilder:
+    """
+    按 token 预算组装发送给模型的消息
+    优先级依次为：系统提示词和当前问题（含指令模板）、检索片段（按相关度从高到低装入，
+    最多占用 retrieval_tokens）、最近的对话历史（从新到旧装入）。装不下的更早对话
+    压缩为一条摘要，只保留用户问过的问题，最多占用 summary_tokens。
+    """
+
+    def __init__(self, max_tokens=6000, retrieval_tokens=3000, summary_tokens=200, counter=None,
+                 passage_template=PASSAGE_TEMPLATE):
+        self.max_tokens = int(max_tokens)
+        self.retrieval_tokens = int(retrieval_tokens)
+        self.summary_tokens = int(summary_tokens)
+        self.counter = counter or TokenCounter()
+        self.passage_template = passage_template
+
+    def passage_overhead(self, index):
+        """第 index 个片段外层格式占用的 token 数（片段文本本身，包括 "[法条i] " 等来源标记，另行计数）"""
+        return self.counter.count(self.passage_template.format(index=index, text=''))
+
+    def pack_passages(self, passages, budget):
+        """
+        按相关度从高到低装入检索片段，装不下的片段跳过
+        :param passages: [(text, score)]
+        :return: 装入的片段文本，按相关度排序
+        """
+        selected = []
+        used = 0
+        for text, _ in sorted(passages, key=lambda item: -item[1]):
+            cost = self.counter.count(text) + self.passage_overhead(len(selected) + 1)
+            if used + cost > budget:
+                continue
+            selected.append(text)
+            used += cost
+        overhead = self.passage_overhead(1)
+        if not selected and passages and budget > overhead:
+            # 单个片段就超出预算时截断最相关的片段，而不是完全不给模型参考资料
+            best_text = max(passages, key=lambda item: item[1])[0]
+            selected.append(self.counter.truncate(best_text, budget - overhead))
+        return selected
+
+    def summarize(self, messages, budget):
+        """把更早的对话压缩为一条摘要：从新到旧列出用户的问题，直到用完预算"""
+        prefix = "更早的对话中用户问过："
+        remaining = budget - MESSAGE_OVERHEAD - self.counter.count(prefix)
+        questions = []
+        for message in reversed(messages):
+            if message['role'] != 'user':
+                continue
+            question = message['content'].strip().replace('\n', ' ')
+            if len(question) > SUMMARY_QUESTION_CHARS:
+                question = question[:SUMMARY_QUESTION_CHARS] + "…"
+            cost = self.counter.count(question) + 1
+            if cost > remaining:
+                break
+            questions.append(question)
+            remaining -= cost
+        if not questions:
+            return None
+        return {"role": "system", "content": prefix + "；".join(reversed(questions))}
+
+    def build(self, system_prompt, history, passages=None, render_prompt=None):
+        """
+        组装消息列表
+        :param system_prompt: 系统提示词，可为空
+        :param history: 会话历史，最后一条为当前用户问题
+        :param passages: 检索片段 [(text, score)]，为 None 时不使用检索
+        :param render_prompt: render_prompt(question, passages) 返回替换当前问题的增强提示词
+        :return: (messages, selected_passages, report)，report 为各部分占用的 token 数
+        """
+        history = list(history)
+        question = history.pop() if history and history[-1]['role'] == 'user' else None
+        report = {'budget': self.max_tokens, 'system': 0, 'template': 0, 'question': 0,
+                  'retrieval': 0, 'history': 0, 'summary': 0}
+
+        system_messages = []
+        if system_prompt:
+            system_messages.append({"role": "system", "content": system_prompt})
+            report['system'] = self.counter.count_message(system_messages[0])
+
+        selected = []
+        question_messages = []
+        if question is not None:
+            report['question'] = self.counter.count_message(question)
+            content = question['content']
+            if passages is not None and render_prompt is not None:
+                bare_prompt = render_prompt(content, [])
+                report['template'] = self.counter.count(bare_prompt) - self.counter.count(content)
+                remaining = self.max_tokens - report['system'] - report['question'] - report['template']
+                selected = self.pack_passages(passages, min(self.retrieval_tokens, max(0, remaining)))
+                content = render_prompt(content, selected)
+                report['retrieval'] = self.counter.count(content) - self.counter.count(bare_prompt)
+            question_messages.append({"role": question['role'], "content": content})
+
+        # 从新到旧装入历史，装不下时停止；保留的历史不以助手消息开头
+        remaining = self.max_tokens - (report['system'] + report['template'] + report['question'] + report['retrieval'])
+        kept = []
+        for message in reversed(history):
+            cost = self.counter.count_message(message)
+            if cost > remaining:
+                break
+            kept.append(message)
+            remaining -= cost
+        kept.reverse()
+        while kept and kept[0]['role'] == 'assistant':
+            remaining += self.counter.count_message(kept.pop(0))
+        dropped = history[:len(history) - len(kept)]
+        report['history'] = sum(self.counter.count_message(message) for message in kept)
+
+        summary_messages = []
+        if dropped and self.summary_tokens > 0:
+            summary = self.summarize(dropped, min(self.summary_tokens, remaining))
+            if summary is not None:
+                summary_messages.append(summary)
+                report['summary'] = self.counter.count_message(summary)
+
+        report['history_messages'] = len(kept)
+        report['history_messages_dropped'] = len(dropped)
+        report['passages'] = len(selected)
+        report['passages_dropped'] = len(passages or []) - len(selected)
+        report['total'] = (report['system'] + report['template'] + report['question']
+                           + report['retrieval'] + report['history'] + report['summary'])
+        messages = system_messages + summary_messages + kept + question_messages
+        return messages, selected, report
+
+
+def create_context_builder():
+    """
+    根据环境变量创建上下文组装器
+    CONTEXT_TOKENIZER 为 HuggingFace 分词器目录或模型名，不设置时按字符估算 token 数
+    """
+    return ContextBuilder(
+        max_tokens=int(os.getenv('CONTEXT_MAX_TOKENS', 6000)),
+        retrieval_tokens=int(os.getenv('CONTEXT_RETRIEVAL_TOKENS', 3000)),
+        summary_tokens=int(os.getenv('CONTEXT_SUMMARY_TOKENS', 200)),
+        counter=TokenCounter(os.getenv('CONTEXT_TOKENIZER') or None)
+    )
@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def row_hash(text):
+    """单行语料的内容哈希"""
+    return hashlib.blake2b(str(text).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_manifest(directory):
+    """
+    读取嵌入向量清单，不存在时返回 None
+    :return: {'model': 生成嵌入向量的模型标识（旧版本清单为 None）, 'sources': {来源名: [每行内容哈希]}}
+    """
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {'model': data.get('model'), 'sources': data.get('sources', {})}
+
+
+def save_manifest(directory, sources, model=None):
+    """原子写入嵌入向量清单"""
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'updated_at': time.time(), 'model': model, 'sources': sources}, f)
+    os.replace(tmp_path, path)
+
+
+def plan_update(old_hashes, new_hashes):
+    """
+    对比新旧内容哈希，得到每一行可复用的旧行号
+    :return: (reuse, missing)。reuse[i] 为新第 i 行对应的旧行号（无法复用时为 -1），
+             missing 为需要重新计算嵌入的新行号
+    """
+    positions = {}
+    for index, value in enumerate(old_hashes):
+        positions.setdefault(value, index)
+    reuse = np.array([positions.get(value, -1) for value in new_hashes], dtype=np.int64)
+    missing = np.where(reuse < 0)[0]
+    return reuse, missing
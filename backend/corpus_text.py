@@ -0,0 +1,149 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from file_utils import atomic_save_npy
+
+# 单个 CSV 字段的最大长度，默认的 128KB 对长条文不够
+csv.field_size_limit(2 ** 31 - 1)
+
+
+class TextColumn:
+    """
+    紧凑的文本列
+    所有文本按 UTF-8 编码后首尾相接存放在一个 uint8 数组中，offsets[i]:offsets[i+1]
+    为第 i 行的字节区间。两个数组都以 .npy 保存，可用 mmap 方式加载，
+    多个工作进程共享同一份页缓存。
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, texts):
+        encoded = [str(text).encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        # 顺序读取全部文本时一次取出整个字节串，避免逐行切片数组
+        data = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+    def take(self, indices):
+        return [self[int(index)] for index in indices]
+
+    @property
+    def nbytes(self):
+        return self.blob.nbytes + self.offsets.nbytes
+
+    @staticmethod
+    def paths(directory, name):
+        return (
+            os.path.join(directory, f'{name}.text.npy'),
+            os.path.join(directory, f'{name}.offsets.npy'),
+        )
+
+    def save(self, directory, name):
+        """偏移数组最后写入，加载时用最后一个偏移校验字节串的长度"""
+        blob_path, offsets_path = self.paths(directory, name)
+        atomic_save_npy(blob_path, self.blob)
+        atomic_save_npy(offsets_path, self.offsets)
+
+    @classmethod
+    def load(cls, directory, name, mmap=False):
+        """加载文本列，文件不存在或字节串与偏移数组不配套时返回 None"""
+        blob_path, offsets_path = cls.paths(directory, name)
+        if not (os.path.exists(blob_path) and os.path.exists(offsets_path)):
+            return None
+        mmap_mode = 'r' if mmap else None
+        blob, offsets = np.load(blob_path, mmap_mode=mmap_mode), np.load(offsets_path, mmap_mode=mmap_mode)
+        if len(offsets) == 0 or int(offsets[-1]) != len(blob):
+            return None
+        return cls(blob, offsets)
+
+
+def read_csv_column(csv_path, column):
+    """用标准库 csv 读取一列文本（空值为空字符串），不依赖 pandas"""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if column not in (reader.fieldnames or []):
+            raise KeyError(f"{os.path.basename(csv_path)} 中没有列 {column}")
+        return [row[column] or '' for row in reader]
+
+
+def csv_signature(csv_path, column):
+    """CSV 文件的大小和纳秒级修改时间，与构建文本列时记录的不同则需要重新构建"""
+    stat = os.stat(csv_path)
+    return {'column': column, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _column_meta_path(directory, name):
+    return os.path.join(directory, f'{name}.column.json')
+
+
+def _read_column_meta(directory, name):
+    try:
+        with open(_column_meta_path(directory, name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_stale_versions(directory, name, version):
+    """删除同一列其它版本（以及旧版本不带版本号）的文件；已 mmap 这些文件的进程不受影响"""
+    pattern = re.compile(rf'^{re.escape(name)}(\.[0-9a-f]{{12}})?\.(text|offsets)\.npy$')
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match and match.group(1) != f'.{version}':
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+def load_csv_column(csv_path, directory, name, column='data', mmap=False):
+    """
+    加载 CSV 中一列对应的紧凑文本列
+    构建时在 {name}.column.json 中记录 CSV 的大小和修改时间（纳秒）以及文本列的版本号，
+    文本列保存为 {name}.{版本号}.text.npy / .offsets.npy。记录与当前 CSV 一致时直接加载，不再解析 CSV；
+    否则重新构建，两个数组写完后才替换 column.json，字节串和偏移数组作为一对发布，
+    读取方不会拿到新旧混合的一对文件。CSV 不存在时使用已有的文本列。
+    :param mmap: 为 True 时以只读 mmap 方式加载
+    """
+    meta = _read_column_meta(directory, name)
+    if meta is not None and (not os.path.exists(csv_path) or meta.get('source') == csv_signature(csv_path, column)):
+        text_column = TextColumn.load(directory, f"{name}.{meta['version']}", mmap=mmap)
+        if text_column is not None:
+            return text_column
+    elif meta is None and not os.path.exists(csv_path):
+        # 旧版本构建的文本列没有记录文件
+        text_column = TextColumn.load(directory, name, mmap=mmap)
+        if text_column is not None:
+            return text_column
+
+    # 先记录签名再读取，读取期间 CSV 被修改时下次启动会重新构建
+    signature = csv_signature(csv_path, column)
+    version = hashlib.blake2b(json.dumps(signature, sort_keys=True).encode('utf-8'), digest_size=6).hexdigest()
+    TextColumn.build(read_csv_column(csv_path, column)).save(directory, f'{name}.{version}')
+    meta_path = _column_meta_path(directory, name)
+    tmp_path = f'{meta_path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'source': signature, 'version': version}, f)
+    os.replace(tmp_path, meta_path)
+    _remove_stale_versions(directory, name, version)
+    return TextColumn.load(directory, f'{name}.{version}', mmap=mmap)
@@ -1,150 +1,814 @@
-import pandas as pd
+import hashlib
+import json
+import logging
 import numpy as np
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
 import os
 from typing import List, Dict
-import torch
-from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
+from vector_index import load_or_build_index, search_batch, RerankIndex
+from sharded_index import ShardPool, ShardedIndex, start_worker_server
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from chunking import ChunkTable
+from embedding_backends import load_text_embedding, embedding_model_id, embed_sentences, DEFAULT_EMBEDDING_MODEL_ID
+from embedding_store import EmbeddingStore, SOURCE_LAW, SOURCE_QA, SOURCE_NAMES
+from corpus_text import load_csv_column
+from file_utils import atomic_save_npy, hash_file_stats
+from cache import LRUCache, ResultCache, normalize_query_text
+from embedding_batcher import EmbeddingBatcher
+from corpus_manifest import row_hash, load_manifest, save_manifest, plan_update
+from metrics import timed
+import contextvars
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 切分后每需要一行结果检索的块数
+CHUNK_SEARCH_FACTOR = 4
 
 class DataProcessor:
-    def __init__(self):
-        # 使用相对路径
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.law_data_path = os.path.join(current_dir, 'law_data_3k.csv')
-        self.law_qa_path = os.path.join(current_dir, 'law_QA.csv')
-        self.embeddings_dir = os.path.join(current_dir, 'embeddings')
+    def __init__(self, batch_size=None, index_type=None, nprobe=None, embedding_dtype=None, mmap=None,
+                 query_cache_size=None, query_cache_ttl=None, result_cache_path=None, text_embedding=None,
+                 retrieval_mode=None, chunk_max_chars=None, chunk_overlap=None, data_dir=None, progress=None,
+                 pq_subvectors=None, rerank_candidates=None, search_shards=None, embeddings_dir=None,
+                 embedding_builder=None, full_rebuild=False):
+        # 加载进度回调 progress(stage, **detail)，后台预热时用于报告当前阶段
+        self.progress = progress
+        # 计算语料嵌入的函数 embedding_builder(texts, batch_size, desc)，默认为 compute_embeddings；
+        # 离线构建（build_index.py）用它在进程池中分片计算并保存检查点
+        self.embedding_builder = embedding_builder
+        # 批量计算嵌入时每批的句子数量
+        self.batch_size = int(batch_size or os.getenv('EMBEDDING_BATCH_SIZE', 32))
+        # 向量索引类型：flat 为精确检索，ivf 为近似检索；nprobe 越大召回越高、延迟越大
+        self.index_type = index_type or os.getenv('VECTOR_INDEX', 'flat')
+        self.nprobe = int(nprobe or os.getenv('VECTOR_INDEX_NPROBE', 8))
+        # 检索方式：dense 只用向量检索；hybrid 同时用 BM25 词法检索，两路结果按倒数排名融合
+        self.retrieval_mode = retrieval_mode or os.getenv('RETRIEVAL_MODE', 'dense')
+        if self.retrieval_mode not in ('dense', 'hybrid'):
+            raise ValueError(f"未知的检索方式: {self.retrieval_mode}，可选: dense, hybrid")
+        # 每一路参与融合的候选数量
+        self.hybrid_candidates = int(os.getenv('HYBRID_CANDIDATES', 50))
+        # 语料行数达到该值时，向量相似度只在 BM25 预筛选出的 LEXICAL_PREFILTER_SIZE 个候选中计算
+        self.lexical_prefilter_min_docs = int(os.getenv('LEXICAL_PREFILTER_MIN_DOCS', 100000))
+        self.lexical_prefilter_size = int(os.getenv('LEXICAL_PREFILTER_SIZE', 2000))
+        # 长文本按句子切分为块后再计算嵌入，块之间重叠 chunk_overlap 个字符；
+        # chunk_max_chars 为 0（默认）时不切分，每行一个向量，已有的逐行嵌入向量继续有效
+        self.chunk_max_chars = int(chunk_max_chars if chunk_max_chars is not None else os.getenv('CHUNK_MAX_CHARS', 0))
+        self.chunk_overlap = int(chunk_overlap if chunk_overlap is not None else os.getenv('CHUNK_OVERLAP', 32))
+        # 归一化嵌入向量的存储精度：float32、float16（内存减半）、int8（约 1/4）或 pq（乘积量化，约 1/32）
+        self.embedding_dtype = embedding_dtype or os.getenv('EMBEDDING_DTYPE', 'float32')
+        # pq 的子空间数量（每个向量占的字节数），为 0 时每个子空间约 8 维
+        self.pq_subvectors = int(pq_subvectors if pq_subvectors is not None else os.getenv('PQ_SUBVECTORS', 0)) or None
+        # int8 / pq 存储下检索的候选数，用全精度向量（mmap 读取原始 .npy）重新排序，为 0 时不重排
+        self.rerank_candidates = int(
+            rerank_candidates if rerank_candidates is not None else os.getenv('QUANTIZED_RERANK', 0)
+        )
+        # 分片检索：flat 索引的向量按行分为 search_shards 段，由同样数量的工作进程并行扫描，
+        # 法条和问答同时检索；为 1 时在当前线程中依次检索
+        self.search_shards = int(search_shards or os.getenv('SEARCH_SHARDS', 1))
+        self.shard_pool = None
+        self.source_executor = None
+        if self.search_shards > 1 and self.index_type == 'flat':
+            # 在加载模型之前启动分片检索工作进程的 forkserver 服务进程
+            start_worker_server()
+        # 内存映射模式：嵌入向量和紧凑文本列以只读 mmap 方式加载，同一主机上的工作进程共享页缓存
+        if mmap is None:
+            mmap = os.getenv('EMBEDDING_MMAP', '0').lower() in ('1', 'true', 'yes')
+        self.mmap = mmap
+        # 查询嵌入缓存：相同（规范化后）的问题不再重复经过模型推理
+        self.query_cache = LRUCache(
+            maxsize=int(query_cache_size if query_cache_size is not None else os.getenv('QUERY_CACHE_SIZE', 1024)),
+            ttl=float(query_cache_ttl if query_cache_ttl is not None else os.getenv('QUERY_CACHE_TTL', 3600))
+        )
+
+        # 数据目录默认为本文件所在目录，基准测试等场景可指定其它目录
+        data_dir = data_dir or os.path.dirname(os.path.abspath(__file__))
+        self.law_data_path = os.path.join(data_dir, 'law_data_3k.csv')
+        self.law_qa_path = os.path.join(data_dir, 'law_QA.csv')
+        self.embeddings_dir = embeddings_dir or os.path.join(data_dir, 'embeddings')
         
         # 创建embeddings目录
         os.makedirs(self.embeddings_dir, exist_ok=True)
         
         # 加载数据
-        print("正在加载数据...")
+        self.report_progress('loading_data')
+        logger.info("正在加载数据...")
         try:
-            self.law_data = pd.read_csv(self.law_data_path)
-            self.law_qa = pd.read_csv(self.law_qa_path)
-            print(f"数据加载完成。法律条文数量：{len(self.law_data)}，问答数据数量：{len(self.law_qa)}")
+            self.text_columns = self.load_text_columns()
         except Exception as e:
-            print(f"加载数据文件失败: {str(e)}")
+            logger.warning("加载数据文件失败: %s", e)
             raise
+        logger.info("数据加载完成。法律条文数量：%d，问答数据数量：%d", self.corpus_size(SOURCE_LAW), self.corpus_size(SOURCE_QA))
+        self.report_progress('chunking')
+        self.build_chunks()
         
-        # 初始化文本嵌入模型
-        print("正在加载文本嵌入模型...")
-        self.text_embedding = pipeline(
-            Tasks.sentence_embedding,
-            model='damo/nlp_corom_sentence-embedding_chinese-base',
-            model_revision='v1.0.0'
-        )
-        print("模型加载完成")
+        # 初始化文本嵌入模型（热更新语料时复用已加载的模型）
+        if text_embedding is not None:
+            self.text_embedding = text_embedding
+        else:
+            self.report_progress('loading_model')
+            logger.info("正在加载文本嵌入模型...")
+            self.text_embedding = load_text_embedding()
+            logger.info("模型加载完成")
+        self.embedding_model_id = embedding_model_id(self.text_embedding)
+        
+        # 按内容哈希增量计算新增或修改行的嵌入向量；full_rebuild 时忽略已有向量全部重新计算
+        self.report_progress('embedding')
+        changed = self.sync_embeddings(full=full_rebuild)
         
-        # 尝试加载已有的嵌入向量
-        self.law_data_embeddings = self.load_embeddings('law_data_embeddings.npy')
-        self.law_qa_embeddings = self.load_embeddings('law_qa_embeddings.npy')
+        # 优先加载已归一化的嵌入向量存储
+        self.store = None if changed or full_rebuild else self.load_store()
+        if self.store is None:
+            self.build_store(
+                self.load_embeddings('law_data_embeddings.npy', mmap=True),
+                self.load_embeddings('law_qa_embeddings.npy', mmap=True)
+            )
+        self.report_progress('building_index')
+        self.build_indexes(rebuild=full_rebuild, patch=changed and not full_rebuild)
+        self.build_lexical_indexes()
         
-        # 如果没有找到嵌入向量文件，则重新计算
-        if self.law_data_embeddings is None or self.law_qa_embeddings is None:
-            print("未找到预计算的嵌入向量，开始计算...")
-            self.compute_and_save_embeddings()
+        # 查询嵌入微批调度：并发请求合并为一次批量前向计算，QUERY_BATCH_MAX_SIZE 大于 1 时启用
+        self.query_batcher = None
+        query_batch_size = int(os.getenv('QUERY_BATCH_MAX_SIZE', 1))
+        if query_batch_size > 1:
+            # 后台线程只持有弱引用，热更新后旧实例不再被请求使用时可以被回收
+            self.query_batcher = EmbeddingBatcher(
+                _weak_method(self.embed_texts),
+                max_batch_size=query_batch_size,
+                max_wait_ms=float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', 5))
+            )
+        
+        # 检索结果缓存，缓存键中包含语料版本号，语料或嵌入向量变化后自动失效
+        self.corpus_version = self.compute_corpus_version()
+        self.result_cache = ResultCache(
+            maxsize=int(os.getenv('RESULT_CACHE_SIZE', 1024)),
+            ttl=float(os.getenv('RESULT_CACHE_TTL', 3600)),
+            sqlite_path=result_cache_path or os.getenv('RESULT_CACHE_DB') or None,
+            version=self.corpus_version
+        )
+    
+    def report_progress(self, stage, **detail):
+        """报告加载进度"""
+        if self.progress is not None:
+            self.progress(stage, **detail)
+    
+    def compute_corpus_version(self):
+        """
+        由嵌入向量清单、块与行的对应关系以及检索配置计算语料版本号
+        清单记录了每一块的内容哈希和嵌入模型，与 .npy 中的向量一一对应，不需要读取向量文件和 CSV；
+        没有清单时退回到向量文件的大小和修改时间
+        """
+        digest = hashlib.sha1()
+        for source in sorted(SOURCE_NAMES):
+            digest.update(np.ascontiguousarray(self.chunks[source].parents).tobytes())
+            digest.update(f"/{self.chunks[source].row_count};".encode('utf-8'))
+        manifest = load_manifest(self.embeddings_dir)
+        if manifest is not None:
+            digest.update(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+        else:
+            digest.update(hash_file_stats([
+                os.path.join(self.embeddings_dir, 'law_data_embeddings.npy'),
+                os.path.join(self.embeddings_dir, 'law_qa_embeddings.npy'),
+            ]).encode('utf-8'))
+        content_hash = digest.hexdigest()
+        storage = self.embedding_dtype
+        if self.store.quantized:
+            storage += f"/{getattr(self.store.vectors, 'subvectors', '')}/rerank{self.rerank_candidates}"
+        return (f"{content_hash[:16]}:{self.index_type}:{self.nprobe}:{storage}:{self.retrieval_mode}"
+                f":{self.chunk_max_chars}/{self.chunk_overlap}")
+    
+    def load_text_columns(self):
+        """
+        加载 CSV 中 data 列对应的紧凑文本列（UTF-8 字节串 + 偏移数组，按行号 O(1) 读取）
+        文本列只在 CSV 更新后重新构建，查询时不需要 pandas DataFrame
+        """
+        text_columns = {
+            source: load_csv_column(csv_path, self.embeddings_dir, name, 'data', mmap=self.mmap)
+            for source, name, csv_path in (
+                (SOURCE_LAW, 'law_data', self.law_data_path),
+                (SOURCE_QA, 'law_qa', self.law_qa_path),
+            )
+        }
+        logger.info("加载语料文本列%s，占用 %.1f MB", '（mmap）' if self.mmap else '',
+                    sum(column.nbytes for column in text_columns.values()) / 1024 / 1024)
+        return text_columns
+    
+    def corpus_size(self, source):
+        """某个来源的语料行数"""
+        return len(self.text_columns[source])
+    
+    def get_texts(self, source, indices=None):
+        """
+        按行号获取语料文本
+        :param source: 来源编号 SOURCE_LAW / SOURCE_QA
+        :param indices: 行号列表，为 None 时返回全部文本
+        """
+        column = self.text_columns[source]
+        return list(column) if indices is None else column.take(indices)
+    
+    def build_chunks(self):
+        """按句子和条文编号把每一行切分为块，嵌入向量和索引都以块为单位"""
+        self.chunks = {
+            source: ChunkTable.build(self.get_texts(source), self.chunk_max_chars, self.chunk_overlap)
+            for source in (SOURCE_LAW, SOURCE_QA)
+        }
+        logger.info("语料切分完成。法律条文块数：%d，问答数据块数：%d", len(self.chunks[SOURCE_LAW]), len(self.chunks[SOURCE_QA]))
+    
+    def get_chunk_texts(self, source):
+        """某个来源全部块的文本，顺序与嵌入向量一致"""
+        table = self.chunks[source]
+        row_texts = self.get_texts(source)
+        return table.chunk_texts([row_texts[row] for row in table.parents.tolist()])
+    
+    def chunk_search_depth(self, source, top_k):
+        """一行可能有多个块命中，检索的块数多于需要的行数，去重后仍能凑满 top_k 行"""
+        if self.chunks[source].is_identity:
+            return top_k
+        return top_k * CHUNK_SEARCH_FACTOR
+    
+    def get_passages(self, source, chunk_ids, similarities, top_k):
+        """
+        将命中的块按所属行去重，同一行中相邻的块合并，返回前 top_k 行的相关片段
+        不相邻的片段之间用省略号连接。
+        :return: [(行号, 该行命中块的最高相似度, 片段)]
+        """
+        table = self.chunks[source]
+        groups = table.group_by_parent(chunk_ids, top_k)
+        if not groups:
+            return []
+        best_scores = {}
+        for chunk_id, similarity in zip(np.asarray(chunk_ids).tolist(), np.asarray(similarities).tolist()):
+            row = int(table.parents[chunk_id])
+            best_scores[row] = max(best_scores.get(row, similarity), similarity)
+        row_texts = self.get_texts(source, [row for row, _ in groups])
+        return [
+            (row, best_scores[row], "……".join(str(text)[start:end].strip() for start, end in spans))
+            for text, (row, spans) in zip(row_texts, groups)
+        ]
     
-    def load_embeddings(self, filename):
-        """加载嵌入向量"""
+    def load_store(self):
+        """加载归一化后的嵌入向量存储，不存在或已过期时返回 None"""
+        store_path, _ = EmbeddingStore.paths(self.embeddings_dir, self.embedding_dtype)
+        if not os.path.exists(store_path):
+            return None
+        # 原始嵌入向量比存储更新时需要重新构建
+        for filename in ('law_data_embeddings.npy', 'law_qa_embeddings.npy'):
+            filepath = os.path.join(self.embeddings_dir, filename)
+            if os.path.exists(filepath) and os.path.getmtime(filepath) > os.path.getmtime(store_path):
+                return None
+        store = EmbeddingStore.load(self.embeddings_dir, self.embedding_dtype, mmap=self.mmap)
+        if store is None:
+            return None
+        if store.count(SOURCE_LAW) != len(self.chunks[SOURCE_LAW]) or store.count(SOURCE_QA) != len(self.chunks[SOURCE_QA]):
+            logger.warning("嵌入向量存储与数据文件行数不一致，重新构建")
+            return None
+        if self.pq_subvectors and getattr(store.vectors, 'subvectors', self.pq_subvectors) != self.pq_subvectors:
+            logger.info("pq 子空间数量已修改，重新构建嵌入向量存储")
+            return None
+        logger.info("加载嵌入向量存储: %s%s", os.path.basename(store_path), '（mmap）' if self.mmap else '')
+        return store
+    
+    def build_store(self, law_data_embeddings, law_qa_embeddings):
+        """将法条和问答的嵌入向量归一化（int8 / pq 时再量化）后拼接为一个存储并保存"""
+        self.store = EmbeddingStore.build({
+            SOURCE_LAW: law_data_embeddings,
+            SOURCE_QA: law_qa_embeddings,
+        }, dtype=self.embedding_dtype, pq_subvectors=self.pq_subvectors)
+        self.store.save(self.embeddings_dir)
+        logger.info("嵌入向量存储已保存: %s，占用 %.1f MB", self.store.dtype, self.store.nbytes / 1024 / 1024)
+        if self.mmap:
+            # 改为引用映射文件，释放进程私有的副本
+            self.store = EmbeddingStore.load(self.embeddings_dir, self.embedding_dtype, mmap=True)
+    
+    def start_shard_pool(self):
+        """按当前的嵌入向量存储启动分片检索进程池，启动失败时退回单进程检索"""
+        self.close_shard_pool()
+        if self.search_shards <= 1 or self.index_type != 'flat':
+            return
+        try:
+            self.shard_pool = ShardPool(
+                self.embeddings_dir, self.store.dtype,
+                [self.store.count(source) for source in sorted(SOURCE_NAMES)], self.search_shards
+            )
+        except Exception as e:
+            logger.warning("分片检索进程池启动失败，使用单进程检索: %s", e)
+            return
+        self.source_executor = ThreadPoolExecutor(max_workers=max(4, self.search_shards), thread_name_prefix='source-search')
+    
+    def close_shard_pool(self):
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+            self.shard_pool = None
+        if self.source_executor is not None:
+            self.source_executor.shutdown(wait=False)
+            self.source_executor = None
+    
+    def close(self):
+        """关闭微批调度线程和分片检索进程池"""
+        if self.query_batcher is not None:
+            self.query_batcher.close()
+        self.close_shard_pool()
+    
+    def close_when_unreferenced(self):
+        """实例不再被引用（仍在使用它的请求都已结束）后关闭微批调度线程和分片检索进程池"""
+        weakref.finalize(self, _close_resources, self.query_batcher, self.shard_pool, self.source_executor)
+    
+    def index_fingerprint(self, name, filename):
+        """
+        某个来源向量内容的指纹，随向量索引保存
+        由清单中各块的内容哈希、嵌入模型和存储精度计算；没有清单时使用嵌入向量文件的大小和修改时间
+        """
+        manifest = load_manifest(self.embeddings_dir)
+        if manifest is not None and name in manifest['sources']:
+            content = json.dumps([manifest['model'], manifest['sources'][name]])
+        else:
+            content = hash_file_stats([os.path.join(self.embeddings_dir, filename)])
+        return hashlib.sha1(f"{content}:{self.embedding_dtype}".encode('utf-8')).hexdigest()
+
+    def build_indexes(self, rebuild=False, patch=False):
+        """
+        基于嵌入向量存储加载或构建法条和问答的向量索引
+        :param rebuild: 是否完全重建
+        :param patch: 语料有增量变化，复用已有聚类中心并重新分配倒排列表
+        """
+        self.law_data_index = load_or_build_index(
+            self.store.segment(SOURCE_LAW),
+            os.path.join(self.embeddings_dir, 'law_data_embeddings.npy'),
+            kind=self.index_type, rebuild=rebuild, patch=patch, normalized=True, nprobe=self.nprobe,
+            fingerprint=self.index_fingerprint('law_data', 'law_data_embeddings.npy')
+        )
+        self.law_qa_index = load_or_build_index(
+            self.store.segment(SOURCE_QA),
+            os.path.join(self.embeddings_dir, 'law_qa_embeddings.npy'),
+            kind=self.index_type, rebuild=rebuild, patch=patch, normalized=True, nprobe=self.nprobe,
+            fingerprint=self.index_fingerprint('law_qa', 'law_qa_embeddings.npy')
+        )
+        self.start_shard_pool()
+        if self.shard_pool is not None:
+            self.law_data_index = ShardedIndex(self.law_data_index, self.shard_pool, SOURCE_LAW, self.search_shards)
+            self.law_qa_index = ShardedIndex(self.law_qa_index, self.shard_pool, SOURCE_QA, self.search_shards)
+        if self.store.quantized and self.rerank_candidates > 0:
+            self.law_data_index = RerankIndex(
+                self.law_data_index, self.load_embeddings('law_data_embeddings.npy', mmap=True), self.rerank_candidates
+            )
+            self.law_qa_index = RerankIndex(
+                self.law_qa_index, self.load_embeddings('law_qa_embeddings.npy', mmap=True), self.rerank_candidates
+            )
+    
+    def build_lexical_indexes(self):
+        """hybrid 模式下为法条和问答构建 BM25 倒排索引"""
+        self.law_data_lexical = None
+        self.law_qa_lexical = None
+        if self.retrieval_mode != 'hybrid':
+            return
+        self.law_data_lexical = BM25Index(self.get_chunk_texts(SOURCE_LAW))
+        self.law_qa_lexical = BM25Index(self.get_chunk_texts(SOURCE_QA))
+        logger.info("BM25 索引构建完成，词表大小：%d / %d", len(self.law_data_lexical.vocabulary), len(self.law_qa_lexical.vocabulary))
+    
+    def load_embeddings(self, filename, mmap=False):
+        """加载嵌入向量，mmap 为 True 时以只读内存映射方式加载"""
         filepath = os.path.join(self.embeddings_dir, filename)
         if os.path.exists(filepath):
-            print(f"加载嵌入向量: {filename}")
-            return np.load(filepath)
+            logger.info("加载嵌入向量: %s", filename)
+            return np.load(filepath, mmap_mode='r' if mmap else None)
         return None
     
     def save_embeddings(self, embeddings, filename):
         """保存嵌入向量"""
         filepath = os.path.join(self.embeddings_dir, filename)
-        np.save(filepath, embeddings)
-        print(f"嵌入向量已保存: {filename}")
-    
-    def compute_and_save_embeddings(self):
-        """计算并保存嵌入向量"""
-        # 计算法律条文的嵌入向量
-        print("计算法律条文嵌入向量...")
-        self.law_data_embeddings = []
-        for _, row in tqdm(self.law_data.iterrows(), total=len(self.law_data), desc="计算法律条文嵌入"):
-            result = self.text_embedding({'source_sentence': [row['data']]})
-            embedding = result['text_embedding']
-            self.law_data_embeddings.append(embedding)
-        self.law_data_embeddings = np.array(self.law_data_embeddings)
-        self.save_embeddings(self.law_data_embeddings, 'law_data_embeddings.npy')
+        atomic_save_npy(filepath, embeddings)
+        logger.info("嵌入向量已保存: %s", filename)
+    
+    def embed_texts(self, texts):
+        """对一批文本做一次前向计算，返回形状为 (len(texts), dim) 的 float32 矩阵"""
+        return embed_sentences(self.text_embedding, texts)
+    
+    def compute_embeddings(self, texts, batch_size=None, desc="计算嵌入"):
+        """
+        批量计算文本嵌入向量
+        :param texts: 文本列表
+        :param batch_size: 每批句子数量，默认使用 self.batch_size
+        :param desc: 进度条描述
+        :return: 形状为 (len(texts), dim) 的连续 float32 矩阵，行顺序与 texts 一致
+        """
+        batch_size = max(1, int(batch_size or self.batch_size))
+        texts = [str(text) for text in texts]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        with tqdm(total=len(texts), desc=desc) as progress:
+            def on_batch(count):
+                progress.update(count)
+                self.report_progress('embedding', desc=desc, done=progress.n, total=len(texts))
+            return embed_in_batches(self.embed_texts, texts, batch_size, on_batch)
+
+    def sync_embeddings(self, batch_size=None, full=False):
+        """
+        按内容哈希同步嵌入向量
+        清单 embeddings/manifest.json 记录每一块的内容哈希，只有新增或修改的块需要重新计算嵌入，
+        其余块直接复用旧向量，结果按当前 CSV 的行顺序写回 .npy 文件。
+        :param batch_size: 每批句子数量
+        :param full: 是否忽略已有向量全部重新计算
+        :return: 嵌入向量是否有变化
+        """
+        manifest = None if full else load_manifest(self.embeddings_dir)
+        if full:
+            trusted = False
+        elif manifest is not None:
+            # 旧版本清单没有记录模型，视为默认模型生成
+            trusted = (manifest['model'] or DEFAULT_EMBEDDING_MODEL_ID) == self.embedding_model_id
+        else:
+            # 没有清单的旧版本嵌入向量由默认模型生成
+            trusted = self.embedding_model_id == DEFAULT_EMBEDDING_MODEL_ID
+        hashes_by_source = dict(manifest['sources']) if trusted and manifest is not None else {}
+        changed = False
+        for source, name, filename, desc in (
+            (SOURCE_LAW, 'law_data', 'law_data_embeddings.npy', "计算法律条文嵌入"),
+            (SOURCE_QA, 'law_qa', 'law_qa_embeddings.npy', "计算问答数据嵌入"),
+        ):
+            texts = self.get_chunk_texts(source)
+            hashes = [row_hash(text) for text in texts]
+            old_embeddings = self.load_embeddings(filename) if trusted else None
+            old_hashes = hashes_by_source.get(name)
+            if old_embeddings is not None and manifest is None and len(old_embeddings) == len(hashes):
+                # 旧版本生成的嵌入向量没有清单，视为与当前数据一致
+                old_hashes = hashes
+            if old_embeddings is None or old_hashes is None or len(old_hashes) != len(old_embeddings):
+                old_embeddings, old_hashes = None, []
+            
+            if old_hashes == hashes:
+                if hashes_by_source.get(name) != hashes or manifest is None or manifest['model'] is None:
+                    hashes_by_source[name] = hashes
+                    save_manifest(self.embeddings_dir, hashes_by_source, self.embedding_model_id)
+                continue
+            
+            reuse, missing = plan_update(old_hashes, hashes)
+            logger.info("%s：复用 %d 条，新增或修改 %d 条", desc, len(hashes) - len(missing), len(missing))
+            compute = self.embedding_builder or self.compute_embeddings
+            new_embeddings = compute([texts[i] for i in missing], batch_size, desc=desc)
+            if old_embeddings is not None:
+                old_embeddings = np.asarray(old_embeddings, dtype=np.float32).reshape(len(old_embeddings), -1)
+                dim = old_embeddings.shape[1]
+            else:
+                dim = new_embeddings.shape[1]
+            embeddings = np.empty((len(hashes), dim), dtype=np.float32)
+            if len(missing) < len(hashes):
+                embeddings[reuse >= 0] = old_embeddings[reuse[reuse >= 0]]
+            if len(missing) > 0:
+                embeddings[missing] = new_embeddings
+            
+            self.save_embeddings(embeddings, filename)
+            hashes_by_source[name] = hashes
+            save_manifest(self.embeddings_dir, hashes_by_source, self.embedding_model_id)
+            changed = True
+        return changed
+
+    def compute_and_save_embeddings(self, batch_size=None):
+        """重新计算并保存全部嵌入向量"""
+        self.sync_embeddings(batch_size, full=True)
+        self.build_store(
+            self.load_embeddings('law_data_embeddings.npy'),
+            self.load_embeddings('law_qa_embeddings.npy')
+        )
+        self.build_indexes(rebuild=True)
+        logger.info("所有嵌入向量计算完成")
+
+    def embed_query(self, query):
+        """计算查询的嵌入向量，优先从查询嵌入缓存中读取"""
+        key = normalize_query_text(query)
+        query_embedding = self.query_cache.get(key)
+        if query_embedding is None:
+            with timed('query_embedding'):
+                if self.query_batcher is not None:
+                    query_embedding = self.query_batcher.embed(query)
+                else:
+                    query_embedding = self.embed_texts([query])[0]
+            # 缓存中的向量被多个请求共享，设为只读
+            query_embedding.flags.writeable = False
+            self.query_cache.set(key, query_embedding)
+        return query_embedding
+
+    def embed_queries(self, queries):
+        """
+        批量计算查询的嵌入向量
+        缓存未命中的查询去重后按 batch_size 分批做前向计算，不经过微批调度
+        :return: 形状为 (len(queries), dim) 的 float32 矩阵
+        """
+        keys = [normalize_query_text(query) for query in queries]
+        embeddings = {key: self.query_cache.get(key) for key in keys}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if embeddings[key] is None:
+                missing.setdefault(key, query)
+        if missing:
+            texts = list(missing.values())
+            with timed('query_embedding'):
+                computed = np.concatenate([
+                    self.embed_texts(texts[start:start + self.batch_size])
+                    for start in range(0, len(texts), self.batch_size)
+                ])
+            for key, embedding in zip(missing, computed):
+                embedding.flags.writeable = False
+                self.query_cache.set(key, embedding)
+                embeddings[key] = embedding
+        return np.stack([embeddings[key] for key in keys])
+    
+    def cache_stats(self):
+        """缓存命中统计"""
+        return {
+            'query_embedding': self.query_cache.stats(),
+            'retrieval_result': self.result_cache.stats(),
+            'query_batching': self.query_batcher.stats() if self.query_batcher is not None else None,
+        }
+
+    def search_source(self, index, lexical_index, query, query_embedding, top_k, similarity_threshold, nprobe=None):
+        """
+        在一个来源中检索
+        没有 BM25 索引时只做向量检索；否则向量检索和 BM25 各取 hybrid_candidates 个候选，
+        按倒数排名融合后排序。阈值始终作用于余弦相似度，与纯向量检索含义一致。
+        :return: (similarities, indices)，按最终排名排序
+        """
+        if lexical_index is None:
+            similarities, indices = index.search(query_embedding, top_k, nprobe=nprobe)
+            keep = similarities > similarity_threshold
+            return similarities[keep], indices[keep]
         
-        # 计算问答数据的嵌入向量
-        print("计算问答数据嵌入向量...")
-        self.law_qa_embeddings = []
-        for _, row in tqdm(self.law_qa.iterrows(), total=len(self.law_qa), desc="计算问答数据嵌入"):
-            result = self.text_embedding({'source_sentence': [row['data']]})
-            embedding = result['text_embedding']
-            self.law_qa_embeddings.append(embedding)
-        self.law_qa_embeddings = np.array(self.law_qa_embeddings)
-        self.save_embeddings(self.law_qa_embeddings, 'law_qa_embeddings.npy')
+        depth = max(top_k, self.hybrid_candidates)
+        prefilter = len(index) >= self.lexical_prefilter_min_docs
+        with timed('lexical_search'):
+            _, lexical_indices = lexical_index.search(query, max(depth, self.lexical_prefilter_size) if prefilter else depth)
+        if prefilter and len(lexical_indices) >= depth:
+            # 大语料只对词法命中的候选计算向量相似度
+            _, dense_indices = index.search(query_embedding, depth, candidates=lexical_indices)
+        else:
+            _, dense_indices = index.search(query_embedding, depth, nprobe=nprobe)
+        _, fused_indices = reciprocal_rank_fusion([dense_indices, lexical_indices[:depth]])
         
-        print("所有嵌入向量计算完成")
-
-    def find_relevant_cases(self, query, law_top_k=3, qa_top_k=3, similarity_threshold=0.3):
+        # 计算融合后候选的余弦相似度，按阈值筛选并保持融合排名
+        similarities, scored_indices = index.search(query_embedding, len(fused_indices), candidates=fused_indices)
+        similarity_by_id = dict(zip(scored_indices.tolist(), similarities.tolist()))
+        similarities = np.array([similarity_by_id[i] for i in fused_indices.tolist()], dtype=np.float32)
+        keep = similarities > similarity_threshold
+        return similarities[keep][:top_k], fused_indices[keep][:top_k]
+    
+    def retrieve(self, query, law_top_k=3, qa_top_k=3, similarity_threshold=0.3, nprobe=None):
         """
-        查找与查询最相关的案例
+        检索与查询最相关的法条和问答片段
         :param query: 用户查询
         :param law_top_k: 返回的法条数量
         :param qa_top_k: 返回的问答数量
         :param similarity_threshold: 相似度阈值
-        :return: 相关案例列表
+        :param nprobe: 近似索引扫描的簇数量，仅对 ivf 索引生效
+        :return: [{'source': 'law' / 'qa', 'row': 行号, 'score': 余弦相似度, 'text': 片段}]，
+                 法条在前，同一来源内按相关度排序
         """
-        # 计算查询的嵌入向量
-        query_result = self.text_embedding({'source_sentence': [query]})
-        query_embedding = np.array(query_result['text_embedding']).reshape(1, -1)
-        
-        # 确保法律条文嵌入向量的维度正确
-        if len(self.law_data_embeddings.shape) == 3:
-            self.law_data_embeddings = self.law_data_embeddings.squeeze(1)
-        if len(self.law_qa_embeddings.shape) == 3:
-            self.law_qa_embeddings = self.law_qa_embeddings.squeeze(1)
+        # 相同查询和参数的结果直接从缓存返回，跳过模型推理和相似度计算
+        cache_key = self.result_cache.make_key(query, 'retrieve', law_top_k, qa_top_k, similarity_threshold, nprobe)
+        cached_hits = self.result_cache.get(cache_key)
+        if cached_hits is not None:
+            return [dict(hit) for hit in cached_hits]
         
-        # 计算与法律条文的相似度
-        law_similarities = cosine_similarity(query_embedding, self.law_data_embeddings)[0]
-        # 筛选相似度高于阈值的案例
-        law_mask = law_similarities > similarity_threshold
-        law_indices = np.where(law_mask)[0]
-        # 如果有满足条件的案例，取law_top_k个最相关的
-        if len(law_indices) > 0:
-            law_indices = law_indices[np.argsort(law_similarities[law_indices])[-law_top_k:][::-1]]
-        
-        # 计算与问答数据的相似度
-        qa_similarities = cosine_similarity(query_embedding, self.law_qa_embeddings)[0]
-        # 筛选相似度高于阈值的问答
-        qa_mask = qa_similarities > similarity_threshold
-        qa_indices = np.where(qa_mask)[0]
-        # 如果有满足条件的问答，取qa_top_k个最相关的
-        if len(qa_indices) > 0:
-            qa_indices = qa_indices[np.argsort(qa_similarities[qa_indices])[-qa_top_k:][::-1]]
-        
-        # 获取相关案例
-        relevant_laws = []
-        if len(law_indices) > 0:
-            relevant_laws = self.law_data.iloc[law_indices]['data'].tolist()
+        # 计算查询的嵌入向量
+        query_embedding = self.embed_query(query)
         
-        relevant_qas = []
-        if len(qa_indices) > 0:
-            relevant_qas = self.law_qa.iloc[qa_indices]['data'].tolist()
+        def source_hits(source, index, lexical_index, top_k):
+            # 检索最相关的块，筛选相似度高于阈值的块后按所属行去重并合并相邻的块
+            similarities, indices = self.search_source(
+                index, lexical_index, query, query_embedding,
+                self.chunk_search_depth(source, top_k), similarity_threshold, nprobe
+            )
+            return [
+                {'source': SOURCE_NAMES[source], 'row': row, 'score': score, 'text': text}
+                for row, score, text in self.get_passages(source, indices, similarities, top_k)
+            ]
         
-        # 合并结果并标记来源
-        results = []
-        for i, law in enumerate(relevant_laws, 1):
-            results.append(f"[法条{i}] {law}")
-        for i, qa in enumerate(relevant_qas, 1):
-            results.append(f"[问答{i}] {qa}")
+        law_hits, qa_hits = self.search_sources(source_hits, law_top_k, qa_top_k)
+        hits = law_hits + qa_hits
+        self.result_cache.set(cache_key, hits)
+        return [dict(hit) for hit in hits]
+    
+    def search_sources(self, source_hits, law_top_k, qa_top_k):
+        """
+        分别在法条和问答中调用 source_hits(source, index, lexical_index, top_k)
+        :return: (法条的结果, 问答的结果)
+        """
+        law_args = (SOURCE_LAW, self.law_data_index, self.law_data_lexical, law_top_k)
+        qa_args = (SOURCE_QA, self.law_qa_index, self.law_qa_lexical, qa_top_k)
+        executor = self.source_executor
+        if executor is None:
+            return source_hits(*law_args), source_hits(*qa_args)
+        # 分片模式下法条在另一个线程中检索，同时在当前线程中检索问答
+        law_future = executor.submit(contextvars.copy_context().run, source_hits, *law_args)
+        qa_hits = source_hits(*qa_args)
+        return law_future.result(), qa_hits
+    
+    def retrieve_batch(self, queries, law_top_k=3, qa_top_k=3, similarity_threshold=0.3, nprobe=None):
+        """
+        批量检索，参数含义与 retrieve 相同
+        未命中结果缓存的查询一次批量计算嵌入，每个来源用一次矩阵乘法计算全部查询的相似度；
+        hybrid 模式下各查询的融合排序仍逐条进行。结果与逐条调用 retrieve 一致（得分可能有浮点舍入差异），
+        并写入同一个结果缓存。
+        :param queries: 查询列表
+        :return: 与 queries 一一对应的检索结果列表
+        """
+        queries = [str(query) for query in queries]
+        keys = [
+            self.result_cache.make_key(query, 'retrieve', law_top_k, qa_top_k, similarity_threshold, nprobe)
+            for query in queries
+        ]
+        results = {}
+        pending = {}
+        for key, query in zip(keys, queries):
+            if key in results or key in pending:
+                continue
+            cached_hits = self.result_cache.get(key)
+            if cached_hits is None:
+                pending[key] = query
+            else:
+                results[key] = cached_hits
         
-        return results
+        if pending:
+            pending_queries = list(pending.values())
+            query_embeddings = self.embed_queries(pending_queries)
+            
+            def source_hits(source, index, lexical_index, top_k):
+                depth = self.chunk_search_depth(source, top_k)
+                if lexical_index is None:
+                    searched = [
+                        (similarities[keep], indices[keep])
+                        for similarities, indices in search_batch(index, query_embeddings, depth, nprobe=nprobe)
+                        for keep in [similarities > similarity_threshold]
+                    ]
+                else:
+                    searched = [
+                        self.search_source(index, lexical_index, query, query_embedding, depth, similarity_threshold, nprobe)
+                        for query, query_embedding in zip(pending_queries, query_embeddings)
+                    ]
+                return [
+                    [
+                        {'source': SOURCE_NAMES[source], 'row': row, 'score': score, 'text': text}
+                        for row, score, text in self.get_passages(source, indices, similarities, top_k)
+                    ]
+                    for similarities, indices in searched
+                ]
+            
+            law_hits, qa_hits = self.search_sources(source_hits, law_top_k, qa_top_k)
+            for key, law, qa in zip(pending, law_hits, qa_hits):
+                results[key] = law + qa
+                self.result_cache.set(key, results[key])
+        return [[dict(hit) for hit in results[key]] for key in keys]
+    
+    def find_relevant_cases(self, query, law_top_k=3, qa_top_k=3, similarity_threshold=0.3, nprobe=None):
+        """
+        查找与查询最相关的案例
+        :param query: 用户查询
+        :param law_top_k: 返回的法条数量
+        :param qa_top_k: 返回的问答数量
+        :param similarity_threshold: 相似度阈值
+        :param nprobe: 近似索引扫描的簇数量，仅对 ivf 索引生效
+        :return: 相关案例列表
+        """
+        return format_hits(self.retrieve(query, law_top_k, qa_top_k, similarity_threshold, nprobe))
+
+
+def embed_in_batches(embed_texts, texts, batch_size, on_batch=None):
+    """
+    按长度排序后分批调用 embed_texts，同一批内的句子长度相近，padding 更少
+    :param on_batch: 每算完一批调用 on_batch(该批条数)
+    :return: 形状为 (len(texts), dim) 的 float32 矩阵，行顺序与 texts 一致
+    """
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    embeddings = None
+    for start in range(0, len(texts), batch_size):
+        batch_indices = order[start:start + batch_size]
+        batch_embeddings = embed_texts([texts[i] for i in batch_indices])
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+        # 按原始顺序写回
+        embeddings[batch_indices] = batch_embeddings
+        if on_batch is not None:
+            on_batch(len(batch_indices))
+    return embeddings
+
+
+def format_hits(hits):
+    """将检索结果格式化为带来源标记的文本，如 "[法条1] ..." 和 "[问答1] ..." """
+    labels = {'law': '法条', 'qa': '问答'}
+    counts = {}
+    results = []
+    for hit in hits:
+        counts[hit['source']] = counts.get(hit['source'], 0) + 1
+        results.append(f"[{labels[hit['source']]}{counts[hit['source']]}] {hit['text']}")
+    return results
+
+def _weak_method(method):
+    """不持有实例强引用的绑定方法"""
+    ref = weakref.WeakMethod(method)
+    
+    def call(*args, **kwargs):
+        return ref()(*args, **kwargs)
+    return call
+
+def _close_resources(query_batcher, shard_pool, source_executor):
+    if query_batcher is not None:
+        query_batcher.close()
+    if shard_pool is not None:
+        shard_pool.close()
+    if source_executor is not None:
+        source_executor.shutdown(wait=False)
 
 # 单例模式
 _data_processor = None
+# 保护单例的创建和替换，首次加载和语料热更新不会同时进行
+_reload_lock = threading.Lock()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+# 首次加载结束（成功或失败）时设置
+_warmup_done = threading.Event()
+# 首次加载的状态：idle（未开始）、loading、ready、failed
+_warmup = {'state': 'idle', 'stage': None, 'detail': {}, 'started_at': None, 'finished_at': None, 'error': None}
+
+def _report_warmup(stage, **detail):
+    _warmup.update(stage=stage, detail=detail)
 
 def get_data_processor():
+    """返回数据处理器单例，尚未加载时在当前线程中加载"""
     global _data_processor
     if _data_processor is None:
-        _data_processor = DataProcessor()
-    return _data_processor 
\ No newline at end of file
+        with _reload_lock:
+            if _data_processor is None:
+                _warmup_done.clear()
+                _warmup.update(state='loading', stage=None, detail={}, started_at=time.time(), error=None)
+                try:
+                    _data_processor = DataProcessor(progress=_report_warmup)
+                    _warmup.update(state='ready', stage=None, detail={}, finished_at=time.time())
+                except Exception as e:
+                    _warmup.update(state='failed', finished_at=time.time(), error=str(e))
+                    raise
+                finally:
+                    _warmup_done.set()
+    return _data_processor
+
+def peek_data_processor():
+    """返回已加载的数据处理器，尚未加载完成时返回 None，不会触发加载"""
+    return _data_processor
+
+def start_warmup():
+    """在后台线程中加载数据处理器（语料、嵌入模型、向量和索引），立即返回"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _data_processor is not None or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        _warmup.update(state='loading', started_at=time.time())
+        _warmup_done.clear()
+        _warmup_thread = threading.Thread(target=_warmup_worker, name='warmup', daemon=True)
+        _warmup_thread.start()
+
+def _warmup_worker():
+    try:
+        get_data_processor()
+        logger.info("数据处理器预热完成，耗时 %.1f 秒", _warmup['finished_at'] - _warmup['started_at'])
+    except Exception:
+        logger.exception("数据处理器预热失败")
+
+def wait_for_data_processor(timeout=None):
+    """
+    等待数据处理器加载完成
+    尚未开始加载时启动后台预热；超时或加载失败时返回 None，调用方可以不使用检索继续处理
+    """
+    if _data_processor is None:
+        if _warmup['state'] == 'idle':
+            start_warmup()
+        if _warmup['state'] != 'failed':
+            _warmup_done.wait(timeout)
+    return _data_processor
+
+def warmup_status():
+    """首次加载的进度，用于就绪检查"""
+    status = dict(_warmup, ready=_data_processor is not None)
+    if status['started_at'] is not None:
+        status['elapsed'] = (status['finished_at'] or time.time()) - status['started_at']
+    return status
+
+def reload_data_processor():
+    """
+    重新加载语料并热替换单例，无需重启服务
+    新的实例在后台构建（只计算新增或修改行的嵌入，复用已加载的模型），
+    构建完成后原子替换，正在处理的请求继续使用旧实例。
+    首次加载尚未完成时等待其结束；首次加载失败时可用于重试。
+    """
+    global _data_processor
+    with _reload_lock:
+        old_processor = _data_processor
+        text_embedding = old_processor.text_embedding if old_processor is not None else None
+        new_processor = DataProcessor(text_embedding=text_embedding)
+        _data_processor = new_processor
+        if old_processor is None:
+            _warmup.update(state='ready', stage=None, detail={}, finished_at=time.time(), error=None)
+            _warmup_done.set()
+        if old_processor is not None:
+            # 仍在使用旧实例的请求结束、旧实例被回收时再关闭其微批调度线程和分片检索进程池
+            old_processor.close_when_unreferenced()
+    return new_processor
@@ -0,0 +1,138 @@
+import json
+import os
+import zlib
+import numpy as np
+from lexical_index import tokenize
+
+EMBEDDING_MODEL = 'damo/nlp_corom_sentence-embedding_chinese-base'
+EMBEDDING_MODEL_REVISION = 'v1.0.0'
+# 嵌入向量清单中记录的模型标识，模型变化后已有的嵌入向量不能复用
+DEFAULT_EMBEDDING_MODEL_ID = f'modelscope:{EMBEDDING_MODEL}@{EMBEDDING_MODEL_REVISION}'
+# 导出的计算图格式，导出目录中 export.json 记录格式、计算图文件名和分词参数
+EXPORT_FORMATS = ('onnx', 'torchscript')
+EXPORT_METADATA = 'export.json'
+# 计算图的输入，顺序与导出时一致
+GRAPH_INPUTS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+
+class HashingEmbedding:
+    """
+    确定性的本地嵌入，用于基准测试和离线测试，不需要下载模型
+    将文本的字二元组按 CRC32 哈希到 dim 维后做 L2 归一化，字面相近的文本向量也相近。
+    调用方式与 modelscope 的 sentence_embedding pipeline 相同。
+    """
+
+    def __init__(self, dim=256):
+        self.dim = int(dim)
+        self.model_id = f'stub:hashing-{self.dim}'
+
+    def __call__(self, inputs):
+        sentences = inputs['source_sentence'] if isinstance(inputs, dict) else [inputs]
+        embeddings = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            buckets = [zlib.crc32(token.encode('utf-8')) % self.dim for token in tokenize(sentence)]
+            if buckets:
+                embeddings[row] = np.bincount(buckets, minlength=self.dim)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return {'text_embedding': embeddings / norms}
+
+
+class ExportedEmbedding:
+    """
+    导出为 ONNX / TorchScript 计算图的 CoROM 模型（由 embedding_export.py 生成），
+    CPU 上推理不经过 modelscope pipeline 的前后处理和 autograd，可选 int8 动态量化。
+    调用方式与 modelscope 的 sentence_embedding pipeline 相同。
+    """
+
+    def __init__(self, directory, threads=0):
+        """
+        :param directory: 导出目录，包含计算图、分词器文件和 export.json
+        :param threads: 算子内并行的线程数，为 0 时使用推理库的默认值
+        """
+        with open(os.path.join(directory, EXPORT_METADATA), 'r', encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        self.format = self.metadata['format']
+        self.max_length = self.metadata.get('max_length')
+        # 计算图（尤其是 int8 量化后）的向量与原模型有差异，使用不同的模型标识，切换后端时重新计算语料嵌入
+        self.model_id = f"{self.format}{'-int8' if self.metadata.get('quantized') else ''}:{self.metadata['source']}"
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        graph_path = os.path.join(directory, self.metadata['graph'])
+        if self.format == 'onnx':
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = int(threads)
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = onnxruntime.InferenceSession(graph_path, options, providers=['CPUExecutionProvider'])
+            self.input_names = [graph_input.name for graph_input in self.session.get_inputs()]
+        elif self.format == 'torchscript':
+            import torch
+            if threads:
+                torch.set_num_threads(int(threads))
+            self.module = torch.jit.load(graph_path, map_location='cpu').eval()
+        else:
+            raise ValueError(f"未知的计算图格式: {self.format}，可选: {', '.join(EXPORT_FORMATS)}")
+
+    def encode(self, sentences):
+        tokens = self.tokenizer(
+            list(sentences), padding=True, truncation=True, max_length=self.max_length, return_tensors='np'
+        )
+        if self.format == 'onnx':
+            outputs = self.session.run(None, {name: tokens[name].astype(np.int64) for name in self.input_names})[0]
+        else:
+            import torch
+            with torch.no_grad():
+                outputs = self.module(*[torch.from_numpy(tokens[name].astype(np.int64)) for name in GRAPH_INPUTS]).numpy()
+        return np.asarray(outputs, dtype=np.float32)
+
+    def __call__(self, inputs):
+        sentences = inputs['source_sentence'] if isinstance(inputs, dict) else [inputs]
+        return {'text_embedding': self.encode([str(sentence) for sentence in sentences])}
+
+
+def default_export_dir(backend, quantized=False):
+    """导出目录的默认位置：backend/models/corom-<格式>[-int8]"""
+    suffix = '-int8' if quantized else ''
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', f'corom-{backend}{suffix}')
+
+
+def embed_sentences(text_embedding, texts):
+    """对一批文本做一次前向计算，返回形状为 (len(texts), dim) 的 float32 矩阵"""
+    result = text_embedding({'source_sentence': list(texts)})
+    return np.asarray(result['text_embedding'], dtype=np.float32).reshape(len(texts), -1)
+
+
+def load_text_embedding(backend=None):
+    """
+    加载文本嵌入模型
+    :param backend: modelscope（默认，CoROM 中文句向量模型）、onnx / torchscript（导出的计算图，
+                    目录由 EMBEDDING_MODEL_PATH 指定，线程数由 EMBEDDING_THREADS 指定）
+                    或 stub（HashingEmbedding），为 None 时读取环境变量 EMBEDDING_BACKEND
+    """
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'modelscope')
+    if backend == 'stub':
+        return HashingEmbedding(int(os.getenv('STUB_EMBEDDING_DIM', 256)))
+    if backend in EXPORT_FORMATS:
+        directory = os.getenv('EMBEDDING_MODEL_PATH') or default_export_dir(backend)
+        embedding = ExportedEmbedding(directory, threads=int(os.getenv('EMBEDDING_THREADS', 0)))
+        if embedding.format != backend:
+            raise ValueError(f"{directory} 中的计算图格式为 {embedding.format}，与 EMBEDDING_BACKEND={backend} 不一致")
+        return embedding
+    if backend != 'modelscope':
+        raise ValueError(f"未知的嵌入后端: {backend}，可选: modelscope, {', '.join(EXPORT_FORMATS)}, stub")
+    # 只在需要真实模型时才导入 modelscope（及其依赖的 torch）
+    from modelscope.pipelines import pipeline
+    from modelscope.utils.constant import Tasks
+    return pipeline(
+        Tasks.sentence_embedding,
+        model=EMBEDDING_MODEL,
+        model_revision=EMBEDDING_MODEL_REVISION
+    )
+
+
+def embedding_model_id(text_embedding):
+    """嵌入模型的标识，用于判断已保存的嵌入向量是否由同一个模型生成"""
+    return getattr(text_embedding, 'model_id', DEFAULT_EMBEDDING_MODEL_ID)
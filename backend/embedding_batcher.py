@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    查询嵌入的微批调度器
+    并发到达的查询先进入队列，后台线程最多等待 max_wait_ms 毫秒或凑满 max_batch_size 条后，
+    合并为一次批量前向计算，再把各自的向量交还给等待的请求。
+    max_wait_ms 越大批次越满、吞吐越高，但低负载时单个请求的延迟也越高。
+    """
+
+    def __init__(self, embed_fn, max_batch_size=16, max_wait_ms=5):
+        """
+        :param embed_fn: 批量计算函数，输入文本列表，返回形状为 (len(texts), dim) 的矩阵
+        :param max_batch_size: 每批最多合并的查询数量
+        :param max_wait_ms: 收到第一条查询后最多等待的毫秒数
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        """提交一条查询，返回 Future，结果为一维 float32 向量"""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher 已关闭")
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text, timeout=None):
+        """提交查询并等待结果"""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self):
+        """阻塞直到收到第一条查询，然后在等待窗口内继续收集"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号放回队列，当前批次处理完后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            # 跳过已被调用方取消的请求
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            # 同一批次中的重复查询只计算一次
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = np.asarray(self.embed_fn(unique_texts), dtype=np.float32)
+                embeddings = embeddings.reshape(len(unique_texts), -1)
+                positions = {text: i for i, text in enumerate(unique_texts)}
+                for text, future in batch:
+                    future.set_result(embeddings[positions[text]].copy())
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+
+    def close(self):
+        """停止后台线程，已提交的查询会先处理完"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            # 由后台线程自身触发关闭（如实例回收时的 finalizer）时不等待自己结束
+            if threading.current_thread() is not self._worker:
+                self._worker.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+            }
@@ -0,0 +1,228 @@
+# embedding_export.py
+"""
+将 CoROM 句向量模型导出为 ONNX 或 TorchScript 计算图，供 EMBEDDING_BACKEND=onnx / torchscript 使用
+导出的计算图输入为分词结果，输出为 [CLS] 位置的向量（与 modelscope pipeline 的句向量一致），
+可选对 Linear 层做 int8 动态量化以减小模型并加快 CPU 推理。
+导出后用同一批文本比较导出模型与 modelscope pipeline 的向量（余弦相似度的偏差、最近邻是否一致），
+并测量两者单条查询的延迟和批量计算的吞吐量。
+
+用法：
+    python embedding_export.py --format onnx
+    python embedding_export.py --format onnx --quantize --threads 4
+    python embedding_export.py --format torchscript --output models/corom-torchscript --parity-texts 500
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+import numpy as np
+from benchmark import embedding_latency, load_base_corpus, sample_queries
+from data_processor import embed_in_batches
+from embedding_backends import (
+    ExportedEmbedding, load_text_embedding, default_export_dir, embed_sentences,
+    EMBEDDING_MODEL, EMBEDDING_MODEL_REVISION, DEFAULT_EMBEDDING_MODEL_ID,
+    EXPORT_FORMATS, EXPORT_METADATA, GRAPH_INPUTS
+)
+from log_utils import configure_logging
+
+# 导出时用于追踪计算图的示例输入，批大小和序列长度在导出后都是动态的
+TRACE_TEXTS = ['劳动合同解除后用人单位应当支付经济补偿', '借款合同']
+
+
+def reference_model_dir():
+    """modelscope 缓存中原模型的目录，不存在时下载"""
+    from modelscope.hub.snapshot_download import snapshot_download
+    return snapshot_download(EMBEDDING_MODEL, revision=EMBEDDING_MODEL_REVISION)
+
+
+def reference_max_length(model_dir):
+    """modelscope 预处理的最大序列长度，导出模型分词时使用相同的截断长度"""
+    try:
+        with open(os.path.join(model_dir, 'configuration.json'), 'r', encoding='utf-8') as f:
+            preprocessor = json.load(f).get('preprocessor', {})
+    except (OSError, ValueError):
+        return None
+    return preprocessor.get('max_length') or preprocessor.get('sequence_length')
+
+
+def sentence_encoder(model_dir):
+    """加载原模型的 BERT 编码器，包装为输入分词结果、输出 [CLS] 向量的模块"""
+    import torch
+    from transformers import BertModel
+
+    class SentenceEncoder(torch.nn.Module):
+        def __init__(self, bert):
+            super().__init__()
+            self.bert = bert
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+            return outputs[0][:, 0]
+
+    bert = BertModel.from_pretrained(model_dir, add_pooling_layer=False, torchscript=True)
+    return SentenceEncoder(bert).eval()
+
+
+def export_model(output_dir, export_format='onnx', quantize=False, model_dir=None, max_length=None, opset=13):
+    """
+    导出计算图、分词器和 export.json 到 output_dir
+    先写入临时目录，完成后替换 output_dir，导出失败时不会留下不完整的目录
+    :return: export.json 的内容
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"未知的计算图格式: {export_format}，可选: {', '.join(EXPORT_FORMATS)}")
+    import torch
+    from transformers import BertTokenizerFast
+
+    model_dir = model_dir or reference_model_dir()
+    max_length = max_length or reference_max_length(model_dir)
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    encoder = sentence_encoder(model_dir)
+    sample = tokenizer(TRACE_TEXTS, padding=True, return_tensors='pt')
+    example = tuple(sample[name] for name in GRAPH_INPUTS)
+
+    tmp_dir = f"{output_dir.rstrip(os.sep)}.tmp.{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        if export_format == 'onnx':
+            graph = 'model.onnx'
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in GRAPH_INPUTS}
+            dynamic_axes['embedding'] = {0: 'batch'}
+            with torch.no_grad():
+                torch.onnx.export(
+                    encoder, example, os.path.join(tmp_dir, graph), input_names=list(GRAPH_INPUTS),
+                    output_names=['embedding'], dynamic_axes=dynamic_axes, opset_version=opset
+                )
+            if quantize:
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                quantize_dynamic(os.path.join(tmp_dir, graph), os.path.join(tmp_dir, 'model.int8.onnx'),
+                                 weight_type=QuantType.QInt8)
+                os.remove(os.path.join(tmp_dir, graph))
+                graph = 'model.int8.onnx'
+        else:
+            if quantize:
+                encoder = torch.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+            graph = 'model.int8.pt' if quantize else 'model.pt'
+            with torch.no_grad():
+                torch.jit.trace(encoder, example).save(os.path.join(tmp_dir, graph))
+        tokenizer.save_pretrained(tmp_dir)
+        metadata = {
+            'format': export_format,
+            'graph': graph,
+            'quantized': bool(quantize),
+            'source': DEFAULT_EMBEDDING_MODEL_ID,
+            'max_length': max_length,
+            'exported_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with open(os.path.join(tmp_dir, EXPORT_METADATA), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return metadata
+
+
+def parity_report(reference, candidate, texts, batch_size=32):
+    """
+    同一批文本在两个嵌入后端下的向量差异
+    cosine 是逐条文本两个向量的余弦相似度，drift = 1 - cosine；
+    neighbour_agreement 是每条文本在这批文本中的最近邻（不含自身）两边一致的比例，反映检索排序是否改变
+    """
+    if len(texts) == 0:
+        return {'texts': 0}
+    expected = embed_in_batches(lambda batch: embed_sentences(reference, batch), texts, batch_size)
+    actual = embed_in_batches(lambda batch: embed_sentences(candidate, batch), texts, batch_size)
+    if expected.shape != actual.shape:
+        raise ValueError(f"向量形状不一致: {expected.shape} != {actual.shape}")
+
+    def normalize(matrix):
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    expected, actual = normalize(expected), normalize(actual)
+    cosine = np.sum(expected * actual, axis=1)
+    report = {
+        'texts': len(texts),
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+        'mean_drift': float(1 - cosine.mean()),
+        'max_drift': float(1 - cosine.min()),
+        'max_abs_diff': float(np.abs(expected - actual).max()),
+    }
+    if len(texts) > 1:
+        neighbours = []
+        for matrix in (expected, actual):
+            similarities = matrix @ matrix.T
+            np.fill_diagonal(similarities, -np.inf)
+            neighbours.append(np.argmax(similarities, axis=1))
+        report['neighbour_agreement'] = float(np.mean(neighbours[0] == neighbours[1]))
+    return report
+
+
+def parity_texts(count, seed=0):
+    """检查一致性用的文本：一半是完整的语料行（较长，会被截断），一半是截取的查询片段"""
+    law, qa = load_base_corpus()
+    corpus = law + qa
+    rows = random.Random(seed).sample(corpus, min(len(corpus), count - count // 2))
+    return rows + sample_queries(corpus, count // 2, seed=seed)
+
+
+def format_report(report):
+    """将一致性检查和速度测量的结果格式化为便于阅读的文本"""
+    lines = [f"== 导出模型：{report['export']['format']}"
+             f"{'（int8 动态量化）' if report['export']['quantized'] else ''}  {report['output']}"]
+    parity = report.get('parity')
+    if parity and parity.get('texts'):
+        lines.append(f"  一致性 {parity['texts']} 条  平均余弦 {parity['mean_cosine']:.6f}  最小余弦 {parity['min_cosine']:.6f}"
+                     f"  最大偏差 {parity['max_drift']:.2e}  最近邻一致 {parity.get('neighbour_agreement', 1.0):.3f}")
+    for name, stats in report.get('speed', {}).items():
+        latency = stats['query_latency']
+        lines.append(f"  {name:<12} 单条查询 p50 {latency['p50_ms']:8.3f} ms  p95 {latency['p95_ms']:8.3f} ms"
+                     f"  p99 {latency['p99_ms']:8.3f} ms")
+        for batch_size, throughput in stats['throughput'].items():
+            lines.append(f"  {name:<12} 批大小 {batch_size:<4} {throughput['sentences_per_second']:10.1f} 句/秒")
+    return "\n".join(lines)
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description="导出 ONNX / TorchScript 句向量模型，检查与原模型的一致性并测量 CPU 推理速度")
+    parser.add_argument('--format', default='onnx', choices=EXPORT_FORMATS, help="计算图格式")
+    parser.add_argument('--quantize', action='store_true', help="对 Linear 层做 int8 动态量化")
+    parser.add_argument('--output', default=None, help="导出目录，默认 models/corom-<格式>[-int8]")
+    parser.add_argument('--model-dir', default=None, help="原模型目录，默认从 modelscope 缓存读取")
+    parser.add_argument('--max-length', type=int, default=None, help="分词截断长度，默认与原模型的预处理一致")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('EMBEDDING_THREADS', 0)),
+                        help="测量速度时算子内并行的线程数，0 表示推理库的默认值")
+    parser.add_argument('--parity-texts', type=int, default=200, help="检查一致性和测量速度的文本数量，0 表示跳过")
+    parser.add_argument('--batch-sizes', default='1,8,32', help="测量吞吐量的批大小，逗号分隔")
+    parser.add_argument('--skip-export', action='store_true', help="不重新导出，只检查 --output 中已有的模型")
+    parser.add_argument('--json', default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    output = args.output or default_export_dir(args.format, args.quantize)
+    if not args.skip_export:
+        export_model(output, args.format, quantize=args.quantize, model_dir=args.model_dir, max_length=args.max_length)
+    exported = ExportedEmbedding(output, threads=args.threads)
+    report = {'output': output, 'export': exported.metadata}
+    if args.parity_texts:
+        texts = parity_texts(args.parity_texts)
+        reference = load_text_embedding('modelscope')
+        batch_sizes = [int(value) for value in args.batch_sizes.split(',') if value]
+        report['parity'] = parity_report(reference, exported, texts)
+        report['speed'] = {
+            'modelscope': embedding_latency(reference, texts, batch_sizes),
+            exported.model_id.split(':')[0]: embedding_latency(exported, texts, batch_sizes),
+        }
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+from vector_index import normalize_rows
+from quantization import QUANTIZERS, Int8Matrix, PQMatrix, PQ_TRAIN_SAMPLES, iter_chunks
+from file_utils import atomic_save_npy
+
+# 数据来源编号，对应 sources 列中的取值
+SOURCE_LAW = 0
+SOURCE_QA = 1
+SOURCE_NAMES = {
+    SOURCE_LAW: 'law',
+    SOURCE_QA: 'qa',
+}
+
+# float32 / float16 直接保存归一化后的向量；int8 / pq 保存量化编码，得分为近似值
+SUPPORTED_DTYPES = ('float32', 'float16') + tuple(QUANTIZERS)
+
+
+class EmbeddingStore:
+    """
+    紧凑的嵌入向量存储
+    法条与问答的向量在构建时一次性 L2 归一化，按来源依次拼接成一个矩阵，
+    另有一列 sources 记录每一行的来源编号。同一来源的行是连续的，
+    segment() 返回的是矩阵切片（视图），不会复制数据。
+    """
+
+    def __init__(self, vectors, sources):
+        self.vectors = vectors
+        self.sources = np.asarray(sources, dtype=np.int8)
+        if len(self.vectors) != len(self.sources):
+            raise ValueError("向量数量与来源列长度不一致")
+        counts = np.bincount(self.sources, minlength=len(SOURCE_NAMES))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    @classmethod
+    def build(cls, embeddings_by_source, dtype='float32', pq_subvectors=None):
+        """
+        由各来源的原始嵌入向量构建存储
+        :param embeddings_by_source: {来源编号: 嵌入向量矩阵}，可以是 mmap 方式加载的 .npy
+        :param dtype: 存储精度 float32 / float16 / int8 / pq
+        :param pq_subvectors: pq 的子空间数量，默认每个子空间约 8 维
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的存储精度: {dtype}，可选: {', '.join(SUPPORTED_DTYPES)}")
+        sources = np.concatenate([
+            np.full(len(embeddings_by_source[source]), source, dtype=np.int8) for source in sorted(SOURCE_NAMES)
+        ])
+        if dtype not in QUANTIZERS:
+            parts = [normalize_rows(embeddings_by_source[source], dtype=dtype) for source in sorted(SOURCE_NAMES)]
+            return cls(np.ascontiguousarray(np.concatenate(parts)), sources)
+
+        # 量化存储：所有来源共用一套参数，逐块从（可能是 mmap 的）输入读取、归一化后直接编码到预先分配的数组，
+        # 不生成完整的 float32 归一化矩阵；pq 的码本在采样的行上训练
+        dim = next((np.shape(embeddings)[1] for embeddings in embeddings_by_source.values() if len(embeddings)), 0)
+        if dtype == PQMatrix.kind:
+            codebooks = PQMatrix.train(cls._normalized_sample(embeddings_by_source, PQ_TRAIN_SAMPLES),
+                                       subvectors=pq_subvectors)
+            codes = np.empty((len(sources), len(codebooks)), dtype=np.uint8)
+        else:
+            codes = np.empty((len(sources), dim), dtype=np.int8)
+            scales = np.empty(len(sources), dtype=np.float32)
+        row = 0
+        for source in sorted(SOURCE_NAMES):
+            embeddings = embeddings_by_source[source]
+            for start, end in iter_chunks(len(embeddings)):
+                chunk = normalize_rows(embeddings[start:end])
+                rows = slice(row + start, row + end)
+                if dtype == PQMatrix.kind:
+                    codes[rows] = PQMatrix.encode(chunk, codebooks=codebooks).codes
+                else:
+                    encoded = Int8Matrix.encode(chunk)
+                    codes[rows], scales[rows] = encoded.codes, encoded.scales
+            row += len(embeddings)
+        if dtype == PQMatrix.kind:
+            return cls(PQMatrix(codes, codebooks), sources)
+        return cls(Int8Matrix(codes, scales), sources)
+
+    @staticmethod
+    def _normalized_sample(embeddings_by_source, sample_size, seed=0):
+        """在所有来源的行中均匀采样，只读取并归一化被采样的行"""
+        counts = [len(embeddings_by_source[source]) for source in sorted(SOURCE_NAMES)]
+        total = sum(counts)
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(total, min(total, sample_size), replace=False))
+        parts, offset = [], 0
+        for source, count in zip(sorted(SOURCE_NAMES), counts):
+            local = sample_ids[(sample_ids >= offset) & (sample_ids < offset + count)] - offset
+            if len(local):
+                parts.append(normalize_rows(embeddings_by_source[source][local]))
+            offset += count
+        return np.concatenate(parts)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dtype(self):
+        return self.vectors.kind if self.quantized else self.vectors.dtype.name
+
+    @property
+    def quantized(self):
+        return not isinstance(self.vectors, np.ndarray)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.sources.nbytes
+
+    def segment(self, source):
+        """返回某个来源的向量切片，切片内的行号即该来源 CSV 中的行号"""
+        return self.vectors[self.offsets[source]:self.offsets[source + 1]]
+
+    def count(self, source):
+        return int(self.offsets[source + 1] - self.offsets[source])
+
+    @staticmethod
+    def paths(directory, dtype):
+        """(向量或量化编码文件, 来源列文件)；量化参数另存为 embedding_store.{dtype}.{名称}.npy"""
+        return (
+            os.path.join(directory, f'embedding_store.{dtype}.npy'),
+            os.path.join(directory, 'embedding_store.sources.npy'),
+        )
+
+    def save(self, directory):
+        vectors_path, sources_path = self.paths(directory, self.dtype)
+        if self.quantized:
+            arrays = self.vectors.to_arrays()
+            for name, array in arrays.items():
+                if name != 'codes':
+                    atomic_save_npy(os.path.join(directory, f'embedding_store.{self.dtype}.{name}.npy'), array)
+            # 编码文件最后写入，它的修改时间代表整个存储
+            atomic_save_npy(vectors_path, arrays['codes'])
+        else:
+            atomic_save_npy(vectors_path, self.vectors)
+        atomic_save_npy(sources_path, self.sources)
+
+    @classmethod
+    def load(cls, directory, dtype='float32', mmap=False):
+        """
+        加载已构建的存储，文件不存在时返回 None
+        :param mmap: 是否以只读内存映射方式加载向量矩阵，同一主机上的多个工作进程共享页缓存
+        """
+        vectors_path, sources_path = cls.paths(directory, dtype)
+        if not (os.path.exists(vectors_path) and os.path.exists(sources_path)):
+            return None
+        mmap_mode = 'r' if mmap else None
+        vectors = np.load(vectors_path, mmap_mode=mmap_mode)
+        if dtype in QUANTIZERS:
+            quantizer = QUANTIZERS[dtype]
+            arrays = {'codes': vectors}
+            for name in quantizer.ARRAYS[1:]:
+                path = os.path.join(directory, f'embedding_store.{dtype}.{name}.npy')
+                if not os.path.exists(path):
+                    return None
+                arrays[name] = np.load(path, mmap_mode=mmap_mode)
+            vectors = quantizer.from_arrays(arrays)
+        return cls(vectors, np.load(sources_path))
@@ -0,0 +1,28 @@
+import hashlib
+import os
+import numpy as np
+
+
+def atomic_save_npy(path, array):
+    """
+    先写入临时文件再原子替换，其它进程（包括以 mmap 方式读取的进程）
+    不会看到写了一半的文件
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def hash_file_stats(paths):
+    """由多个文件的大小和纳秒级修改时间计算 SHA-1 摘要（不读取文件内容），不存在的文件记为缺失"""
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            digest.update(b'<missing>')
+            continue
+        digest.update(f":{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()
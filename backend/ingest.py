@@ -0,0 +1,46 @@
+# ingest.py
+"""
+离线增量更新语料
+修改 law_data_3k.csv / law_QA.csv 后运行，只计算新增或修改行的嵌入向量并更新索引；
+指定 --reload-url 时通知正在运行的服务热加载新语料。
+
+用法：
+    python ingest.py
+    python ingest.py --full
+    python ingest.py --reload-url http://localhost:5000/admin/reload-corpus
+"""
+import argparse
+import os
+import httpx
+from dotenv import load_dotenv
+from data_processor import DataProcessor
+from log_utils import configure_logging
+
+load_dotenv()
+
+
+def notify_reload(url, token):
+    """请求服务端热加载语料"""
+    response = httpx.post(url, headers={'X-Admin-Token': token or ''}, timeout=600)
+    print(f"服务端响应 {response.status_code}: {response.text}")
+    response.raise_for_status()
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description="增量更新语料嵌入向量和索引")
+    parser.add_argument('--full', action='store_true', help="忽略已有向量，全部重新计算")
+    parser.add_argument('--batch-size', type=int, default=None, help="每批计算的句子数量")
+    parser.add_argument('--reload-url', default=None, help="更新完成后通知服务热加载的地址")
+    args = parser.parse_args()
+
+    # 构造时即完成同步：计算缺失的嵌入（--full 时全部重新计算）、更新存储和索引
+    processor = DataProcessor(batch_size=args.batch_size, full_rebuild=args.full)
+    print(f"语料版本：{processor.compute_corpus_version()}")
+
+    if args.reload_url:
+        notify_reload(args.reload_url, os.getenv('ADMIN_TOKEN'))
+
+
+if __name__ == "__main__":
+    main()
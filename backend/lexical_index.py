@@ -0,0 +1,115 @@
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+from vector_index import top_k_indices
+
+# 连续的汉字串切分为字二元组，连续的字母数字串作为一个词
+TOKEN_PATTERN = re.compile(r'[一-鿿]+|[0-9a-z]+')
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词
+    中文按字二元组切分（如"第二十三条"切分为 第二/二十/十三/三条），单个汉字保留为单字；
+    英文和数字按连续串切分并转为小写。
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    基于字二元组倒排表的 BM25 检索
+    倒排表以 CSR 形式保存：postings_offsets[t]:postings_offsets[t+1] 为第 t 个词的文档 id 和 BM25 权重，
+    权重在构建时预先算好，查询时只需对命中的倒排列表做累加。
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = float(k1)
+        self.b = float(b)
+        vocabulary = {}
+        doc_ids = []
+        term_ids = []
+        term_freqs = []
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        self.vocabulary = vocabulary
+        self.doc_count = len(doc_lengths)
+        doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        term_freqs = np.asarray(term_freqs, dtype=np.float32)
+
+        # 按词编号排序，得到每个词的倒排列表
+        order = np.argsort(term_ids, kind='stable')
+        doc_freqs = np.bincount(term_ids, minlength=len(vocabulary))
+        self.postings_offsets = np.concatenate([[0], np.cumsum(doc_freqs)]).astype(np.int64)
+        self.postings_docs = doc_ids[order]
+
+        idf = np.log(1 + (self.doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = doc_lengths.mean() if self.doc_count else 0.0
+        tf = term_freqs[order]
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[self.postings_docs] / max(avg_length, 1e-6))
+        self.postings_weights = idf[term_ids[order]] * tf * (self.k1 + 1) / (tf + norm)
+
+    def __len__(self):
+        return self.doc_count
+
+    def search(self, query, top_k):
+        """
+        检索与查询词重合度最高的文档
+        :param query: 查询文本
+        :param top_k: 返回数量
+        :return: (scores, indices)，只包含至少命中一个查询词的文档，按 BM25 得分从高到低排序
+        """
+        query_terms = Counter(tokenize(query))
+        postings = [
+            (self.vocabulary[term], count) for term, count in query_terms.items() if term in self.vocabulary
+        ]
+        if not postings or top_k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term_id, count in postings:
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            # 同一个词的倒排列表中文档 id 不重复，可以直接按下标累加
+            scores[self.postings_docs[start:end]] += count * self.postings_weights[start:end]
+        matched = np.flatnonzero(scores)
+        order = top_k_indices(scores[matched], top_k)
+        return scores[matched[order]], matched[order].astype(np.int64)
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """
+    倒数排名融合（RRF）：score(d) = Σ weight_i / (k + rank_i(d))，rank 从 1 开始
+    只依赖排名而不依赖原始得分，稠密检索的余弦相似度和 BM25 得分无需归一化即可融合。
+    :param rankings: 多个按相关度从高到低排序的文档 id 数组
+    :param k: 平滑常数，越大排名靠后的文档权重下降越慢
+    :param weights: 每个排名列表的权重，默认均为 1
+    :return: (scores, indices)，按融合得分从高到低排序
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(np.asarray(ranking).tolist(), 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    if not fused:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    indices = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], indices[order]
@@ -0,0 +1,476 @@
+# loadtest.py
+"""
+后端压测
+按脚本中的并发数依次运行：每个虚拟用户循环执行 /start-session、/set-system-prompt 和若干轮 /chat
+（按比例混合通用模式与法律模式、非流式与 /chat/stream），统计吞吐量、各接口的延迟分位数和错误率，
+并定期读取 /metrics 中的会话数、会话消息规模和进程常驻内存，观察会话存储随时间的内存增长。
+会话默认关闭语义答案缓存（重复的法律问题否则会直接命中缓存，测得的是缓存的延迟），--semantic-cache 开启；
+报告中同时给出语义答案缓存的命中和未命中次数。
+结果可保存为 JSON，下次运行时用 --compare 与之对比。
+
+压测时模型接口应指向 mock_llm.py，避免真实的调用费用和不稳定的外部延迟；
+--spawn 会在空闲端口上自动启动模拟接口和后端（DEEPSEEK_API_BASE 指向模拟接口），结束后关闭。
+
+用法：
+    python loadtest.py --spawn asgi --levels 1,8,32 --duration 30
+    python loadtest.py --spawn flask --llm-latency 1.0 --llm-token-rate 30 --json run.json
+    python loadtest.py --url http://localhost:5000 --levels 4,16 --law-ratio 0.3 --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+import httpx
+from benchmark import percentiles
+from log_utils import configure_logging
+
+GENERAL_QUESTIONS = [
+    '帮我写一段自我介绍',
+    '如何提高睡眠质量？',
+    '解释一下什么是机器学习',
+    '推荐几本适合入门的历史书',
+    '周末去郊游需要准备什么？',
+]
+LAW_QUESTIONS = [
+    '公司拖欠工资怎么办？',
+    '劳动合同到期不续签有经济补偿吗？',
+    '试用期被辞退可以要求赔偿吗？',
+    '交通事故对方全责，误工费怎么计算？',
+    '离婚时孩子的抚养权如何判定？',
+    '借钱不还又没有借条，还能起诉吗？',
+    '租房押金房东不退怎么办？',
+    '工伤认定需要哪些材料？',
+]
+FOLLOW_UPS = ['能再具体一点吗？', '还有其他需要注意的地方吗？', '请总结一下要点']
+GENERAL_PROMPT = '你是一个乐于助人的助手，用中文回答'
+LAW_PROMPT = '你是一名专业的中国律师，请依据法律条文回答用户的问题'
+
+# 从 /metrics 读取的内存相关指标
+MEMORY_METRICS = {
+    'rag_active_sessions': 'sessions',
+    'rag_session_messages': 'messages',
+    'rag_session_content_chars': 'content_chars',
+    'rag_process_resident_memory_bytes': 'rss_bytes',
+}
+# 从 /metrics 读取的语义答案缓存计数（带标签的指标按完整的序列名匹配）
+CACHE_METRICS = {
+    'rag_cache_hits_total{cache="semantic_answer"}': 'semantic_cache_hits',
+    'rag_cache_misses_total{cache="semantic_answer"}': 'semantic_cache_misses',
+}
+
+
+class Recorder:
+    """记录一个并发等级内每个请求的耗时和错误"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.requests = Counter()
+        self.sessions = 0
+        self.chat_turns = 0
+
+    def record(self, endpoint, seconds, error=None):
+        self.requests[endpoint] += 1
+        if error:
+            self.errors[f"{endpoint}:{error}"] += 1
+        else:
+            self.latencies[endpoint].append(seconds)
+
+    def observe(self, name, seconds):
+        """记录不对应独立请求的耗时，例如流式回复的首个内容事件"""
+        self.latencies[name].append(seconds)
+
+
+def error_kind(response=None, exception=None, body=None):
+    """请求失败的类型：HTTP 状态码、异常类名或响应中的 error 字段"""
+    if exception is not None:
+        return type(exception).__name__
+    if response.status_code != 200:
+        return f"http_{response.status_code}"
+    if isinstance(body, dict) and body.get('error'):
+        return 'error_response'
+    return None
+
+
+async def post_json(client, recorder, endpoint, path, payload=None):
+    """发送一个 JSON 请求并记录耗时，失败时返回 None"""
+    start = time.perf_counter()
+    try:
+        response = await client.post(path, json=payload)
+        body = response.json() if response.status_code == 200 else None
+        error = error_kind(response, body=body)
+    except (httpx.HTTPError, ValueError) as e:
+        body, error = None, error_kind(exception=e)
+    recorder.record(endpoint, time.perf_counter() - start, error)
+    return None if error else body
+
+
+async def stream_chat(client, recorder, payload):
+    """调用 /chat/stream，额外记录首个内容事件的延迟，返回完整回复，失败时返回 None"""
+    start = time.perf_counter()
+    parts = []
+    error = None
+    event = None
+    try:
+        async with client.stream('POST', '/chat/stream', json=payload) as response:
+            if response.status_code != 200:
+                error = error_kind(response)
+            else:
+                async for line in response.aiter_lines():
+                    if line.startswith('event:'):
+                        event = line[len('event:'):].strip()
+                    elif line.startswith('data:'):
+                        data = json.loads(line[len('data:'):])
+                        if event == 'error':
+                            error = 'error_event'
+                        elif event is None and data.get('content'):
+                            if not parts:
+                                recorder.observe('chat_stream_first_token', time.perf_counter() - start)
+                            parts.append(data['content'])
+                    elif not line:
+                        event = None
+    except (httpx.HTTPError, ValueError) as e:
+        error = error_kind(exception=e)
+    recorder.record('chat_stream', time.perf_counter() - start, error)
+    return None if error else "".join(parts)
+
+
+async def run_user(client, recorder, rng, deadline, law_ratio, turns, stream_ratio, deep_thinking,
+                   semantic_cache=False):
+    """一个虚拟用户：不断新建会话，设置模式后进行 turns 轮对话，直到 deadline"""
+    while time.monotonic() < deadline:
+        is_law_mode = rng.random() < law_ratio
+        body = await post_json(client, recorder, 'start_session', '/start-session')
+        if body is None:
+            # 后端不可用时稍作等待，避免空转
+            await asyncio.sleep(0.1)
+            continue
+        session_id = body['session_id']
+        recorder.sessions += 1
+        body = await post_json(client, recorder, 'set_system_prompt', '/set-system-prompt', {
+            'session_id': session_id,
+            'system_prompt': LAW_PROMPT if is_law_mode else GENERAL_PROMPT,
+            'is_law_mode': is_law_mode,
+            'semantic_cache': semantic_cache,
+        })
+        if body is None:
+            continue
+        messages = []
+        for turn in range(turns):
+            if time.monotonic() >= deadline:
+                break
+            questions = (LAW_QUESTIONS if is_law_mode else GENERAL_QUESTIONS) if turn == 0 else FOLLOW_UPS
+            # 与前端一致，每次发送完整的对话历史
+            messages.append({'role': 'user', 'content': rng.choice(questions)})
+            payload = {'session_id': session_id, 'messages': messages, 'deep_thinking': deep_thinking}
+            if rng.random() < stream_ratio:
+                content = await stream_chat(client, recorder, payload)
+            else:
+                body = await post_json(client, recorder, 'chat', '/chat', payload)
+                content = body['choices'][0]['message']['content'] if body is not None else None
+            if content is None:
+                break
+            recorder.chat_turns += 1
+            messages.append({'role': 'assistant', 'content': content})
+
+
+def parse_metrics(text):
+    """从 Prometheus 文本中读取 MEMORY_METRICS 和 CACHE_METRICS 中的指标"""
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, _, value = line.rpartition(' ')
+        key = MEMORY_METRICS.get(name) or CACHE_METRICS.get(name)
+        if key:
+            values[key] = float(value)
+    return values
+
+
+async def take_sample(client, timeline, started_at, level):
+    """读取一次 /metrics，追加到 timeline"""
+    try:
+        response = await client.get('/metrics')
+    except httpx.HTTPError:
+        return
+    if response.status_code == 200:
+        timeline.append({'t': round(time.monotonic() - started_at, 3), 'concurrency': level,
+                         **parse_metrics(response.text)})
+
+
+async def sample_memory(client, timeline, started_at, interval, level, stop):
+    """每 interval 秒读取一次 /metrics，直到 stop 被设置"""
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+            return
+        except asyncio.TimeoutError:
+            await take_sample(client, timeline, started_at, level)
+
+
+def summarize_level(level, recorder, elapsed, memory_start=None, memory_end=None):
+    """汇总一个并发等级的结果"""
+    total = sum(recorder.requests.values())
+    errors = sum(recorder.errors.values())
+    memory, cache = {}, {}
+    if memory_start and memory_end:
+        memory = {key: memory_end.get(key, 0) - memory_start.get(key, 0) for key in MEMORY_METRICS.values()}
+        cache = {key: memory_end[key] - memory_start[key] for key in CACHE_METRICS.values()
+                 if key in memory_start and key in memory_end}
+    return {
+        'concurrency': level,
+        'seconds': elapsed,
+        'sessions': recorder.sessions,
+        'chat_turns': recorder.chat_turns,
+        'chat_turns_per_second': recorder.chat_turns / elapsed if elapsed else 0.0,
+        'requests_per_second': total / elapsed if elapsed else 0.0,
+        'requests': dict(recorder.requests),
+        'error_rate': errors / total if total else 0.0,
+        'errors': dict(recorder.errors),
+        'latency': {endpoint: percentiles(samples) for endpoint, samples in recorder.latencies.items()},
+        'memory_growth': memory,
+        'semantic_cache': cache,
+    }
+
+
+async def run_levels(base_url, levels, duration, law_ratio=0.5, turns=2, stream_ratio=0.0, deep_thinking=True,
+                     sample_interval=1.0, timeout=120.0, seed=0, semantic_cache=False, transport=None):
+    """
+    依次在每个并发数下运行 duration 秒
+    :return: {'levels': [每个并发等级的汇总], 'timeline': [/metrics 采样]}
+    """
+    timeline = []
+    results = []
+    started_at = time.monotonic()
+    limits = httpx.Limits(max_connections=max(levels) + 1, max_keepalive_connections=max(levels) + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as client:
+        for level in levels:
+            recorder = Recorder()
+            stop = asyncio.Event()
+            level_timeline = []
+            # 开始和结束时各采样一次，作为本等级内存增长的起点和终点
+            await take_sample(client, level_timeline, started_at, level)
+            sampler = asyncio.ensure_future(
+                sample_memory(client, level_timeline, started_at, sample_interval, level, stop)
+            )
+            level_start = time.monotonic()
+            deadline = level_start + duration
+            await asyncio.gather(*[
+                run_user(client, recorder, random.Random(f"{seed}-{level}-{user}"), deadline,
+                         law_ratio, turns, stream_ratio, deep_thinking, semantic_cache)
+                for user in range(level)
+            ])
+            elapsed = time.monotonic() - level_start
+            stop.set()
+            await sampler
+            await take_sample(client, level_timeline, started_at, level)
+            timeline.extend(level_timeline)
+            results.append(summarize_level(
+                level, recorder, elapsed,
+                level_timeline[0] if level_timeline else None, level_timeline[-1] if level_timeline else None
+            ))
+    return {'levels': results, 'timeline': timeline}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url, process, timeout):
+    """轮询 url 直到返回 200；进程提前退出或超时时抛出 RuntimeError"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程已退出（返回码 {process.returncode}）：{url}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"等待 {url} 就绪超时")
+
+
+def backend_command(server, port):
+    """启动后端的命令：asgi 为 uvicorn + asgi_app，flask 为 flask run（多线程，不自动重载）"""
+    if server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1', '--port', str(port),
+                '--log-level', 'warning']
+    if server == 'flask':
+        return [sys.executable, '-m', 'flask', 'run', '--host', '127.0.0.1', '--port', str(port),
+                '--no-reload', '--with-threads']
+    raise ValueError(f"未知的后端类型: {server}，可选: asgi, flask")
+
+
+def spawn_services(server, llm_args, log_path, startup_timeout):
+    """
+    在空闲端口上启动模拟模型接口和后端，返回 (后端地址, 进程列表)
+    后端的 DEEPSEEK_API_BASE 指向模拟接口，其余环境变量（EMBEDDING_BACKEND、SESSION_STORE 等）继承当前进程
+    """
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    log = open(log_path, 'ab')
+    processes = []
+    try:
+        llm_port = free_port()
+        mock = subprocess.Popen(
+            [sys.executable, os.path.join(backend_dir, 'mock_llm.py'), '--port', str(llm_port), *llm_args],
+            cwd=backend_dir, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(mock)
+        wait_until_ready(f"http://127.0.0.1:{llm_port}/", mock, 30)
+
+        port = free_port()
+        env = dict(os.environ, DEEPSEEK_API_BASE=f"http://127.0.0.1:{llm_port}/v1", FLASK_APP='app')
+        env.setdefault('DEEPSEEK_API_KEY', 'mock')
+        backend = subprocess.Popen(backend_command(server, port), cwd=backend_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        processes.append(backend)
+        wait_until_ready(f"http://127.0.0.1:{port}/ready", backend, startup_timeout)
+        return f"http://127.0.0.1:{port}", processes
+    except Exception:
+        stop_services(processes)
+        raise
+    finally:
+        log.close()
+
+
+def stop_services(processes):
+    for process in reversed(processes):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def format_report(report):
+    """将压测结果格式化为便于阅读的文本"""
+    lines = []
+    for result in report['levels']:
+        lines.append(f"== 并发 {result['concurrency']}：{result['seconds']:.1f}s，会话 {result['sessions']}，"
+                     f"对话 {result['chat_turns']} 轮（{result['chat_turns_per_second']:.2f} 轮/秒），"
+                     f"请求 {result['requests_per_second']:.2f} 个/秒，错误率 {result['error_rate']:.2%}")
+        for endpoint, stats in sorted(result['latency'].items()):
+            if stats.get('count'):
+                lines.append(f"  {endpoint:<24} n={stats['count']:<6} p50 {stats['p50_ms']:9.1f} ms  "
+                             f"p95 {stats['p95_ms']:9.1f} ms  p99 {stats['p99_ms']:9.1f} ms")
+        for kind, count in sorted(result['errors'].items()):
+            lines.append(f"  错误 {kind}: {count}")
+        cache = result.get('semantic_cache')
+        if cache:
+            hits, misses = cache.get('semantic_cache_hits', 0), cache.get('semantic_cache_misses', 0)
+            lines.append(f"  语义答案缓存：命中 {hits:.0f}，未命中 {misses:.0f}"
+                         + (f"（命中率 {hits / (hits + misses):.1%}）" if hits + misses else ""))
+        growth = result['memory_growth']
+        if growth:
+            lines.append(f"  内存增长：会话 {growth['sessions']:+.0f}，消息 {growth['messages']:+.0f}，"
+                         f"内容 {growth['content_chars']:+.0f} 字符，常驻内存 {growth['rss_bytes'] / 1024 / 1024:+.1f} MB")
+    timeline = report.get('timeline') or []
+    if len(timeline) >= 2 and 'rss_bytes' in timeline[0]:
+        first, last = timeline[0], timeline[-1]
+        sessions = last.get('sessions', 0) - first.get('sessions', 0)
+        rss = last['rss_bytes'] - first['rss_bytes']
+        lines.append(f"== 全程：常驻内存 {first['rss_bytes'] / 1024 / 1024:.1f} → {last['rss_bytes'] / 1024 / 1024:.1f} MB，"
+                     f"会话 {first.get('sessions', 0):.0f} → {last.get('sessions', 0):.0f}"
+                     + (f"，每个新增会话约 {rss / sessions / 1024:.1f} KB" if sessions > 0 else ""))
+    return "\n".join(lines)
+
+
+def compare_reports(report, baseline):
+    """与之前保存的结果按并发数对比吞吐量、chat 的 p95 延迟、错误率和常驻内存增长"""
+    previous = {result['concurrency']: result for result in baseline['levels']}
+    lines = []
+    for result in report['levels']:
+        before = previous.get(result['concurrency'])
+        if before is None:
+            continue
+
+        def change(new, old):
+            return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+        parts = [f"吞吐 {before['chat_turns_per_second']:.2f} → {result['chat_turns_per_second']:.2f} 轮/秒"
+                 f"（{change(result['chat_turns_per_second'], before['chat_turns_per_second'])}）"]
+        for endpoint in ('chat', 'chat_stream'):
+            new, old = result['latency'].get(endpoint, {}), before['latency'].get(endpoint, {})
+            if new.get('count') and old.get('count'):
+                parts.append(f"{endpoint} p95 {old['p95_ms']:.1f} → {new['p95_ms']:.1f} ms（{change(new['p95_ms'], old['p95_ms'])}）")
+        parts.append(f"错误率 {before['error_rate']:.2%} → {result['error_rate']:.2%}")
+        new_rss, old_rss = result['memory_growth'].get('rss_bytes'), before['memory_growth'].get('rss_bytes')
+        if new_rss is not None and old_rss is not None:
+            parts.append(f"内存增长 {old_rss / 1024 / 1024:+.1f} → {new_rss / 1024 / 1024:+.1f} MB")
+        lines.append(f"== 并发 {result['concurrency']}：" + "，".join(parts))
+    return "\n".join(lines)
+
+
+def main():
+    configure_logging()
+    # 每个请求一条的 httpx 日志会淹没结果
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="后端压测：模拟会话与对话请求，统计吞吐量、延迟、错误率和内存增长")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="后端地址，使用 --spawn 时忽略")
+    parser.add_argument('--spawn', default=None, choices=('asgi', 'flask'), help="自动启动模拟模型接口和该类型的后端")
+    parser.add_argument('--levels', default='1,8,32', help="依次运行的并发数，逗号分隔")
+    parser.add_argument('--duration', type=float, default=30, help="每个并发数运行的秒数")
+    parser.add_argument('--law-ratio', type=float, default=0.5, help="法律模式会话的比例")
+    parser.add_argument('--turns', type=int, default=2, help="每个会话的对话轮数")
+    parser.add_argument('--stream-ratio', type=float, default=0.0, help="使用 /chat/stream 的对话比例")
+    parser.add_argument('--no-deep-thinking', action='store_true', help="法律模式下不检索相关案例")
+    parser.add_argument('--semantic-cache', action='store_true',
+                        help="会话开启语义答案缓存（默认关闭，重复的问题会直接命中缓存）")
+    parser.add_argument('--sample-interval', type=float, default=1.0, help="读取 /metrics 的间隔（秒）")
+    parser.add_argument('--timeout', type=float, default=120, help="单个请求的超时（秒）")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子，相同的种子产生相同的请求序列")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="模拟模型接口首个 token 的延迟（秒）")
+    parser.add_argument('--llm-jitter', type=float, default=0.2, help="模拟模型接口延迟的随机浮动比例")
+    parser.add_argument('--llm-token-rate', type=float, default=50, help="模拟模型接口每秒生成的 token 数")
+    parser.add_argument('--llm-tokens', type=int, default=100, help="模拟模型接口每次回复的 token 数")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="模拟模型接口返回错误的比例")
+    parser.add_argument('--startup-timeout', type=float, default=600, help="等待后端就绪的秒数")
+    parser.add_argument('--json', default=None, help="结果另存为 JSON 文件")
+    parser.add_argument('--compare', default=None, help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.levels.split(',') if value]
+    config = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+    processes = []
+    url = args.url
+    if args.spawn:
+        log_path = os.path.join(tempfile.gettempdir(), f'loadtest-{os.getpid()}.log')
+        print(f"启动模拟模型接口和 {args.spawn} 后端，日志：{log_path}")
+        url, processes = spawn_services(args.spawn, [
+            '--latency', str(args.llm_latency), '--jitter', str(args.llm_jitter),
+            '--token-rate', str(args.llm_token_rate), '--tokens', str(args.llm_tokens),
+            '--error-rate', str(args.llm_error_rate), '--seed', str(args.seed),
+        ], log_path, args.startup_timeout)
+    try:
+        report = asyncio.run(run_levels(
+            url, levels, args.duration, law_ratio=args.law_ratio, turns=args.turns,
+            stream_ratio=args.stream_ratio, deep_thinking=not args.no_deep_thinking,
+            sample_interval=args.sample_interval, timeout=args.timeout, seed=args.seed,
+            semantic_cache=args.semantic_cache
+        ))
+    finally:
+        stop_services(processes)
+    report['config'] = config
+    print(format_report(report))
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print(compare_reports(report, json.load(f)))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
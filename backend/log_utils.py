@@ -0,0 +1,20 @@
+import logging
+import os
+import random
+
+# 详细请求日志的采样比例，1 表示每个请求都输出，0 表示不输出
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+
+
+def configure_logging():
+    """按环境变量 LOG_LEVEL（默认 INFO）配置根日志记录器"""
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+
+def sampled(rate=None):
+    """本次请求是否输出详细日志"""
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
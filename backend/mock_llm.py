@@ -0,0 +1,172 @@
+# mock_llm.py
+"""
+本地模拟的 OpenAI 兼容模型接口，用于压测时替代 DeepSeek
+支持 POST /v1/chat/completions（非流式和 SSE 流式），首个 token 的延迟、生成速度、回复长度和错误率可配置，
+回复内容是固定文本，不消耗真实的模型调用额度。后端将 DEEPSEEK_API_BASE 指向 http://<host>:<port>/v1 即可。
+
+用法：
+    python mock_llm.py --port 8100 --latency 0.8 --token-rate 40 --tokens 200
+    DEEPSEEK_API_BASE=http://127.0.0.1:8100/v1 DEEPSEEK_API_KEY=mock uvicorn asgi_app:app --port 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+# 回复内容循环取自这段文本，每个字符算一个 token
+REPLY_TEXT = "根据《中华人民共和国劳动合同法》的相关规定，用人单位解除劳动合同应当依法向劳动者支付经济补偿。[citation:1]"
+
+
+class MockLLMConfig:
+    """模拟接口的延迟和输出设置"""
+
+    def __init__(self, latency=0.5, jitter=0.0, token_rate=50.0, tokens=100, chunk_tokens=1, error_rate=0.0, seed=None):
+        """
+        :param latency: 收到请求到开始输出的秒数（对应首个 token 的延迟）
+        :param jitter: latency 的随机浮动比例，0.2 表示在 ±20% 内均匀分布
+        :param token_rate: 每秒生成的 token 数，0 表示不限速
+        :param tokens: 每次回复的 token 数
+        :param chunk_tokens: 流式输出时每个事件包含的 token 数
+        :param error_rate: 返回 500 错误的请求比例
+        """
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.token_rate = float(token_rate)
+        self.tokens = int(tokens)
+        self.chunk_tokens = max(1, int(chunk_tokens))
+        self.error_rate = float(error_rate)
+        self.random = random.Random(seed)
+
+    def first_token_delay(self):
+        return max(0.0, self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def token_delay(self, count):
+        return count / self.token_rate if self.token_rate > 0 else 0.0
+
+    def should_fail(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def reply(self):
+        repeats = self.tokens // len(REPLY_TEXT) + 1
+        return (REPLY_TEXT * repeats)[:self.tokens]
+
+
+def prompt_tokens(messages):
+    return sum(len(str(message.get('content', ''))) for message in messages)
+
+
+def create_mock_app(config=None):
+    """创建模拟接口的 ASGI 应用，stats 记录请求数、流式请求数和注入的错误数"""
+    config = config or MockLLMConfig()
+    stats = {'requests': 0, 'stream_requests': 0, 'errors': 0, 'active': 0, 'max_active': 0}
+
+    async def chat_completions(request):
+        body = await request.json()
+        stats['requests'] += 1
+        if config.should_fail():
+            stats['errors'] += 1
+            return JSONResponse({'error': {'message': '模拟的服务端错误', 'type': 'server_error'}}, status_code=500)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'mock')
+        created = int(time.time())
+        content = config.reply()
+        usage = {
+            'prompt_tokens': prompt_tokens(body.get('messages', [])),
+            'completion_tokens': len(content),
+            'total_tokens': prompt_tokens(body.get('messages', [])) + len(content),
+        }
+
+        if not body.get('stream'):
+            stats['active'] += 1
+            stats['max_active'] = max(stats['max_active'], stats['active'])
+            try:
+                await asyncio.sleep(config.first_token_delay() + config.token_delay(len(content)))
+            finally:
+                stats['active'] -= 1
+            return JSONResponse({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+
+        stats['stream_requests'] += 1
+
+        def chunk(delta, finish_reason=None):
+            return "data: " + json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }, ensure_ascii=False) + "\n\n"
+
+        async def generate():
+            stats['active'] += 1
+            stats['max_active'] = max(stats['max_active'], stats['active'])
+            try:
+                await asyncio.sleep(config.first_token_delay())
+                yield chunk({'role': 'assistant', 'content': ''})
+                for start in range(0, len(content), config.chunk_tokens):
+                    piece = content[start:start + config.chunk_tokens]
+                    if start:
+                        await asyncio.sleep(config.token_delay(len(piece)))
+                    yield chunk({'content': piece})
+                yield chunk({}, finish_reason='stop')
+                yield "data: [DONE]\n\n"
+            finally:
+                stats['active'] -= 1
+
+        return StreamingResponse(generate(), media_type='text/event-stream')
+
+    async def mock_stats(request):
+        return JSONResponse(stats)
+
+    async def health(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[
+        Route('/v1/chat/completions', chat_completions, methods=['POST']),
+        Route('/chat/completions', chat_completions, methods=['POST']),
+        Route('/mock/stats', mock_stats),
+        Route('/', health),
+    ])
+    app.state.config = config
+    app.state.stats = stats
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容模型接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.5, help="首个 token 的延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延迟的随机浮动比例")
+    parser.add_argument('--token-rate', type=float, default=50.0, help="每秒生成的 token 数，0 表示不限速")
+    parser.add_argument('--tokens', type=int, default=100, help="每次回复的 token 数")
+    parser.add_argument('--chunk-tokens', type=int, default=1, help="流式输出时每个事件包含的 token 数")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 错误的请求比例")
+    parser.add_argument('--seed', type=int, default=None, help="随机数种子，固定后延迟和错误的分布可复现")
+    args = parser.parse_args()
+
+    import uvicorn
+    config = MockLLMConfig(
+        latency=args.latency, jitter=args.jitter, token_rate=args.token_rate, tokens=args.tokens,
+        chunk_tokens=args.chunk_tokens, error_rate=args.error_rate, seed=args.seed
+    )
+    uvicorn.run(create_mock_app(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
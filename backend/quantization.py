@@ -0,0 +1,212 @@
+import numpy as np
+
+# 编码和计算得分时每块处理的行数，控制临时 float32 矩阵的大小
+CHUNK_ROWS = 8192
+# 乘积量化每个子空间的码本大小，编码为 1 字节
+PQ_CENTROIDS = 256
+# 训练码本使用的样本数和迭代次数
+PQ_TRAIN_SAMPLES = 8192
+PQ_TRAIN_ITERATIONS = 12
+
+
+def iter_chunks(rows, chunk_rows=CHUNK_ROWS):
+    for start in range(0, rows, chunk_rows):
+        yield start, min(start + chunk_rows, rows)
+
+
+def _row_shape(values, query):
+    """把按行的系数整理为可与 (rows,) 或 (rows, queries) 得分相乘的形状"""
+    return values.reshape((-1,) + (1,) * (np.ndim(query) - 1))
+
+
+class Int8Matrix:
+    """
+    int8 标量量化的向量矩阵
+    每一行按自身的最大绝对值缩放到 [-127, 127]，另存一个 float32 缩放系数，每行占 dim + 4 字节。
+    查询保持 float32，得分为 (codes @ query) * scale，不需要还原向量（非对称计算）。
+    """
+    kind = 'int8'
+    # 保存到文件的数组
+    ARRAYS = ('codes', 'scales')
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def encode(cls, vectors):
+        """量化已归一化的 float32 向量"""
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(len(vectors), dtype=np.float32)
+        for start, end in iter_chunks(len(vectors)):
+            chunk = np.asarray(vectors[start:end], dtype=np.float32)
+            peak = np.abs(chunk).max(axis=1)
+            peak[peak == 0] = 1.0
+            scales[start:end] = peak / 127
+            codes[start:end] = np.rint(chunk / scales[start:end, None]).astype(np.int8)
+        return cls(codes, scales)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __getitem__(self, key):
+        return Int8Matrix(self.codes[key], self.scales[key])
+
+    def decode(self):
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+    def __array__(self, dtype=None, copy=None):
+        decoded = self.decode()
+        return decoded if dtype is None else decoded.astype(dtype, copy=False)
+
+    def inner_product(self, query):
+        """与查询向量（或查询矩阵的每一列）的近似内积"""
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.empty((len(self),) + query.shape[1:], dtype=np.float32)
+        for start, end in iter_chunks(len(self)):
+            chunk_scores = self.codes[start:end].astype(np.float32) @ query
+            scores[start:end] = chunk_scores * _row_shape(self.scales[start:end], query)
+        return scores
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['codes'], arrays['scales'])
+
+
+def default_subvectors(dim):
+    """默认的子空间数量：每个子空间约 8 维，且能整除向量维度"""
+    target = max(1, dim // 8)
+    return next(m for m in range(target, 0, -1) if dim % m == 0)
+
+
+def _nearest_centroid(data, centroids):
+    """每一行欧氏距离最近的中心编号"""
+    # ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2，||x||^2 对同一行是常数
+    distances = (centroids * centroids).sum(axis=1) - 2 * (data @ centroids.T)
+    return np.argmin(distances, axis=1)
+
+
+def _kmeans(data, k, n_iter, rng):
+    """欧氏距离 k-means，返回 (k, dim) 的中心"""
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _nearest_centroid(data, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.stack([np.bincount(assignments, weights=data[:, dim], minlength=k)
+                         for dim in range(data.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # 空簇重新随机选取中心
+        centroids[~filled] = data[rng.integers(len(data), size=int((~filled).sum()))]
+    return centroids.astype(np.float32)
+
+
+class PQMatrix:
+    """
+    乘积量化（PQ）的向量矩阵
+    向量按维度切成 m 个子向量，每个子空间用 k-means 训练 256 个中心，每个子向量编码为 1 字节，
+    每行只占 m 字节。查询时先计算查询的每个子向量与各中心的内积表（m × 256），
+    每一行的得分是按编码查表后求和（非对称计算）。
+    """
+    kind = 'pq'
+    ARRAYS = ('codes', 'codebooks')
+
+    def __init__(self, codes, codebooks):
+        self.codes = codes
+        self.codebooks = codebooks
+
+    @property
+    def subvectors(self):
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, vectors, subvectors=None, n_iter=PQ_TRAIN_ITERATIONS, sample_size=PQ_TRAIN_SAMPLES, seed=0):
+        """
+        在向量的采样上训练码本
+        :param subvectors: 子空间数量 m，须整除向量维度，默认每个子空间约 8 维
+        :return: (m, k, dim / m) 的码本
+        """
+        dim = vectors.shape[1]
+        subvectors = int(subvectors or default_subvectors(dim))
+        if dim % subvectors:
+            raise ValueError(f"子空间数量 {subvectors} 不能整除向量维度 {dim}")
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(len(vectors), min(len(vectors), sample_size), replace=False))
+        sample = np.asarray(vectors[sample_ids], dtype=np.float32)
+        k = min(PQ_CENTROIDS, len(sample))
+        return np.stack([
+            _kmeans(part, k, n_iter, rng)
+            for part in np.split(sample, subvectors, axis=1)
+        ])
+
+    @classmethod
+    def encode(cls, vectors, codebooks=None, **train_params):
+        """用码本编码向量，未指定码本时先训练"""
+        if codebooks is None:
+            codebooks = cls.train(vectors, **train_params)
+        codes = np.empty((len(vectors), len(codebooks)), dtype=np.uint8)
+        for start, end in iter_chunks(len(vectors)):
+            parts = np.split(np.asarray(vectors[start:end], dtype=np.float32), len(codebooks), axis=1)
+            for sub, (part, codebook) in enumerate(zip(parts, codebooks)):
+                codes[start:end, sub] = _nearest_centroid(part, codebook)
+        return cls(codes, codebooks)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return (len(self.codes), self.codebooks.shape[0] * self.codebooks.shape[2])
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def __getitem__(self, key):
+        return PQMatrix(self.codes[key], self.codebooks)
+
+    def decode(self):
+        subspaces = np.arange(self.subvectors)
+        return self.codebooks[subspaces, np.asarray(self.codes, dtype=np.intp)].reshape(len(self), -1)
+
+    def __array__(self, dtype=None, copy=None):
+        decoded = self.decode()
+        return decoded if dtype is None else decoded.astype(dtype, copy=False)
+
+    def inner_product(self, query):
+        """与查询向量的近似内积；查询矩阵（如聚类中心）按块还原向量后计算"""
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.empty((len(self),) + query.shape[1:], dtype=np.float32)
+        if query.ndim == 1:
+            subspaces = np.arange(self.subvectors)
+            table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.subvectors, -1))
+            for start, end in iter_chunks(len(self)):
+                scores[start:end] = table[subspaces, np.asarray(self.codes[start:end], dtype=np.intp)].sum(axis=1)
+        else:
+            for start, end in iter_chunks(len(self)):
+                scores[start:end] = self[start:end].decode() @ query
+        return scores
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['codes'], np.asarray(arrays['codebooks'], dtype=np.float32))
+
+
+QUANTIZERS = {
+    Int8Matrix.kind: Int8Matrix,
+    PQMatrix.kind: PQMatrix,
+}
@@ -1,38 +1,36 @@
-import pandas as pd
 import numpy as np
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
 import os
+from corpus_text import load_csv_column
+from data_processor import embed_in_batches
+from embedding_backends import load_text_embedding, embed_sentences
 
 class RAGProcessor:
     def __init__(self):
         # 设置数据文件路径
         self.law_data_path = os.path.join(os.path.dirname(__file__), '../RAG_tutorial/实验三/law_data_3k.csv')
         self.law_qa_path = os.path.join(os.path.dirname(__file__), '../RAG_tutorial/实验三/law_QA.csv')
+        self.embeddings_dir = os.path.join(os.path.dirname(__file__), 'embeddings')
+        os.makedirs(self.embeddings_dir, exist_ok=True)
         
-        # 加载数据
-        self.law_data = pd.read_csv(self.law_data_path)
-        self.law_qa = pd.read_csv(self.law_qa_path)
+        # 加载数据：标题和内容以紧凑文本列保存，只在 CSV 更新后重新解析
+        mmap = os.getenv('EMBEDDING_MMAP', '0').lower() in ('1', 'true', 'yes')
+        self.titles = load_csv_column(self.law_data_path, self.embeddings_dir, 'rag_law_data.title', 'title', mmap=mmap)
+        self.contents = load_csv_column(self.law_data_path, self.embeddings_dir, 'rag_law_data.content', 'content', mmap=mmap)
         
-        # 初始化文本嵌入模型
-        self.text_embedding = pipeline(
-            Tasks.sentence_embedding,
-            model='damo/nlp_corom_sentence-embedding_chinese-base',
-            model_revision='v1.0.0'
-        )
+        # 初始化文本嵌入模型，与 DataProcessor 使用同一个嵌入后端（EMBEDDING_BACKEND）
+        self.text_embedding = load_text_embedding()
         
         # 预计算所有案例的嵌入
         print("正在计算案例嵌入...")
-        self.case_embeddings = []
-        for _, row in self.law_data.iterrows():
-            embedding = self.text_embedding(row['content'])['text_embedding']
-            self.case_embeddings.append(embedding)
-        self.case_embeddings = np.array(self.case_embeddings)
+        self.case_embeddings = embed_in_batches(
+            lambda batch: embed_sentences(self.text_embedding, batch), list(self.contents),
+            int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+        )
         print(f"完成案例嵌入计算，共 {len(self.case_embeddings)} 个案例")
 
     def find_relevant_cases(self, query, top_k=3):
         # 计算查询的嵌入
-        query_embedding = self.text_embedding(query)['text_embedding']
+        query_embedding = embed_sentences(self.text_embedding, [query])[0]
         
         # 计算相似度
         similarities = np.dot(self.case_embeddings, query_embedding) / (
@@ -44,10 +42,9 @@ class RAGProcessor:
         relevant_cases = []
         
         for idx in top_indices:
-            case = self.law_data.iloc[idx]
             relevant_cases.append({
-                'title': case['title'],
-                'content': case['content'],
+                'title': self.titles[idx],
+                'content': self.contents[idx],
                 'similarity': float(similarities[idx])
             })
         
@@ -0,0 +1,434 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_SETTINGS = {
+    'system_prompt': None,
+    'is_law_mode': False,  # 是否为法律助手模式
+    'law_cases_count': 3,  # 法条检索数量
+    'qa_cases_count': 3,   # 问答检索数量
+    'semantic_cache': True  # 是否使用语义答案缓存
+}
+# 存为 0/1 的布尔设置
+BOOLEAN_SETTINGS = ('is_law_mode', 'semantic_cache')
+
+
+class SessionStore:
+    """
+    会话存储的公共接口
+    会话设置可更新，对话历史通常只追加，客户端清空对话时整体替换。同时支持 `session_id in store`、
+    `store[session_id]` 和 `store.clear()`，返回的会话数据是副本。
+    """
+
+    def create(self, session_id, **settings):
+        raise NotImplementedError
+
+    def get_settings(self, session_id):
+        """返回会话设置（不含对话历史），会话不存在时返回 None"""
+        raise NotImplementedError
+
+    def update(self, session_id, **settings):
+        raise NotImplementedError
+
+    def append_messages(self, session_id, messages):
+        raise NotImplementedError
+
+    def replace_messages(self, session_id, messages):
+        """以 messages 替换对话历史，追加总数重置为 len(messages)"""
+        raise NotImplementedError
+
+    def message_count(self, session_id):
+        """当前保存的消息条数（超过历史条数上限的早期消息已被裁剪）"""
+        raise NotImplementedError
+
+    def appended_count(self, session_id):
+        """会话创建以来追加过的消息总数，不受历史条数上限影响，与客户端保存的完整历史条数对应"""
+        raise NotImplementedError
+
+    def get_history(self, session_id, limit=None):
+        """返回最近 limit 条消息，limit 为 None 时返回全部"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """会话数、保存的消息总数和消息内容的总字符数，用于观察会话存储的内存增长"""
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        return self.get_settings(session_id) is not None
+
+    def __getitem__(self, session_id):
+        settings = self.get_settings(session_id)
+        if settings is None:
+            raise KeyError(session_id)
+        settings['messages'] = self.get_history(session_id)
+        return settings
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+
+class MemorySessionStore(SessionStore):
+    """
+    进程内 LRU 会话存储
+    超过 max_sessions 时淘汰最久未活动的会话，空闲超过 idle_ttl 秒的会话过期；
+    每个会话最多保留 max_messages 条历史，内存占用有上限。
+    """
+
+    def __init__(self, max_sessions=10000, idle_ttl=86400, max_messages=200):
+        self.max_sessions = int(max_sessions)
+        self.idle_ttl = float(idle_ttl) if idle_ttl else None
+        self.max_messages = int(max_messages) if max_messages else None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id):
+        """取出会话并刷新活动时间，已过期时删除并返回 None"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if self.idle_ttl and now - session['last_active'] > self.idle_ttl:
+            del self._sessions[session_id]
+            return None
+        session['last_active'] = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            expired = self.idle_ttl and now - session['last_active'] > self.idle_ttl
+            if not expired and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self, session_id, **settings):
+        with self._lock:
+            self._sessions[session_id] = {
+                'settings': {**DEFAULT_SETTINGS, **settings},
+                'messages': [],
+                'appended': 0,
+                'last_active': time.monotonic(),
+            }
+            self._evict()
+
+    def get_settings(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            return dict(session['settings']) if session is not None else None
+
+    def update(self, session_id, **settings):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            session['settings'].update(settings)
+
+    def append_messages(self, session_id, messages):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            messages = [dict(msg) for msg in messages]
+            session['messages'].extend(messages)
+            session['appended'] += len(messages)
+            if self.max_messages and len(session['messages']) > self.max_messages:
+                del session['messages'][:-self.max_messages]
+
+    def replace_messages(self, session_id, messages):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                raise KeyError(session_id)
+            messages = [dict(msg) for msg in messages]
+            session['appended'] = len(messages)
+            session['messages'] = messages[-self.max_messages:] if self.max_messages else messages
+
+    def message_count(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            return len(session['messages']) if session is not None else 0
+
+    def appended_count(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            return session['appended'] if session is not None else 0
+
+    def get_history(self, session_id, limit=None):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return []
+            messages = session['messages']
+            if limit is not None:
+                messages = messages[-limit:] if limit > 0 else []
+            return [dict(msg) for msg in messages]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        with self._lock:
+            self._evict()
+            return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            self._evict()
+            messages = [msg for session in self._sessions.values() for msg in session['messages']]
+            return {
+                'sessions': len(self._sessions),
+                'messages': len(messages),
+                'content_chars': sum(len(msg['content']) for msg in messages),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 会话存储
+    会话在重启后仍然保留，同一主机上的多个工作进程可以服务同一个会话。
+    每个会话最多保留 max_messages 条历史，空闲超过 idle_ttl 秒的会话在创建新会话时清理。
+    """
+
+    def __init__(self, path, idle_ttl=86400, max_messages=200):
+        self.path = path
+        self.idle_ttl = float(idle_ttl) if idle_ttl else None
+        self.max_messages = int(max_messages) if max_messages else None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, system_prompt TEXT, is_law_mode INTEGER NOT NULL, "
+                "law_cases_count INTEGER NOT NULL, qa_cases_count INTEGER NOT NULL, last_active REAL NOT NULL, "
+                "semantic_cache INTEGER NOT NULL DEFAULT 1, appended INTEGER NOT NULL DEFAULT 0)"
+            )
+            # 旧版本创建的数据库没有 semantic_cache 列
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if 'semantic_cache' not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN semantic_cache INTEGER NOT NULL DEFAULT 1")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+            # 旧版本创建的数据库没有 appended 列，旧版本不裁剪历史，追加总数即保存的条数
+            if 'appended' not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN appended INTEGER NOT NULL DEFAULT 0")
+                conn.execute(
+                    "UPDATE sessions SET appended = "
+                    "(SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.session_id)"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _expire(self, conn):
+        if not self.idle_ttl:
+            return
+        cutoff = time.time() - self.idle_ttl
+        conn.execute(
+            "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_active < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,))
+
+    def _touch(self, conn, session_id):
+        """刷新活动时间，会话不存在或已过期时返回 False"""
+        now = time.time()
+        if self.idle_ttl:
+            cursor = conn.execute(
+                "UPDATE sessions SET last_active = ? WHERE session_id = ? AND last_active >= ?",
+                (now, session_id, now - self.idle_ttl)
+            )
+        else:
+            cursor = conn.execute("UPDATE sessions SET last_active = ? WHERE session_id = ?", (now, session_id))
+        return cursor.rowcount > 0
+
+    def create(self, session_id, **settings):
+        settings = {**DEFAULT_SETTINGS, **settings}
+        with self._connect() as conn:
+            self._expire(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, system_prompt, is_law_mode, law_cases_count, "
+                "qa_cases_count, last_active, semantic_cache) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, settings['system_prompt'], int(bool(settings['is_law_mode'])),
+                 int(settings['law_cases_count']), int(settings['qa_cases_count']), time.time(),
+                 int(bool(settings['semantic_cache'])))
+            )
+
+    def get_settings(self, session_id):
+        with self._connect() as conn:
+            if not self._touch(conn, session_id):
+                return None
+            row = conn.execute(
+                "SELECT system_prompt, is_law_mode, law_cases_count, qa_cases_count, semantic_cache "
+                "FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return {
+            'system_prompt': row[0],
+            'is_law_mode': bool(row[1]),
+            'law_cases_count': row[2],
+            'qa_cases_count': row[3],
+            'semantic_cache': bool(row[4]),
+        }
+
+    def update(self, session_id, **settings):
+        columns = [key for key in DEFAULT_SETTINGS if key in settings]
+        values = [
+            int(bool(settings[key])) if key in BOOLEAN_SETTINGS else settings[key]
+            for key in columns
+        ]
+        with self._connect() as conn:
+            if not self._touch(conn, session_id):
+                raise KeyError(session_id)
+            if columns:
+                assignments = ", ".join(f"{key} = ?" for key in columns)
+                conn.execute(f"UPDATE sessions SET {assignments} WHERE session_id = ?", (*values, session_id))
+
+    def _insert_messages(self, conn, session_id, messages):
+        """插入消息并裁剪超过 max_messages 的早期消息"""
+        conn.executemany(
+            "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+            [(session_id, msg['role'], msg['content']) for msg in messages]
+        )
+        if self.max_messages:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id <= "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_messages)
+            )
+
+    def append_messages(self, session_id, messages):
+        messages = list(messages)
+        with self._connect() as conn:
+            if not self._touch(conn, session_id):
+                raise KeyError(session_id)
+            conn.execute("UPDATE sessions SET appended = appended + ? WHERE session_id = ?", (len(messages), session_id))
+            self._insert_messages(conn, session_id, messages)
+
+    def replace_messages(self, session_id, messages):
+        messages = list(messages)
+        with self._connect() as conn:
+            if not self._touch(conn, session_id):
+                raise KeyError(session_id)
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("UPDATE sessions SET appended = ? WHERE session_id = ?", (len(messages), session_id))
+            self._insert_messages(conn, session_id, messages)
+
+    def message_count(self, session_id):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def appended_count(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT appended FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def get_history(self, session_id, limit=None):
+        with self._connect() as conn:
+            if limit is None:
+                rows = conn.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, max(0, int(limit)))
+                ).fetchall()[::-1]
+        return [{'role': role, 'content': content} for role, content in rows]
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM sessions")
+
+    def __len__(self):
+        with self._connect() as conn:
+            self._expire(conn)
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        with self._connect() as conn:
+            self._expire(conn)
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages, content_chars = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages"
+            ).fetchone()
+        return {'sessions': sessions, 'messages': messages, 'content_chars': content_chars}
+
+
+def sync_client_messages(store, session_id, messages):
+    """
+    把客户端本次请求发送的对话历史同步到会话存储
+    客户端历史以会话已保存的历史为前缀时只追加新增的消息（按追加总数定位，已裁剪的早期消息不再比较）；
+    客户端历史更短或与已保存的历史不一致（例如前端清空了对话）时，以客户端历史替换会话历史。
+    上一条用户消息尚未得到回答（模型调用失败）而客户端再次发送同一个问题时不重复追加。
+    """
+    messages = [{'role': msg['role'], 'content': msg['content']} for msg in messages if msg.get('role') != 'system']
+    appended = store.appended_count(session_id)
+    history = store.get_history(session_id)
+    trimmed = appended - len(history)
+    if len(messages) < appended or messages[trimmed:appended] != history:
+        store.replace_messages(session_id, messages)
+        return
+    new = messages[appended:]
+    if new and history and history[-1]['role'] == 'user' and new[-1] == history[-1]:
+        # 重试上一个问题，前端在两次提问之间加入的失败提示也不保存
+        new = []
+    if new:
+        store.append_messages(session_id, new)
+
+
+def create_session_store():
+    """
+    根据环境变量创建会话存储
+    SESSION_STORE=memory（默认）或 sqlite；SESSION_DB 为 SQLite 文件路径
+    """
+    backend = os.getenv('SESSION_STORE', 'memory').lower()
+    idle_ttl = float(os.getenv('SESSION_IDLE_TTL', 86400))
+    max_messages = int(os.getenv('SESSION_MAX_MESSAGES', 200))
+    if backend == 'sqlite':
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
+        return SQLiteSessionStore(os.getenv('SESSION_DB', default_path), idle_ttl=idle_ttl, max_messages=max_messages)
+    if backend != 'memory':
+        raise ValueError(f"未知的会话存储类型: {backend}，可选: memory, sqlite")
+    return MemorySessionStore(
+        max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', 10000)),
+        idle_ttl=idle_ttl,
+        max_messages=max_messages
+    )
@@ -0,0 +1,163 @@
+"""
+多进程分片检索
+嵌入向量存储按行切成若干分片，由进程池中的工作进程并行计算各分片的局部 top-k，
+再由调用方合并。工作进程以 mmap 方式加载同一个存储文件，共享页缓存，不复制向量。
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from embedding_store import EmbeddingStore
+from metrics import timed
+from vector_index import FlatIndex, inner_product, normalize_query, normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# 工作进程中以 mmap 方式加载的嵌入向量存储
+_worker_store = None
+
+
+def _init_worker(directory, dtype, counts):
+    global _worker_store
+    store = EmbeddingStore.load(directory, dtype, mmap=True)
+    if store is None or [store.count(source) for source in range(len(counts))] != list(counts):
+        raise RuntimeError(f"分片进程加载的嵌入向量存储与主进程不一致: {directory}")
+    _worker_store = store
+
+
+def _ping():
+    return os.getpid()
+
+
+def _search_shard(source, start, end, query, top_k):
+    """在一个分片中检索，返回 (scores, indices)，行号为该来源内的行号"""
+    scores = inner_product(_worker_store.segment(source)[start:end], query)
+    order = top_k_indices(scores, top_k)
+    return scores[order], order + start
+
+
+def _search_shard_batch(source, start, end, queries, top_k):
+    """在一个分片中批量检索，返回与每个查询对应的 (scores, indices) 列表"""
+    shard = FlatIndex(_worker_store.segment(source)[start:end], normalized=True)
+    return [(scores, indices + start) for scores, indices in shard.search_batch(queries, top_k)]
+
+
+def merge_top_k(results, top_k):
+    """合并各分片的 (scores, indices)，得分相同时按行号排序，结果与分片数无关"""
+    scores = np.concatenate([scores for scores, _ in results])
+    indices = np.concatenate([indices for _, indices in results])
+    order = np.lexsort((indices, -scores))[:top_k]
+    return scores[order], indices[order]
+
+
+# forkserver 服务进程预先导入的模块：只导入本模块（numpy 和向量存储），不导入主模块
+FORKSERVER_PRELOAD = ['sharded_index']
+
+
+def default_start_method():
+    """
+    默认以 forkserver 启动工作进程：主进程中已有预热线程、请求线程和 torch / OpenMP / BLAS 线程池，
+    直接 fork 可能继承被其他线程持有的锁；forkserver 的工作进程由一个只导入了本模块的单线程服务进程 fork 出来。
+    不支持 forkserver 的平台使用 spawn
+    """
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def worker_context(start_method=None):
+    context = multiprocessing.get_context(start_method or default_start_method())
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(FORKSERVER_PRELOAD)
+    return context
+
+
+def start_worker_server(start_method=None):
+    """提前启动 forkserver 服务进程（已启动时不做任何事），应在加载模型和启动其他线程之前调用"""
+    if worker_context(start_method).get_start_method() == 'forkserver':
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+
+
+def is_worker_process():
+    """
+    是否为 multiprocessing 启动的子进程；spawn / forkserver 的工作进程会以 __mp_main__ 重新导入主模块，
+    主模块据此跳过加载模型等启动工作
+    """
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+class ShardPool:
+    """检索工作进程池，创建时即启动全部进程并加载存储"""
+
+    def __init__(self, directory, dtype, counts, processes, start_method=None):
+        context = worker_context(start_method)
+        self.start_method = context.get_start_method()
+        self.processes = int(processes)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=context,
+            initializer=_init_worker, initargs=(directory, dtype, tuple(counts))
+        )
+        # 等待工作进程加载存储；加载失败时在这里抛出，由调用方退回单进程检索
+        for future in [self.executor.submit(_ping) for _ in range(self.processes * 2)]:
+            future.result()
+        logger.info("分片检索进程池已启动：%d 个进程（%s）", self.processes, self.start_method)
+
+    def submit(self, *args):
+        return self.executor.submit(_search_shard, *args)
+
+    def submit_batch(self, *args):
+        return self.executor.submit(_search_shard_batch, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ShardedIndex:
+    """
+    精确检索的分片版本
+    一个来源的向量按行均分为 shards 段，每段由进程池中的一个进程计算局部 top-k，合并后返回全局 top-k。
+    候选子集检索（词法预筛选、混合检索的打分）量小，仍在当前进程中由被包装的索引完成；
+    进程池不可用时也退回到被包装的索引。
+    """
+
+    def __init__(self, index, pool, source, shards):
+        self.index = index
+        self.pool = pool
+        self.source = source
+        bounds = np.linspace(0, len(index), int(shards) + 1).astype(np.int64)
+        self.ranges = [(int(start), int(end)) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, query, top_k, candidates=None, **kwargs):
+        if candidates is not None or len(self.ranges) <= 1:
+            return self.index.search(query, top_k, candidates=candidates, **kwargs)
+        query = normalize_query(query)
+        try:
+            with timed('similarity_scoring'):
+                futures = [self.pool.submit(self.source, start, end, query, top_k) for start, end in self.ranges]
+                results = [future.result() for future in futures]
+        except Exception as e:
+            logger.warning("分片检索失败，改为在当前进程中检索: %s", e)
+            return self.index.search(query, top_k, **kwargs)
+        with timed('top_k_selection'):
+            return merge_top_k(results, top_k)
+
+    def search_batch(self, queries, top_k, **kwargs):
+        """批量检索：每个分片对全部查询做一次矩阵乘法，返回与 queries 每一行对应的 (scores, indices) 列表"""
+        if len(self.ranges) <= 1:
+            return self.index.search_batch(queries, top_k, **kwargs)
+        queries = normalize_rows(queries)
+        try:
+            with timed('similarity_scoring'):
+                futures = [self.pool.submit_batch(self.source, start, end, queries, top_k) for start, end in self.ranges]
+                shard_results = [future.result() for future in futures]
+        except Exception as e:
+            logger.warning("分片检索失败，改为在当前进程中检索: %s", e)
+            return self.index.search_batch(queries, top_k, **kwargs)
+        with timed('top_k_selection'):
+            return [merge_top_k(results, top_k) for results in zip(*shard_results)]
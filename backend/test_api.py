@@ -80,10 +80,13 @@ class TestChatAPIIntegration(unittest.TestCase):
         first_reply = response.get_json()['choices'][0]['message']['content']
         self.assertIn('北京', first_reply)
         
-        # 第二轮对话（需要包含上下文）
+        # 第二轮对话（与前端一样发送完整历史）
         second_msg = {
             'session_id': session_id,
-            'messages': [{'role': 'user', 'content': '那里有多少人口？'}]
+            'messages': first_msg['messages'] + [
+                {'role': 'assistant', 'content': first_reply},
+                {'role': 'user', 'content': '那里有多少人口？'}
+            ]
         }
         response = self.client.post('/chat', json=second_msg)
         second_reply = response.get_json()['choices'][0]['message']['content']
@@ -0,0 +1,345 @@
+# test_app.py
+import csv
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import data_processor
+from benchmark import synthetic_corpus
+from data_processor import DataProcessor
+from embedding_backends import HashingEmbedding, embed_sentences
+
+# 导入时不在测试进程中加载语料和嵌入模型
+with mock.patch.dict(os.environ, {'LAZY_STARTUP': '1', 'SESSION_STORE': 'memory'}), \
+        mock.patch('data_processor.start_warmup'):
+    import app as flask_app
+
+# 前端法律助手模式（Chat.js 的 handleSpecialGreeting）设置的系统提示词和欢迎语
+LAW_PROMPT = '你是一个专业的法律顾问，请基于提供的相关案例和法律知识，为用户提供专业、准确的法律建议。'
+GREETING = {'role': 'assistant', 'content': '您好！我是您的法律助手。\n\n请问您有什么法律问题需要咨询吗？'}
+
+
+class FakeProcessor:
+    """用哈希嵌入计算查询向量，固定返回一条法条的检索结果"""
+
+    corpus_version = 'test'
+
+    def __init__(self):
+        self.embedding = HashingEmbedding(dim=64)
+
+    def embed_query(self, query):
+        return embed_sentences(self.embedding, [query])[0]
+
+    def retrieve(self, query, law_top_k=3, qa_top_k=3, **kwargs):
+        return [{'source': 'law', 'row': 0, 'score': 0.9, 'text': '第一条 用人单位应当按时足额支付劳动报酬'}]
+
+
+class SlowProcessor:
+    """加载过程由测试控制的数据处理器"""
+    release = None
+
+    def __init__(self, progress=None, text_embedding=None):
+        if progress is not None:
+            progress('embedding', done=1, total=2)
+        self.release.wait(5)
+
+
+class ReloadedProcessor:
+    """热更新后构建的数据处理器，记录复用的嵌入模型"""
+
+    def __init__(self, text_embedding=None):
+        self.text_embedding = text_embedding
+        self.corpus_version = 'v2'
+        self.law_data_index = [0, 1, 2]
+        self.law_qa_index = [0]
+        self.close_when_unreferenced = mock.Mock()
+
+
+def reset_warmup():
+    """数据处理器单例恢复为未加载状态"""
+    data_processor._data_processor = None
+    data_processor._warmup_thread = None
+    data_processor._warmup_done.clear()
+    data_processor._warmup.update(state='idle', stage=None, detail={}, started_at=None, finished_at=None, error=None)
+
+
+def completion(content):
+    """openai.ChatCompletion.create 的非流式返回值"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class TestChatFlow(unittest.TestCase):
+    def setUp(self):
+        self.client = flask_app.app.test_client()
+        flask_app.chat_sessions.clear()
+        flask_app.answer_cache.clear()
+        patcher = mock.patch.object(flask_app, 'wait_for_data_processor', return_value=FakeProcessor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def law_session(self):
+        """按前端的顺序创建会话并切换到法律助手模式"""
+        session_id = self.client.post('/start-session').get_json()['session_id']
+        response = self.client.post('/set-system-prompt', json={
+            'session_id': session_id, 'system_prompt': LAW_PROMPT, 'is_law_mode': True,
+            'law_cases_count': 3, 'qa_cases_count': 3,
+        })
+        self.assertEqual(response.status_code, 200)
+        return session_id
+
+    def chat(self, session_id, messages):
+        response = self.client.post('/chat', json={'session_id': session_id, 'messages': messages, 'deep_thinking': True})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_01_semantic_cache_after_greeting(self):
+        """测试前端先加入欢迎语再提问时仍视为单轮提问：新会话中相同的问题命中语义答案缓存"""
+        question = {'role': 'user', 'content': '公司拖欠工资怎么办？'}
+        before = flask_app.answer_cache.stats()
+        with mock.patch('openai.ChatCompletion.create', return_value=completion('可以向劳动监察部门投诉')) as create:
+            first = self.chat(self.law_session(), [GREETING, question])
+            self.assertEqual(first['retrieval_status'], 'ok')
+
+            session_id = self.law_session()
+            second = self.chat(session_id, [GREETING, question])
+            self.assertEqual(second['retrieval_status'], 'cached')
+            self.assertEqual(second['choices'][0]['message']['content'], '可以向劳动监察部门投诉')
+            self.assertEqual(second['related_cases'], first['related_cases'])
+            self.assertEqual(create.call_count, 1)
+
+            # 同一会话的追问依赖之前的上下文，不查找缓存
+            follow_up = [GREETING, question, second['choices'][0]['message'], {'role': 'user', 'content': '需要准备什么材料？'}]
+            self.assertEqual(self.chat(session_id, follow_up)['retrieval_status'], 'ok')
+            self.assertEqual(create.call_count, 2)
+        stats = flask_app.answer_cache.stats()
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses'], stats['size']), (1, 1, 1))
+
+    def test_02_invalid_requests(self):
+        """测试请求体不是合法的 JSON 对象或会话无效时返回 400"""
+        for path in ('/set-system-prompt', '/chat', '/chat/stream'):
+            for body in ('{bad', '[1, 2]'):
+                response = self.client.post(path, data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (path, body))
+            response = self.client.post(path, json={'session_id': 'missing', 'messages': []})
+            self.assertEqual(response.status_code, 400)
+
+
+class SearchEndpointCases:
+    """
+    Flask 和 ASGI 两个入口共用的检索接口测试用例
+    子类设置 module（app 或 asgi_app）并实现 post(path, body, headers) -> (状态码, Content-Type, 响应文本)
+    """
+
+    module = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.law, cls.qa = synthetic_corpus(law_count=60, qa_count=20)
+        for filename, texts in (('law_data_3k.csv', cls.law), ('law_QA.csv', cls.qa)):
+            with open(os.path.join(cls.tmp_dir, filename), 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['data'])
+                writer.writerows([text] for text in texts)
+        cls.processor = DataProcessor(text_embedding=HashingEmbedding(dim=64), data_dir=cls.tmp_dir, chunk_max_chars=0)
+        cls.queries = [cls.law[i][:20] for i in range(3)] + [cls.qa[i][:20] for i in range(2)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.processor.close()
+        shutil.rmtree(cls.tmp_dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        # 每批计算 2 条查询，分批边界与分页边界错开
+        for patcher in (mock.patch.object(self.module, 'peek_data_processor', return_value=self.processor),
+                        mock.patch.object(flask_app, 'SEARCH_BATCH_SIZE', 2)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_json(self, path, data, headers=None):
+        status, content_type, text = self.post(path, json.dumps(data, ensure_ascii=False), headers)
+        return status, content_type, json.loads(text) if content_type.startswith('application/json') else text
+
+    def test_search_structured_hits(self):
+        """测试 /search 返回结构化结果，与直接检索一致"""
+        status, _, body = self.post_json('/search', {'query': self.queries[0], 'law_top_k': 2, 'qa_top_k': 1,
+                                                     'similarity_threshold': 0})
+        self.assertEqual(status, 200)
+        self.assertEqual(body['query'], self.queries[0])
+        expected = self.processor.retrieve(self.queries[0], law_top_k=2, qa_top_k=1, similarity_threshold=0)
+        self.assertEqual([(hit['source'], hit['row'], hit['text']) for hit in body['hits']],
+                         [(hit['source'], hit['row'], hit['text']) for hit in expected])
+        self.assertEqual([hit['source'] for hit in body['hits']], ['law', 'law', 'qa'])
+        for hit in body['hits']:
+            self.assertEqual(set(hit), {'source', 'row', 'score', 'text'})
+            self.assertIsInstance(hit['row'], int)
+            self.assertAlmostEqual(hit['score'], next(item['score'] for item in expected
+                                                      if (item['source'], item['row']) == (hit['source'], hit['row'])),
+                                   places=5)
+
+    def test_search_batch_pages(self):
+        """测试 /search/batch 按 offset 和 limit 分页，next_offset 指向下一页，最后一页为 null"""
+        indices = []
+        offset = 0
+        pages = []
+        while offset is not None:
+            status, _, body = self.post_json('/search/batch', {'queries': self.queries, 'offset': offset, 'limit': 3,
+                                                               'similarity_threshold': 0})
+            self.assertEqual(status, 200)
+            self.assertEqual((body['offset'], body['total']), (offset, 5))
+            pages.append(len(body['results']))
+            indices.extend(result['index'] for result in body['results'])
+            for result in body['results']:
+                self.assertEqual(result['query'], self.queries[result['index']])
+                self.assertEqual([hit['row'] for hit in result['hits']],
+                                 [hit['row'] for hit in self.processor.retrieve(result['query'], similarity_threshold=0)])
+            offset = body['next_offset']
+        self.assertEqual(pages, [3, 2])
+        self.assertEqual(indices, list(range(5)))
+
+        # offset 超出查询条数时返回空页
+        status, _, body = self.post_json('/search/batch', {'queries': self.queries, 'offset': 5})
+        self.assertEqual((status, body['results'], body['next_offset']), (200, [], None))
+
+    def test_search_batch_ndjson(self):
+        """测试 NDJSON 模式每行一条结果，从 offset 开始输出全部结果，Accept 头同样生效"""
+        for data, headers in (({'format': 'ndjson'}, None), ({}, {'Accept': 'application/x-ndjson'})):
+            status, content_type, text = self.post('/search/batch', json.dumps(
+                {'queries': self.queries, 'offset': 1, **data}), headers)
+            self.assertEqual(status, 200)
+            self.assertTrue(content_type.startswith('application/x-ndjson'))
+            self.assertTrue(text.endswith('\n'))
+            records = [json.loads(line) for line in text.split('\n')[:-1]]
+            self.assertEqual([record['index'] for record in records], [1, 2, 3, 4])
+            self.assertEqual([record['query'] for record in records], self.queries[1:])
+            self.assertTrue(all(set(record) == {'index', 'query', 'hits'} for record in records))
+
+    def test_search_invalid_requests(self):
+        """测试不合法的检索请求返回 400，数据处理器加载完成前返回 503"""
+        invalid = {
+            '/search': ['{bad', '[1]', {}, {'query': '  '}, {'query': '合同', 'law_top_k': 1000},
+                        {'query': '合同', 'qa_top_k': 'abc'}],
+            '/search/batch': ['{bad', {'queries': '合同'}, {'queries': [1]}, {'queries': ['合同'], 'limit': 0},
+                              {'queries': ['合同'], 'offset': -1}, {'queries': ['合同'], 'limit': 101},
+                              {'queries': ['合同'], 'law_top_k': -1}],
+        }
+        for path, bodies in invalid.items():
+            for body in bodies:
+                status, _, _ = self.post(path, body if isinstance(body, str) else json.dumps(body))
+                self.assertEqual(status, 400, (path, body))
+        with mock.patch.object(self.module, 'peek_data_processor', return_value=None):
+            for path, body in (('/search', {'query': '合同'}), ('/search/batch', {'queries': ['合同']})):
+                self.assertEqual(self.post_json(path, body)[0], 503)
+
+
+class TestSearchEndpoints(SearchEndpointCases, unittest.TestCase):
+    module = flask_app
+
+    def setUp(self):
+        self.client = flask_app.app.test_client()
+        super().setUp()
+
+    def post(self, path, body, headers=None):
+        response = self.client.post(path, data=body, headers={'Content-Type': 'application/json', **(headers or {})})
+        return response.status_code, response.content_type, response.get_data(as_text=True)
+
+
+class ServiceEndpointCases:
+    """
+    Flask 和 ASGI 两个入口共用的运维接口（/metrics、/ready、/admin/reload-corpus）测试用例
+    子类实现 get(path) 和 post(path, body, headers)，均返回 (状态码, Content-Type, 响应文本)
+    """
+
+    def test_metrics_endpoint(self):
+        """测试 /metrics 以 Prometheus 文本格式导出注册的指标，请求计数随请求增加"""
+        def invalid_searches(text):
+            match = re.search(r'^rag_requests_total\{endpoint="search",status="invalid"\} (\d+)$', text, re.M)
+            return int(match.group(1)) if match else 0
+
+        before = invalid_searches(self.get('/metrics')[2])
+        self.post('/start-session', '')
+        self.assertEqual(self.post('/search', '{bad')[0], 400)
+        status, content_type, text = self.get('/metrics')
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith('text/plain; version=0.0.4'))
+        for name, kind in (('rag_ready', 'gauge'), ('rag_active_sessions', 'gauge'), ('rag_session_messages', 'gauge'),
+                           ('rag_session_content_chars', 'gauge'), ('rag_corpus_rows', 'gauge'),
+                           ('rag_cache_hits_total', 'counter'), ('rag_cache_misses_total', 'counter'),
+                           ('rag_requests_total', 'counter'), ('rag_request_duration_seconds', 'histogram'),
+                           ('rag_stage_duration_seconds', 'histogram'), ('rag_process_resident_memory_bytes', 'gauge')):
+            self.assertIn(f'# TYPE {name} {kind}', text)
+        self.assertRegex(text, r'(?m)^rag_active_sessions [1-9]')
+        self.assertRegex(text, r'(?m)^rag_cache_hits_total\{cache="semantic_answer"\} \d+')
+        self.assertRegex(text, r'(?m)^rag_request_duration_seconds_count\{endpoint="search"\} [1-9]')
+        self.assertEqual(invalid_searches(text), before + 1)
+
+    def test_ready_endpoint(self):
+        """测试 /ready 在后台加载期间返回 503 和加载进度，加载完成后返回 200"""
+        SlowProcessor.release = threading.Event()
+        self.addCleanup(reset_warmup)
+        self.addCleanup(SlowProcessor.release.set)
+        reset_warmup()
+        with mock.patch.object(data_processor, 'DataProcessor', SlowProcessor):
+            data_processor.start_warmup()
+            status, _, text = self.get('/ready')
+            body = json.loads(text)
+            self.assertEqual(status, 503)
+            self.assertFalse(body['ready'])
+            self.assertEqual((body['state'], body['stage'], body['detail']), ('loading', 'embedding', {'done': 1, 'total': 2}))
+            self.assertGreaterEqual(body['elapsed'], 0)
+
+            SlowProcessor.release.set()
+            data_processor._warmup_thread.join(5)
+            status, _, text = self.get('/ready')
+            body = json.loads(text)
+            self.assertEqual(status, 200)
+            self.assertTrue(body['ready'])
+            self.assertEqual(body['state'], 'ready')
+
+    def test_reload_corpus_endpoint(self):
+        """测试语料热更新需要管理令牌，新的实例复用已加载的模型并替换单例，旧实例在不再被引用时关闭"""
+        self.addCleanup(reset_warmup)
+        old = ReloadedProcessor(text_embedding='model')
+        old.corpus_version = 'v1'
+        data_processor._data_processor = old
+        with mock.patch.object(flask_app, 'ADMIN_TOKEN', 'secret'), \
+                mock.patch.object(data_processor, 'DataProcessor', ReloadedProcessor):
+            for headers in (None, {'X-Admin-Token': 'wrong'}):
+                self.assertEqual(self.post('/admin/reload-corpus', '', headers)[0], 403)
+            self.assertIs(data_processor.peek_data_processor(), old)
+
+            status, _, text = self.post('/admin/reload-corpus', '', {'X-Admin-Token': 'secret'})
+        self.assertEqual(status, 200)
+        body = json.loads(text)
+        self.assertEqual((body['status'], body['corpus_version'], body['law_count'], body['qa_count']),
+                         ('success', 'v2', 3, 1))
+        new = data_processor.peek_data_processor()
+        self.assertIsNot(new, old)
+        self.assertEqual(new.text_embedding, 'model')
+        old.close_when_unreferenced.assert_called_once_with()
+        new.close_when_unreferenced.assert_not_called()
+
+
+class TestServiceEndpoints(ServiceEndpointCases, unittest.TestCase):
+    def setUp(self):
+        self.client = flask_app.app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.content_type, response.get_data(as_text=True)
+
+    def post(self, path, body, headers=None):
+        response = self.client.post(path, data=body, headers={'Content-Type': 'application/json', **(headers or {})})
+        return response.status_code, response.content_type, response.get_data(as_text=True)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
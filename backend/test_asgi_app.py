@@ -0,0 +1,173 @@
+# test_asgi_app.py
+import json
+import os
+import threading
+import unittest
+from unittest import mock
+from starlette.testclient import TestClient
+from test_app import SearchEndpointCases, ServiceEndpointCases
+
+# 导入时不在测试进程中加载语料和嵌入模型
+with mock.patch.dict(os.environ, {'LAZY_STARTUP': '1', 'SESSION_STORE': 'memory'}), \
+        mock.patch('data_processor.start_warmup'):
+    import app as flask_app
+    import asgi_app
+
+
+def parse_events(text):
+    """把 SSE 响应解析为 [(事件名, 数据)]，无事件名的事件为 None，忽略注释行"""
+    events = []
+    for block in text.split('\n\n'):
+        lines = [line for line in block.splitlines() if line and not line.startswith(':')]
+        if not lines:
+            continue
+        event = next((line[len('event: '):] for line in lines if line.startswith('event: ')), None)
+        data = next(line[len('data: '):] for line in lines if line.startswith('data: '))
+        events.append((event, json.loads(data)))
+    return events
+
+
+class FakeProcessor:
+    """固定返回一条法条的检索结果"""
+
+    def retrieve(self, query, law_top_k=3, qa_top_k=3, **kwargs):
+        return [{'source': 'law', 'row': 0, 'score': 0.9, 'text': '第一条 用人单位解除劳动合同应当支付经济补偿'}]
+
+
+async def fake_stream(full_messages):
+    for delta in ('根据', '相关规定'):
+        yield delta
+
+
+async def failing_stream(full_messages):
+    yield '根据'
+    raise RuntimeError('模型接口断开')
+
+
+class TestASGIApp(SearchEndpointCases, ServiceEndpointCases, unittest.TestCase):
+    module = asgi_app
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = TestClient(asgi_app.app)
+        cls.client.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+        super().tearDownClass()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.headers['content-type'], response.text
+
+    def post(self, path, body, headers=None):
+        response = self.client.post(path, content=body.encode('utf-8'),
+                                    headers={'Content-Type': 'application/json', **(headers or {})})
+        return response.status_code, response.headers['content-type'], response.text
+
+    def start_session(self, is_law_mode=False):
+        session_id = self.client.post('/start-session').json()['session_id']
+        response = self.client.post('/set-system-prompt', json={
+            'session_id': session_id, 'system_prompt': '你是一名律师', 'is_law_mode': is_law_mode,
+            'semantic_cache': False,
+        })
+        self.assertEqual(response.status_code, 200)
+        return session_id
+
+    def test_01_chat(self):
+        """测试非流式对话返回模型回复，并追加到会话历史"""
+        session_id = self.start_session()
+        messages = [{'role': 'user', 'content': '你好'}]
+        with mock.patch.object(asgi_app, 'create_chat_completion', mock.AsyncMock(return_value='你好，请问有什么可以帮您')):
+            body = self.client.post('/chat', json={'session_id': session_id, 'messages': messages}).json()
+        self.assertEqual(body['choices'][0]['message']['content'], '你好，请问有什么可以帮您')
+        self.assertEqual(body['related_cases'], [])
+        history = flask_app.chat_sessions.get_history(session_id)
+        self.assertEqual([msg['role'] for msg in history], ['user', 'assistant'])
+
+    def test_02_stream_event_order(self):
+        """测试流式对话依次返回 related_cases、各段内容和 done，done 中为完整回复"""
+        session_id = self.start_session()
+        with mock.patch.object(asgi_app, 'stream_chat_completion', fake_stream):
+            response = self.client.post('/chat/stream', json={
+                'session_id': session_id, 'messages': [{'role': 'user', 'content': '劳动合同怎么解除'}]
+            })
+        self.assertTrue(response.headers['content-type'].startswith('text/event-stream'))
+        events = parse_events(response.text)
+        self.assertEqual([event for event, _ in events], ['related_cases', None, None, 'done'])
+        self.assertEqual([data['content'] for event, data in events if event is None], ['根据', '相关规定'])
+        self.assertEqual(events[-1][1]['message'], {'role': 'assistant', 'content': '根据相关规定'})
+        self.assertEqual(flask_app.chat_sessions.get_history(session_id)[-1]['content'], '根据相关规定')
+
+    def test_03_stream_related_cases(self):
+        """测试法律模式下先返回检索到的相关案例，并装入发送给模型的提示词"""
+        session_id = self.start_session(is_law_mode=True)
+        sent = []
+
+        async def recording_stream(full_messages):
+            sent.append(full_messages)
+            yield '回答'
+
+        with mock.patch.object(asgi_app, 'peek_data_processor', return_value=FakeProcessor()), \
+                mock.patch.object(asgi_app, 'stream_chat_completion', recording_stream):
+            response = self.client.post('/chat/stream', json={
+                'session_id': session_id, 'messages': [{'role': 'user', 'content': '解除劳动合同有补偿吗'}],
+                'deep_thinking': True,
+            })
+        events = parse_events(response.text)
+        self.assertEqual([event for event, _ in events], ['related_cases', None, 'done'])
+        self.assertEqual(events[0][1]['retrieval_status'], 'ok')
+        self.assertEqual(len(events[0][1]['related_cases']), 1)
+        self.assertIn('经济补偿', sent[0][-1]['content'])
+
+    def test_04_stream_error_event(self):
+        """测试模型接口中途出错时以 error 事件结束，不追加不完整的回复"""
+        session_id = self.start_session()
+        with mock.patch.object(asgi_app, 'stream_chat_completion', failing_stream):
+            response = self.client.post('/chat/stream', json={
+                'session_id': session_id, 'messages': [{'role': 'user', 'content': '你好'}]
+            })
+        events = parse_events(response.text)
+        self.assertEqual([event for event, _ in events], ['related_cases', None, 'error'])
+        self.assertIn('模型接口断开', events[-1][1]['error'])
+        self.assertEqual([msg['role'] for msg in flask_app.chat_sessions.get_history(session_id)], ['user'])
+
+    def test_05_invalid_requests(self):
+        """测试请求体不是合法的 JSON 对象或会话无效时返回 400"""
+        headers = {'Content-Type': 'application/json'}
+        for path in ('/set-system-prompt', '/chat', '/chat/stream'):
+            for body in ('{bad', '[1, 2]'):
+                response = self.client.post(path, content=body, headers=headers)
+                self.assertEqual(response.status_code, 400, (path, body))
+            response = self.client.post(path, json={'session_id': 'missing', 'messages': []})
+            self.assertEqual(response.status_code, 400)
+
+    def test_06_chat_during_warmup(self):
+        """测试预热期间检索线程池被占满时普通对话立即返回，法律模式等待超时后不附带相关案例"""
+        release = threading.Event()
+        busy = [asgi_app.retrieval_executor.submit(release.wait) for _ in range(asgi_app.RETRIEVAL_WORKERS)]
+        self.addCleanup(release.set)
+        with mock.patch.object(asgi_app, 'peek_data_processor', return_value=None), \
+                mock.patch.object(asgi_app, 'warmup_status', return_value={'state': 'loading', 'ready': False}), \
+                mock.patch.object(asgi_app, 'WARMUP_WAIT_SECONDS', 0.1), \
+                mock.patch.object(asgi_app, 'create_chat_completion', mock.AsyncMock(return_value='您好')):
+            body = self.client.post('/chat', json={
+                'session_id': self.start_session(), 'messages': [{'role': 'user', 'content': '你好'}],
+            }).json()
+            self.assertEqual(body['choices'][0]['message']['content'], '您好')
+            self.assertIsNone(body['retrieval_status'])
+            self.assertFalse(any(future.done() for future in busy))
+
+            release.set()
+            body = self.client.post('/chat', json={
+                'session_id': self.start_session(is_law_mode=True), 'deep_thinking': True,
+                'messages': [{'role': 'user', 'content': '解除劳动合同有补偿吗'}],
+            }).json()
+            self.assertEqual(body['retrieval_status'], 'warming_up')
+            self.assertEqual(body['related_cases'], [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,54 @@
+# test_benchmark.py
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from benchmark import benchmark_size, percentiles, scale_corpus, synthetic_corpus
+from embedding_backends import HashingEmbedding
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.law, self.qa = synthetic_corpus(law_count=300, qa_count=100)
+        self.embedding = HashingEmbedding(dim=64)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_01_stub_embedding_is_deterministic(self):
+        """测试本地嵌入可重复，字面相近的文本相似度更高"""
+        first = self.embedding({'source_sentence': ['劳动合同解除赔偿', '离婚抚养权']})['text_embedding']
+        second = HashingEmbedding(dim=64)({'source_sentence': ['劳动合同解除赔偿']})['text_embedding']
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertAlmostEqual(float(np.linalg.norm(first[0])), 1.0, places=5)
+        near = self.embedding({'source_sentence': ['劳动合同解除']})['text_embedding'][0]
+        self.assertGreater(float(near @ first[0]), float(near @ first[1]))
+
+    def test_02_scale_and_percentiles(self):
+        """测试语料扩充到指定行数且副本不重复，分位数单位为毫秒"""
+        scaled = scale_corpus(self.law, 1000)
+        self.assertEqual(len(scaled), 1000)
+        self.assertEqual(len(set(scaled)), 1000)
+        self.assertEqual(scale_corpus(self.law, 10), self.law[:10])
+        stats = percentiles([0.001] * 99 + [0.1])
+        self.assertAlmostEqual(stats['p50_ms'], 1.0)
+        self.assertGreater(stats['p99_ms'], stats['p95_ms'])
+
+    def test_03_benchmark_reports_latency_and_recall(self):
+        """测试基准测试输出延迟分位数，扫描全部簇时近似索引的召回率为 1"""
+        result = benchmark_size(
+            600, self.law, self.qa, self.embedding, queries=20, index_type='ivf',
+            nprobes=[1, 10 ** 6], batch_sizes=[4], work_dir=self.tmp_dir
+        )
+        self.assertEqual(result['law_rows'], 600)
+        self.assertEqual(result['qa_rows'], 200)
+        self.assertEqual(result['find_relevant_cases']['count'], 20)
+        self.assertIn('p99_ms', result['vector_search'])
+        self.assertGreater(result['embedding_throughput']['4']['sentences_per_second'], 0)
+        self.assertEqual(result['recall'][str(10 ** 6)]['recall'], 1.0)
+        self.assertLessEqual(result['recall']['1']['recall'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,95 @@
+# test_build_index.py
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from benchmark import synthetic_corpus
+from build_index import ParallelEmbeddingBuilder, build, migrate_legacy_layout
+from data_processor import DataProcessor
+from embedding_backends import HashingEmbedding
+
+
+class TestBuildIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.law, self.qa = synthetic_corpus(law_count=200, qa_count=60)
+        self.write_csv('law_data_3k.csv', self.law)
+        self.write_csv('law_QA.csv', self.qa)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_csv(self, filename, texts):
+        with open(os.path.join(self.tmp_dir, filename), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['data'])
+            writer.writerows([text] for text in texts)
+
+    def test_01_resume_from_checkpoints(self):
+        """测试分片计算的结果与单进程一致，删除一个检查点后只重新计算该分片"""
+        texts = self.law[:50]
+        checkpoint_dir = os.path.join(self.tmp_dir, 'checkpoints')
+        builder = ParallelEmbeddingBuilder(checkpoint_dir, workers=2, shard_rows=8, backend='stub')
+        try:
+            self.assertEqual(builder.model_id, HashingEmbedding().model_id)
+            embeddings = builder.build(texts, batch_size=4)
+            expected = HashingEmbedding()({'source_sentence': texts})['text_embedding']
+            np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+            self.assertEqual(builder.computed_shards, 7)
+            self.assertEqual(len(os.listdir(checkpoint_dir)), 7)
+
+            os.remove(builder.checkpoint_path(texts[16:24]))
+            np.testing.assert_array_equal(builder.build(texts, batch_size=4), embeddings)
+            self.assertEqual(builder.computed_shards, 8)
+        finally:
+            builder.close()
+
+    def test_02_build_and_publish(self):
+        """测试构建结果与服务端一致并以符号链接原子发布，语料修改后增量构建只计算变化的分片"""
+        # 服务端已生成的普通目录须先迁移为版本链接，迁移后其中的向量可以复用
+        DataProcessor(text_embedding=HashingEmbedding(), data_dir=self.tmp_dir, chunk_max_chars=0)
+        embeddings_dir = os.path.join(self.tmp_dir, 'embeddings')
+        builds_dir = os.path.join(self.tmp_dir, 'embeddings-builds')
+        with self.assertRaisesRegex(RuntimeError, '--migrate-legacy'):
+            build(self.tmp_dir, workers=2, shard_rows=64, backend='stub')
+        self.assertFalse(os.path.islink(embeddings_dir))
+        legacy_dir = migrate_legacy_layout(embeddings_dir, builds_dir)
+        self.assertTrue(os.path.basename(legacy_dir).endswith('-legacy'))
+        self.assertIsNone(migrate_legacy_layout(embeddings_dir, builds_dir))
+
+        first = build(self.tmp_dir, workers=2, shard_rows=64, backend='stub')
+        version_dir, corpus_version = first['version_dir'], first['corpus_version']
+        self.assertEqual(first['computed_shards'], 0)
+        self.assertTrue(os.path.islink(embeddings_dir))
+        self.assertEqual(os.path.realpath(embeddings_dir), os.path.realpath(version_dir))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'embeddings-builds', 'checkpoints')))
+
+        processor = DataProcessor(text_embedding=HashingEmbedding(), data_dir=self.tmp_dir)
+        self.assertEqual(processor.corpus_version, corpus_version)
+        law_embeddings = np.load(os.path.join(embeddings_dir, 'law_data_embeddings.npy'))
+
+        self.write_csv('law_data_3k.csv', ['新增的条文'] + self.law[1:])
+        second = build(self.tmp_dir, workers=1, shard_rows=64, backend='stub')
+        second_dir = second['version_dir']
+        self.assertNotEqual(second['corpus_version'], corpus_version)
+        self.assertEqual(second['computed_shards'], 1)
+        self.assertEqual(os.path.realpath(embeddings_dir), os.path.realpath(second_dir))
+        # 未修改的块复用已发布的向量，旧版本的文件保持不变
+        np.testing.assert_array_equal(np.load(os.path.join(version_dir, 'law_data_embeddings.npy')), law_embeddings)
+        updated = np.load(os.path.join(embeddings_dir, 'law_data_embeddings.npy'))
+        np.testing.assert_array_equal(updated[-10:], law_embeddings[-10:])
+        self.assertEqual(
+            DataProcessor(text_embedding=HashingEmbedding(), data_dir=self.tmp_dir).get_texts(0, [0]), ['新增的条文']
+        )
+
+        third = build(self.tmp_dir, workers=1, shard_rows=64, backend='stub', keep_versions=2)
+        third_dir = third['version_dir']
+        self.assertEqual(third['computed_shards'], 0)
+        versions = [name for name in os.listdir(os.path.join(self.tmp_dir, 'embeddings-builds')) if name.startswith('v-')]
+        self.assertEqual(sorted(versions), sorted([os.path.basename(second_dir), os.path.basename(third_dir)]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,134 @@
+# test_cache.py
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from cache import LRUCache, ResultCache, SemanticCache, normalize_query_text
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_01_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # a 变为最近使用
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_02_ttl_and_stats(self):
+        """测试过期条目失效以及命中统计"""
+        cache = LRUCache(maxsize=10, ttl=0.05)
+        cache.set('q', 'v')
+        self.assertEqual(cache.get('q'), 'v')
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('q'))
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['size'], 0)
+
+    def test_03_disabled(self):
+        """测试容量为 0 时不缓存"""
+        cache = LRUCache(maxsize=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_04_normalize_query_text(self):
+        """测试查询文本规范化"""
+        self.assertEqual(
+            normalize_query_text('  劳动合同解除赔偿怎么算？ '),
+            normalize_query_text('劳动合同解除赔偿怎么算?')
+        )
+        self.assertEqual(normalize_query_text('Labor  Law\n'), 'labor law')
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'result_cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_01_disk_tier_survives_restart(self):
+        """测试 SQLite 磁盘缓存在新实例中仍可命中"""
+        cache = ResultCache(maxsize=10, sqlite_path=self.db_path, version='v1')
+        key = cache.make_key('劳动合同解除赔偿怎么算', 3, 3, 0.3)
+        cache.set(key, ['[法条1] 第一条'])
+
+        restarted = ResultCache(maxsize=10, sqlite_path=self.db_path, version='v1')
+        self.assertEqual(restarted.make_key(' 劳动合同解除赔偿怎么算 ', 3, 3, 0.3), key)
+        self.assertEqual(restarted.get(key), ['[法条1] 第一条'])
+        self.assertEqual(restarted.stats()['disk_hits'], 1)
+
+    def test_02_version_invalidation(self):
+        """测试语料版本变化后旧结果失效"""
+        cache = ResultCache(maxsize=10, sqlite_path=self.db_path, version='v1')
+        key = cache.make_key('问题', 3, 3, 0.3)
+        cache.set(key, ['旧结果'])
+
+        updated = ResultCache(maxsize=10, sqlite_path=self.db_path, version='v2')
+        self.assertNotEqual(updated.make_key('问题', 3, 3, 0.3), key)
+        self.assertIsNone(updated.get(key))
+
+    def test_03_params_in_key(self):
+        """测试检索参数不同时缓存键不同"""
+        cache = ResultCache(maxsize=10)
+        self.assertNotEqual(cache.make_key('问题', 3, 3, 0.3), cache.make_key('问题', 5, 3, 0.3))
+
+
+
+class TestSemanticCache(unittest.TestCase):
+    def setUp(self):
+        self.query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+        # 与 query 的余弦相似度约为 0.995 和 0.707
+        self.similar = np.array([1.0, 0.1, 0.0], dtype=np.float32)
+        self.different = np.array([1.0, 1.0, 0.0], dtype=np.float32)
+
+    def test_01_similarity_threshold_and_scope(self):
+        """测试相似度不低于阈值时命中，不同 scope 之间互不命中"""
+        cache = SemanticCache(maxsize=10, threshold=0.95)
+        scope = SemanticCache.make_scope('系统提示词', 3, 3, 'v1')
+        self.assertIsNone(cache.get(scope, self.query))
+        cache.set(scope, self.query * 2, {'answer': '回答'})
+        value, similarity = cache.get(scope, self.similar)
+        self.assertEqual(value, {'answer': '回答'})
+        self.assertGreater(similarity, 0.99)
+        self.assertIsNone(cache.get(scope, self.different))
+        self.assertIsNone(cache.get(SemanticCache.make_scope('系统提示词', 5, 3, 'v1'), self.query))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 3, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 0.25)
+
+    def test_02_replace_evict_and_expire(self):
+        """测试同义条目替换旧条目，超过容量淘汰最久未使用的条目，过期后不再命中"""
+        cache = SemanticCache(maxsize=2, threshold=0.95)
+        cache.set('s', self.query, '旧回答')
+        cache.set('s', self.similar, '新回答')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('s', self.query)[0], '新回答')
+        cache.set('s', self.different, '另一个回答')
+        cache.get('s', self.query)
+        cache.set('t', self.query, '其他 scope')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('s', self.different))
+        self.assertEqual(cache.get('s', self.query)[0], '新回答')
+
+        expiring = SemanticCache(maxsize=2, ttl=0.05)
+        expiring.set('s', self.query, '回答')
+        time.sleep(0.1)
+        self.assertIsNone(expiring.get('s', self.query))
+        self.assertEqual(len(expiring), 0)
+        disabled = SemanticCache(maxsize=0)
+        disabled.set('s', self.query, '回答')
+        self.assertIsNone(disabled.get('s', self.query))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
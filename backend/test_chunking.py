@@ -0,0 +1,59 @@
+# test_chunking.py
+import unittest
+from chunking import ChunkTable, chunk_spans, sentence_spans
+
+
+class TestChunking(unittest.TestCase):
+    def setUp(self):
+        self.text = (
+            "第一条 为了保护劳动者的合法权益，制定本法。"
+            "第二条 在中华人民共和国境内的企业与劳动者建立劳动关系，适用本法。依照本法第二十三条的规定执行。"
+            "\n第三条 劳动合同是劳动者与用人单位确立劳动关系的协议。"
+        )
+
+    def test_01_sentence_and_article_boundaries(self):
+        """测试按句末标点和行首条文编号切分，正文中引用的条文编号不切分"""
+        spans = sentence_spans(self.text)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(self.text))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(spans, spans[1:])))
+        sentences = [self.text[start:end] for start, end in spans]
+        self.assertIn("依照本法第二十三条的规定执行。\n", sentences)
+        self.assertTrue(sentences[-1].startswith("第三条"))
+
+    def test_02_chunk_size_and_overlap(self):
+        """测试块长度不超过上限、覆盖全文，相邻块有重叠且不会无限循环"""
+        chunks = chunk_spans(self.text, max_chars=40, overlap=20)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(end - start <= 40 for start, end in chunks))
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(self.text))
+        self.assertTrue(all(b[0] <= a[1] for a, b in zip(chunks, chunks[1:])))
+        self.assertTrue(all(b[0] > a[0] for a, b in zip(chunks, chunks[1:])))
+
+        # 超长的单句按上限硬切分
+        long_chunks = chunk_spans("很" * 100, max_chars=30, overlap=0)
+        self.assertEqual([end - start for start, end in long_chunks], [30, 30, 30, 10])
+        self.assertEqual(chunk_spans(self.text, max_chars=0), [(0, len(self.text))])
+
+    def test_03_group_by_parent(self):
+        """测试命中的块按所属行去重，相邻块合并，行按最佳排名排序"""
+        table = ChunkTable.build([self.text, "短文本。", self.text], max_chars=40, overlap=0)
+        self.assertFalse(table.is_identity)
+        first_row = [i for i in range(len(table)) if table.parents[i] == 0]
+        second_row = [i for i in range(len(table)) if table.parents[i] == 1]
+
+        groups = table.group_by_parent([second_row[0], first_row[1], first_row[0], first_row[-1]], top_k=2)
+        self.assertEqual([row for row, _ in groups], [1, 0])
+        spans = groups[1][1]
+        self.assertEqual(spans[0], (int(table.starts[first_row[0]]), int(table.ends[first_row[1]])))
+        self.assertEqual(len(spans), 2)
+        self.assertEqual(len(table.group_by_parent([first_row[0], second_row[0]], top_k=1)), 1)
+
+        identity = ChunkTable.build(["甲。", "乙。"], max_chars=0)
+        self.assertTrue(identity.is_identity)
+        self.assertEqual(identity.chunk_texts(["甲。", "乙。"]), ["甲。", "乙。"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
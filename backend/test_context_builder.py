@@ -0,0 +1,81 @@
+# test_context_builder.py
+import unittest
+from context_builder import PASSAGE_TEMPLATE, ContextBuilder, TokenCounter
+
+
+def render_prompt(question, passages):
+    context = "".join(PASSAGE_TEMPLATE.format(index=i, text=text) for i, text in enumerate(passages, 1))
+    return f"用户问题: {question}\n\n{context}请根据以上搜索结果回答问题。"
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        self.counter = TokenCounter()
+
+    def test_01_token_counter(self):
+        """测试本地估算：汉字各计 1 个，英文单词按长度折算，截断不超出预算"""
+        self.assertEqual(self.counter.count("劳动合同"), 4)
+        self.assertEqual(self.counter.count("labour law"), 2 + 1)
+        self.assertEqual(self.counter.count(""), 0)
+        truncated = self.counter.truncate("劳动合同解除赔偿" * 10, 15)
+        self.assertEqual(self.counter.count(truncated), 15)
+
+    def test_02_pack_highest_scoring_first(self):
+        """测试按相关度装入片段，装不下的片段跳过，外层格式按实际模板计数"""
+        builder = ContextBuilder(counter=self.counter)
+        # "[文件 i 开始]\n\n[文件 i 结束]\n\n" 占 14 个 token
+        self.assertEqual(builder.passage_overhead(1), 14)
+        passages = [("低" * 10, 0.2), ("高" * 30, 0.9), ("中" * 30, 0.5)]
+        selected = builder.pack_passages(passages, budget=68)
+        self.assertEqual(selected, ["高" * 30, "低" * 10])
+        # 单个片段超出预算时截断最相关的片段
+        self.assertEqual(builder.pack_passages([("长" * 100, 0.9)], budget=32), ["长" * 18])
+
+        # 带来源标记的片段装入后，实际渲染占用的 token 数不超过预算
+        passages = [(f"[法条{i}] " + "条文" * 20, 1 - i / 10) for i in range(1, 10)]
+        selected = builder.pack_passages(passages, budget=200)
+        rendered = "".join(PASSAGE_TEMPLATE.format(index=i, text=text) for i, text in enumerate(selected, 1))
+        self.assertEqual(len(selected), 3)
+        self.assertLessEqual(self.counter.count(rendered), 200)
+
+    def test_03_budget_and_report(self):
+        """测试总占用不超过预算，更早的对话被压缩为摘要，报告各部分 token 数"""
+        history = []
+        for i in range(10):
+            history.append({'role': 'user', 'content': f"第{i}个问题" + "问" * 20})
+            history.append({'role': 'assistant', 'content': "答" * 80})
+        history.append({'role': 'user', 'content': "劳动合同解除怎么赔偿？"})
+        passages = [("案例" * 40, 0.8), ("条文" * 40, 0.7), ("无关" * 400, 0.1)]
+
+        builder = ContextBuilder(max_tokens=620, retrieval_tokens=250, summary_tokens=60, counter=self.counter)
+        messages, selected, report = builder.build("你是一名律师", history, passages, render_prompt)
+
+        self.assertEqual(messages[0], {'role': 'system', 'content': '你是一名律师'})
+        self.assertTrue(messages[1]['content'].startswith("更早的对话中用户问过："))
+        self.assertEqual(messages[2]['role'], 'user')
+        self.assertIn("劳动合同解除怎么赔偿？", messages[-1]['content'])
+        self.assertIn("案例" * 40, messages[-1]['content'])
+        self.assertEqual(len(selected), 2)
+        self.assertEqual(report['passages_dropped'], 1)
+        self.assertGreater(report['history_messages_dropped'], 0)
+        self.assertLessEqual(report['total'], 620)
+        self.assertLessEqual(report['retrieval'], 250)
+        # 装入时估算的占用与渲染后的实际占用一致
+        self.assertEqual(report['retrieval'], sum(self.counter.count(text) + builder.passage_overhead(i)
+                                                  for i, text in enumerate(selected, 1)))
+        self.assertEqual(report['total'], sum(self.counter.count_message(msg) for msg in messages))
+
+    def test_04_without_retrieval(self):
+        """测试普通模式下不套用模板，短对话原样发送"""
+        builder = ContextBuilder(counter=self.counter)
+        history = [{'role': 'user', 'content': '你好'}, {'role': 'assistant', 'content': '您好'},
+                   {'role': 'user', 'content': '介绍一下劳动法'}]
+        messages, selected, report = builder.build(None, history)
+        self.assertEqual(messages, history)
+        self.assertEqual(selected, [])
+        self.assertEqual(report['template'], 0)
+        self.assertEqual(report['retrieval'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
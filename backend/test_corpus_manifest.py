@@ -0,0 +1,118 @@
+# test_corpus_manifest.py
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from corpus_manifest import load_manifest, plan_update, row_hash
+from data_processor import DataProcessor
+from embedding_backends import HashingEmbedding, embed_sentences
+
+
+class TestPlanUpdate(unittest.TestCase):
+    def test_01_reuse_modify_add_delete(self):
+        """测试未变化的行复用旧行号，修改和新增的行需要重新计算，删除的行不出现在结果中"""
+        old = [row_hash(text) for text in ('a', 'b', 'c', 'd')]
+        new = [row_hash(text) for text in ('a', 'b2', 'c', 'e', 'f')]
+        reuse, missing = plan_update(old, new)
+        self.assertEqual(reuse.tolist(), [0, -1, 2, -1, -1])
+        self.assertEqual(missing.tolist(), [1, 3, 4])
+
+    def test_02_reorder_and_duplicates(self):
+        """测试行顺序变化时按内容找到旧行号，重复的行复用同一个旧行"""
+        old = [row_hash(text) for text in ('a', 'b', 'c')]
+        new = [row_hash(text) for text in ('c', 'a', 'b', 'a')]
+        reuse, missing = plan_update(old, new)
+        self.assertEqual(reuse.tolist(), [2, 0, 1, 0])
+        self.assertEqual(len(missing), 0)
+        reuse, missing = plan_update([], new)
+        self.assertEqual(missing.tolist(), [0, 1, 2, 3])
+
+
+class TestSyncEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.embedding = HashingEmbedding(dim=64)
+        self.computed = []
+        self.law = [f'第{i}条 劳动合同解除应当支付经济补偿{i}' for i in range(20)]
+        self.qa = [f'问题{i} 离婚后抚养权如何确定{i}' for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_corpus(self):
+        for filename, texts in (('law_data_3k.csv', self.law), ('law_QA.csv', self.qa)):
+            with open(os.path.join(self.tmp_dir, filename), 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['data'])
+                writer.writerows([text] for text in texts)
+
+    def builder(self, embedding):
+        """记录需要计算嵌入的文本"""
+        def build(texts, batch_size=None, desc=None):
+            self.computed.extend(texts)
+            return embed_sentences(embedding, texts) if texts else np.empty((0, 0), dtype=np.float32)
+        return build
+
+    def processor(self, embedding=None, **kwargs):
+        embedding = embedding or self.embedding
+        self.computed = []
+        self.write_corpus()
+        return DataProcessor(text_embedding=embedding, data_dir=self.tmp_dir, chunk_max_chars=0,
+                             embedding_builder=self.builder(embedding), **kwargs)
+
+    def assert_embeddings_match(self, processor, embedding=None):
+        """增量同步后的向量与全部重新计算的结果一致，清单与当前行一一对应"""
+        embedding = embedding or self.embedding
+        for filename, name, texts in (('law_data_embeddings.npy', 'law_data', self.law),
+                                      ('law_qa_embeddings.npy', 'law_qa', self.qa)):
+            np.testing.assert_allclose(processor.load_embeddings(filename), embed_sentences(embedding, texts), rtol=1e-6)
+            manifest = load_manifest(processor.embeddings_dir)
+            self.assertEqual(manifest['sources'][name], [row_hash(text) for text in texts])
+            self.assertEqual(manifest['model'], embedding.model_id)
+
+    def test_01_incremental_update(self):
+        """测试修改、新增、删除和调整顺序后只计算修改和新增的行"""
+        first = self.processor()
+        self.assertEqual(len(self.computed), 30)
+
+        # 语料版本号由清单计算，不读取嵌入向量文件
+        with mock.patch('numpy.load', side_effect=AssertionError('不应读取向量文件')):
+            version = first.compute_corpus_version()
+        self.assertEqual(version, first.corpus_version)
+        second = self.processor()
+        self.assertEqual(self.computed, [])
+        self.assertEqual(second.corpus_version, version)
+
+        self.law[3] = '第3条 修改后的条文内容'
+        self.law.append('第20条 新增的条文')
+        del self.law[7]
+        self.law[0], self.law[10] = self.law[10], self.law[0]
+        self.qa.reverse()
+        processor = self.processor()
+        self.assertEqual(sorted(self.computed), sorted(['第3条 修改后的条文内容', '第20条 新增的条文']))
+        self.assert_embeddings_match(processor)
+        self.assertNotEqual(processor.corpus_version, version)
+
+    def test_02_model_change(self):
+        """测试嵌入模型变化后全部重新计算"""
+        version = self.processor().corpus_version
+        other = HashingEmbedding(dim=32)
+        processor = self.processor(other)
+        self.assertEqual(len(self.computed), 30)
+        self.assert_embeddings_match(processor, other)
+        self.assertNotEqual(processor.corpus_version, version)
+
+    def test_03_full_rebuild(self):
+        """测试全部重新计算时每一行只计算一次（构造时不再先做一次增量同步）"""
+        version = self.processor().corpus_version
+        processor = self.processor(full_rebuild=True)
+        self.assertEqual(sorted(self.computed), sorted(self.law + self.qa))
+        self.assert_embeddings_match(processor)
+        self.assertEqual(processor.corpus_version, version)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
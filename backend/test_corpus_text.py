@@ -0,0 +1,75 @@
+# test_corpus_text.py
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import corpus_text
+from corpus_text import TextColumn, load_csv_column
+
+
+class TestCorpusText(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, 'law.csv')
+        self.write_csv([['第一条 劳动合同', '标题一'], ['含有逗号,引号"和\n换行的文本', '标题二'], ['', '标题三']])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_csv(self, rows):
+        with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['data', 'title'])
+            writer.writerows(rows)
+
+    def test_01_random_access(self):
+        """测试按行号随机读取、顺序遍历和批量读取的结果一致"""
+        texts = ['劳动合同', '', 'ascii text', '多字节文本🙂']
+        column = TextColumn.build(texts)
+        self.assertEqual(len(column), 4)
+        self.assertEqual(column[3], '多字节文本🙂')
+        self.assertEqual(list(column), texts)
+        self.assertEqual(column.take([2, 0]), ['ascii text', '劳动合同'])
+
+    def test_02_build_once_from_csv(self):
+        """测试首次由 CSV 构建文本列，之后直接加载（包括 mmap）而不再解析 CSV"""
+        column = load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')
+        self.assertEqual(list(column), ['第一条 劳动合同', '含有逗号,引号"和\n换行的文本', ''])
+        titles = load_csv_column(self.csv_path, self.tmp_dir, 'law.title', 'title')
+        self.assertEqual(titles[1], '标题二')
+
+        with mock.patch.object(corpus_text, 'read_csv_column', side_effect=AssertionError('不应解析 CSV')):
+            cached = load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data', mmap=True)
+            self.assertEqual(cached[1], column[1])
+            os.remove(self.csv_path)
+            self.assertEqual(len(load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')), 3)
+
+    def test_03_rebuild_after_csv_update(self):
+        """测试 CSV 更新后重新构建文本列，缺少列时报错"""
+        load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')
+        # 在同一秒内改写 CSV 也会重新构建
+        self.write_csv([['新的条文', '标题']])
+        self.assertEqual(list(load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')), ['新的条文'])
+        with self.assertRaises(KeyError):
+            load_csv_column(self.csv_path, self.tmp_dir, 'law.content', 'content')
+
+
+    def test_04_mismatched_pair_is_rebuilt(self):
+        """测试字节串与偏移数组不配套时重新构建，旧版本的文件被删除"""
+        load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')
+        self.write_csv([['更新后的第一条', '标题一'], ['更新后的第二条', '标题二']])
+        load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')
+        self.assertEqual(len([name for name in os.listdir(self.tmp_dir) if name.endswith('.text.npy')]), 1)
+
+        version = corpus_text._read_column_meta(self.tmp_dir, 'law')['version']
+        _, offsets_path = TextColumn.paths(self.tmp_dir, f'law.{version}')
+        np.save(offsets_path, np.array([0, 3], dtype=np.int64))
+        self.assertIsNone(TextColumn.load(self.tmp_dir, f'law.{version}'))
+        self.assertEqual(list(load_csv_column(self.csv_path, self.tmp_dir, 'law', 'data')), ['更新后的第一条', '更新后的第二条'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
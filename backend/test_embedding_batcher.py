@@ -0,0 +1,50 @@
+# test_embedding_batcher.py
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from embedding_batcher import EmbeddingBatcher
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fake_embed(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+    def test_01_concurrent_queries_are_coalesced(self):
+        """测试并发查询被合并为少量批次，且每个请求拿到自己的向量"""
+        batcher = EmbeddingBatcher(self.fake_embed, max_batch_size=8, max_wait_ms=50)
+        texts = [f"问题{i}" * (i + 1) for i in range(16)]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(batcher.embed, texts))
+        batcher.close()
+
+        for text, vector in zip(texts, results):
+            np.testing.assert_array_equal(vector, [len(text), ord(text[0])])
+        self.assertLess(len(self.calls), 16)
+        self.assertTrue(all(len(call) <= 8 for call in self.calls))
+        self.assertEqual(batcher.stats()['items'], 16)
+
+    def test_02_duplicates_and_errors(self):
+        """测试批次内重复查询只计算一次，异常传递给所有等待的请求"""
+        batcher = EmbeddingBatcher(self.fake_embed, max_batch_size=4, max_wait_ms=50)
+        futures = [batcher.submit('劳动合同') for _ in range(3)]
+        vectors = [future.result(timeout=5) for future in futures]
+        self.assertEqual(sum(len(call) for call in self.calls), 1)
+        self.assertEqual(len(vectors), 3)
+
+        def failing_embed(texts):
+            raise RuntimeError('模型错误')
+        batcher.embed_fn = failing_embed
+        with self.assertRaises(RuntimeError):
+            batcher.embed('赔偿', timeout=5)
+        batcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
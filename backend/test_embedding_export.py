@@ -0,0 +1,107 @@
+# test_embedding_export.py
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from benchmark import embedding_latency, synthetic_corpus
+from embedding_backends import ExportedEmbedding, HashingEmbedding, GRAPH_INPUTS
+from embedding_export import TRACE_TEXTS, export_model, parity_report, sentence_encoder
+
+
+def installed(*modules):
+    return all(importlib.util.find_spec(module) is not None for module in modules)
+
+
+class NoisyEmbedding:
+    """在 HashingEmbedding 的向量上加入固定噪声，模拟量化后的模型"""
+
+    def __init__(self, scale):
+        self.reference = HashingEmbedding()
+        self.scale = scale
+
+    def __call__(self, inputs):
+        embeddings = self.reference(inputs)['text_embedding']
+        noise = np.random.default_rng(len(embeddings)).normal(size=embeddings.shape).astype(np.float32)
+        return {'text_embedding': embeddings + self.scale * noise}
+
+
+class TestEmbeddingExport(unittest.TestCase):
+    def setUp(self):
+        law, qa = synthetic_corpus(law_count=40, qa_count=10)
+        self.texts = law + qa
+
+    def test_01_parity_report(self):
+        """测试相同后端的偏差为 0，加入噪声后偏差增大"""
+        same = parity_report(HashingEmbedding(), HashingEmbedding(), self.texts, batch_size=8)
+        self.assertEqual(same['texts'], len(self.texts))
+        self.assertAlmostEqual(same['min_cosine'], 1.0, places=5)
+        self.assertEqual(same['neighbour_agreement'], 1.0)
+
+        noisy = parity_report(HashingEmbedding(), NoisyEmbedding(0.01), self.texts, batch_size=8)
+        self.assertLess(noisy['min_cosine'], 1.0)
+        self.assertGreater(noisy['max_drift'], 0)
+        self.assertGreaterEqual(noisy['max_drift'], noisy['mean_drift'])
+        self.assertEqual(parity_report(HashingEmbedding(), HashingEmbedding(), []), {'texts': 0})
+
+    def test_02_embedding_latency(self):
+        """测试单条查询延迟和各批大小的吞吐量"""
+        report = embedding_latency(HashingEmbedding(), self.texts, [1, 16])
+        self.assertEqual(report['query_latency']['count'], len(self.texts))
+        self.assertEqual(sorted(report['throughput']), ['1', '16'])
+        self.assertGreater(report['throughput']['16']['sentences_per_second'], 0)
+
+
+@unittest.skipUnless(installed('torch', 'transformers'), "需要安装 torch 和 transformers")
+class TestExportParity(unittest.TestCase):
+    """用随机初始化的小 BERT 模型检查导出的计算图与原模块（eager）的输出一致"""
+    texts = ['劳动合同解除', '借款合同纠纷如何处理', '工伤认定的条件是什么？']
+
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.model_dir = os.path.join(cls.tmp_dir, 'model')
+        os.makedirs(cls.model_dir)
+        characters = sorted(set(''.join(cls.texts + TRACE_TEXTS)))
+        vocab_path = os.path.join(cls.model_dir, 'vocab.txt')
+        with open(vocab_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + characters) + '\n')
+        BertTokenizerFast(vocab_file=vocab_path).save_pretrained(cls.model_dir)
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size=5 + len(characters), hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=64, max_position_embeddings=64)
+        BertModel(config, add_pooling_layer=False).eval().save_pretrained(cls.model_dir)
+
+        tokenizer = BertTokenizerFast.from_pretrained(cls.model_dir)
+        tokens = tokenizer(cls.texts, padding=True, truncation=True, max_length=32, return_tensors='pt')
+        with torch.no_grad():
+            cls.expected = sentence_encoder(cls.model_dir)(*[tokens[name] for name in GRAPH_INPUTS]).numpy()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def check_format(self, export_format):
+        output = os.path.join(self.tmp_dir, export_format)
+        metadata = export_model(output, export_format, model_dir=self.model_dir, max_length=32)
+        self.assertEqual(metadata['format'], export_format)
+        exported = ExportedEmbedding(output, threads=1)
+        np.testing.assert_allclose(exported.encode(self.texts), self.expected, rtol=1e-4, atol=1e-5)
+        embeddings = exported({'source_sentence': self.texts})['text_embedding']
+        self.assertEqual(embeddings.shape, self.expected.shape)
+
+    def test_01_torchscript(self):
+        """测试 TorchScript 计算图与原模块的输出一致"""
+        self.check_format('torchscript')
+
+    @unittest.skipUnless(installed('onnx', 'onnxruntime'), "需要安装 onnx 和 onnxruntime")
+    def test_02_onnx(self):
+        """测试 ONNX 计算图在 onnxruntime 中的输出与原模块一致"""
+        self.check_format('onnx')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,58 @@
+# test_lexical_index.py
+import unittest
+import numpy as np
+from lexical_index import BM25Index, tokenize, reciprocal_rank_fusion
+from vector_index import FlatIndex, IVFIndex
+
+
+class TestLexicalIndex(unittest.TestCase):
+    def setUp(self):
+        self.texts = [
+            "第二十三条 用人单位与劳动者可以在劳动合同中约定保守用人单位的商业秘密。",
+            "第二十四条 竞业限制的人员限于用人单位的高级管理人员。",
+            "第三十九条 劳动者严重违反用人单位的规章制度的，用人单位可以解除劳动合同。",
+            "离婚后，子女的抚养权由双方协议；协议不成的，由人民法院判决。",
+            "Article 23 applies to trade secrets.",
+        ]
+        self.index = BM25Index(self.texts)
+
+    def test_01_tokenize(self):
+        """测试中文按字二元组切分，英文数字按词切分"""
+        self.assertEqual(tokenize("第二十三条"), ['第二', '二十', '十三', '三条'])
+        self.assertEqual(tokenize("Article 23，法"), ['article', '23', '法'])
+        self.assertEqual(tokenize("，。"), [])
+
+    def test_02_exact_statute_reference(self):
+        """测试精确的条文编号排在最前，未命中任何词的文档不返回"""
+        scores, indices = self.index.search("第二十三条", 3)
+        self.assertEqual(indices[0], 0)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        self.assertNotIn(3, indices)
+
+        _, indices = self.index.search("抚养权", 5)
+        self.assertEqual(indices.tolist(), [3])
+        self.assertEqual(len(self.index.search("无关词汇", 5)[1]), 0)
+
+    def test_03_reciprocal_rank_fusion(self):
+        """测试两路都靠前的文档融合后排在最前"""
+        scores, indices = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([2, 4, 1])])
+        self.assertEqual(indices[:2].tolist(), [2, 1])
+        self.assertEqual(set(indices.tolist()), {1, 2, 3, 4})
+        self.assertAlmostEqual(float(scores[0]), 1 / 62 + 1 / 61, places=6)
+        self.assertEqual(len(reciprocal_rank_fusion([np.array([], dtype=np.int64)])[1]), 0)
+
+    def test_04_prefilter_candidates(self):
+        """测试向量索引只在预筛选的候选中检索，结果与全量检索中的对应子集一致"""
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(500, 16)).astype(np.float32)
+        candidates = rng.choice(500, 50, replace=False)
+        query = embeddings[candidates[0]]
+        for index in (FlatIndex(embeddings), IVFIndex(embeddings, nlist=8)):
+            scores, indices = index.search(query, 5, candidates=candidates)
+            self.assertTrue(set(indices.tolist()) <= set(candidates.tolist()))
+            self.assertEqual(indices[0], candidates[0])
+            self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
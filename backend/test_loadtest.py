@@ -0,0 +1,83 @@
+# test_loadtest.py
+import json
+import unittest
+from starlette.testclient import TestClient
+from loadtest import Recorder, compare_reports, format_report, parse_metrics, summarize_level
+from mock_llm import MockLLMConfig, create_mock_app
+
+
+class TestMockLLM(unittest.TestCase):
+    def test_01_completion_and_stream(self):
+        """测试非流式回复和 SSE 流式回复的格式与 OpenAI 接口一致，拼接后的内容相同"""
+        app = create_mock_app(MockLLMConfig(latency=0, token_rate=0, tokens=30, chunk_tokens=4))
+        request = {'model': 'deepseek-chat', 'messages': [{'role': 'user', 'content': '你好'}]}
+        with TestClient(app) as client:
+            body = client.post('/v1/chat/completions', json=request).json()
+            content = body['choices'][0]['message']['content']
+            self.assertEqual(len(content), 30)
+            self.assertEqual(body['usage']['prompt_tokens'], 2)
+
+            response = client.post('/chat/completions', json={**request, 'stream': True})
+            self.assertTrue(response.headers['content-type'].startswith('text/event-stream'))
+            payloads = [line[len('data: '):] for line in response.text.splitlines() if line.startswith('data: ')]
+            self.assertEqual(payloads[-1], '[DONE]')
+            chunks = [json.loads(payload) for payload in payloads[:-1]]
+            self.assertEqual(''.join(chunk['choices'][0]['delta'].get('content', '') for chunk in chunks), content)
+            self.assertEqual(chunks[-1]['choices'][0]['finish_reason'], 'stop')
+            self.assertEqual(client.get('/mock/stats').json()['stream_requests'], 1)
+
+    def test_02_error_rate(self):
+        """测试按错误率返回 500"""
+        app = create_mock_app(MockLLMConfig(latency=0, token_rate=0, error_rate=1.0))
+        with TestClient(app) as client:
+            response = client.post('/v1/chat/completions', json={'messages': []})
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(client.get('/mock/stats').json()['errors'], 1)
+
+
+class TestLoadTestReport(unittest.TestCase):
+    def test_01_parse_metrics(self):
+        """测试读取内存相关指标和语义答案缓存的计数，忽略其他带标签的序列"""
+        text = (
+            "# HELP rag_active_sessions 活跃会话数\n"
+            "# TYPE rag_active_sessions gauge\n"
+            "rag_active_sessions 12\n"
+            "rag_session_messages 40\n"
+            "rag_cache_hits_total{cache=\"semantic_answer\"} 3\n"
+            "rag_cache_hits_total{cache=\"query_embedding\"} 7\n"
+            "rag_process_resident_memory_bytes 1048576\n"
+        )
+        self.assertEqual(parse_metrics(text), {'sessions': 12.0, 'messages': 40.0, 'rss_bytes': 1048576.0,
+                                               'semantic_cache_hits': 3.0})
+
+    def test_02_summary_and_compare(self):
+        """测试汇总吞吐量、错误率和内存增长，并与之前的结果对比"""
+        recorder = Recorder()
+        recorder.sessions, recorder.chat_turns = 2, 3
+        for seconds in (0.1, 0.2, 0.3):
+            recorder.record('chat', seconds)
+        recorder.record('chat', 0.5, error='http_500')
+        recorder.observe('chat_stream_first_token', 0.05)
+        start = {'sessions': 0, 'messages': 0, 'content_chars': 0, 'rss_bytes': 1000,
+                 'semantic_cache_hits': 5, 'semantic_cache_misses': 10}
+        end = {'sessions': 2, 'messages': 6, 'content_chars': 90, 'rss_bytes': 3000,
+               'semantic_cache_hits': 6, 'semantic_cache_misses': 13}
+        result = summarize_level(4, recorder, 2.0, start, end)
+        self.assertEqual(result['requests'], {'chat': 4})
+        self.assertAlmostEqual(result['error_rate'], 0.25)
+        self.assertAlmostEqual(result['chat_turns_per_second'], 1.5)
+        self.assertEqual(result['latency']['chat']['count'], 3)
+        self.assertEqual(result['memory_growth']['rss_bytes'], 2000)
+        self.assertEqual(result['semantic_cache'], {'semantic_cache_hits': 1, 'semantic_cache_misses': 3})
+        report = format_report({'levels': [result], 'timeline': [start, end]})
+        self.assertIn('并发 4', report)
+        self.assertIn('命中 1，未命中 3（命中率 25.0%）', report)
+
+        faster = dict(result, chat_turns_per_second=3.0)
+        comparison = compare_reports({'levels': [faster]}, {'levels': [result]})
+        self.assertIn('+100.0%', comparison)
+        self.assertEqual(compare_reports({'levels': [dict(result, concurrency=8)]}, {'levels': [result]}), '')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
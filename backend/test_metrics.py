@@ -0,0 +1,79 @@
+# test_metrics.py
+import threading
+import unittest
+import numpy as np
+from metrics import Registry, STAGE_SECONDS, start_spans, timed
+from vector_index import FlatIndex
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_01_histogram_buckets_are_cumulative(self):
+        """测试直方图桶计数为累计值，并输出 _sum 和 _count"""
+        histogram = self.registry.histogram('latency_seconds', '耗时', ('stage',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, stage='llm_call')
+        text = self.registry.render()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{stage="llm_call",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="llm_call",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{stage="llm_call",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum{stage="llm_call"} 6.05', text)
+        self.assertIn('latency_seconds_count{stage="llm_call"} 4', text)
+
+    def test_02_counter_labels(self):
+        """测试计数器按标签分别累加，标签不匹配时报错"""
+        counter = self.registry.counter('requests_total', '请求数', ('endpoint', 'status'))
+        counter.inc(endpoint='chat', status='ok')
+        counter.inc(2, endpoint='chat', status='ok')
+        counter.inc(endpoint='chat', status='error')
+        text = self.registry.render()
+        self.assertIn('requests_total{endpoint="chat",status="ok"} 3', text)
+        self.assertIn('requests_total{endpoint="chat",status="error"} 1', text)
+        with self.assertRaises(ValueError):
+            counter.inc(endpoint='chat')
+
+    def test_03_callback_metrics(self):
+        """测试回调指标在导出时读取数值，回调出错时不影响其他指标"""
+        sessions = {'a': 1}
+        self.registry.gauge_callback('active_sessions', '会话数', lambda: len(sessions))
+        self.registry.gauge_callback('cache_hits_total', '命中数', lambda: {('query',): 5}, ('cache',), kind='counter')
+        self.registry.gauge_callback('broken', '出错的指标', lambda: 1 / 0)
+        sessions['b'] = 2
+        text = self.registry.render()
+        self.assertIn('active_sessions 2', text)
+        self.assertIn('# TYPE cache_hits_total counter', text)
+        self.assertIn('cache_hits_total{cache="query"} 5', text)
+        self.assertIn('# TYPE broken gauge', text)
+
+    def test_04_request_spans(self):
+        """测试阶段耗时累加到当前请求，且不同线程的请求互不影响"""
+        embeddings = np.eye(4, dtype=np.float32)
+        index = FlatIndex(embeddings, normalized=True)
+        before = STAGE_SECONDS.samples()
+        spans = start_spans()
+        index.search(embeddings[0], 2)
+        with timed('llm_call'):
+            pass
+        with timed('llm_call'):
+            pass
+        self.assertEqual(set(spans), {'similarity_scoring', 'top_k_selection', 'llm_call'})
+        self.assertNotEqual(STAGE_SECONDS.samples(), before)
+
+        other = {}
+        def worker():
+            worker_spans = start_spans()
+            with timed('retrieval'):
+                pass
+            other.update(worker_spans)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertIn('retrieval', other)
+        self.assertNotIn('retrieval', spans)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,91 @@
+# test_quantization.py
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from quantization import QUANTIZERS, Int8Matrix, PQMatrix, default_subvectors
+from vector_index import FlatIndex, IVFIndex, RerankIndex, normalize_rows
+from embedding_store import EmbeddingStore, SOURCE_LAW, SOURCE_QA
+
+
+class TestQuantization(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 32))
+        self.embeddings = (centers[rng.integers(20, size=2000)] + 0.3 * rng.normal(size=(2000, 32))).astype(np.float32)
+        self.normalized = normalize_rows(self.embeddings)
+        self.queries = self.embeddings[:50] + 0.1 * rng.normal(size=(50, 32)).astype(np.float32)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def recall(self, index, top_k=10):
+        exact = FlatIndex(self.embeddings)
+        hits = 0
+        for query in self.queries:
+            hits += len(set(exact.search(query, top_k)[1]) & set(index.search(query, top_k)[1]))
+        return hits / (len(self.queries) * top_k)
+
+    def test_01_int8_scores(self):
+        """测试 int8 量化的近似内积误差很小，并支持切片、花式索引和查询矩阵"""
+        matrix = Int8Matrix.encode(self.normalized)
+        self.assertEqual(matrix.nbytes, 2000 * 32 + 2000 * 4)
+        query = normalize_rows(self.queries[:1])[0]
+        np.testing.assert_allclose(matrix.inner_product(query), self.normalized @ query, atol=0.02)
+        np.testing.assert_allclose(matrix[[5, 1]].inner_product(query), matrix.inner_product(query)[[5, 1]], rtol=1e-5)
+        centroids = self.normalized[:3].T
+        np.testing.assert_allclose(matrix[10:20].inner_product(centroids), np.asarray(matrix[10:20]) @ centroids, rtol=1e-4)
+        self.assertGreater(self.recall(FlatIndex(matrix, normalized=True)), 0.9)
+
+    def test_02_pq_asymmetric_scores(self):
+        """测试 pq 查表计算的得分与还原向量后的内积一致，每行只占 m 字节"""
+        self.assertEqual(default_subvectors(32), 4)
+        self.assertEqual(default_subvectors(768), 96)
+        matrix = PQMatrix.encode(self.normalized, subvectors=8)
+        self.assertEqual(matrix.codes.shape, (2000, 8))
+        self.assertEqual(matrix.shape, (2000, 32))
+        query = normalize_rows(self.queries[:1])[0]
+        np.testing.assert_allclose(matrix.inner_product(query), matrix.decode() @ query, rtol=1e-4, atol=1e-5)
+        self.assertLess(np.abs(matrix.decode() - self.normalized).mean(), 0.1)
+        with self.assertRaises(ValueError):
+            PQMatrix.train(self.normalized, subvectors=5)
+
+    def test_03_rerank_recovers_exact_results(self):
+        """测试用全精度向量重排候选后，量化检索的召回恢复到接近精确检索"""
+        matrix = PQMatrix.encode(self.normalized, subvectors=4)
+        approximate = FlatIndex(matrix, normalized=True)
+        reranked = RerankIndex(approximate, self.embeddings, depth=100)
+        self.assertGreater(self.recall(reranked), self.recall(approximate))
+        self.assertGreater(self.recall(reranked), 0.95)
+        scores, indices = reranked.search(self.queries[0], 5)
+        expected = self.normalized[indices] @ normalize_rows(self.queries[:1])[0]
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+        self.assertEqual(len(reranked), 2000)
+
+    def test_04_quantized_store_persistence_and_ivf(self):
+        """测试量化存储的保存与 mmap 加载，以及在量化向量上构建近似索引"""
+        for dtype in ('int8', 'pq'):
+            store = EmbeddingStore.build({SOURCE_LAW: self.embeddings[:1500], SOURCE_QA: self.embeddings[1500:]}, dtype=dtype)
+            self.assertTrue(store.quantized)
+            self.assertEqual(store.dtype, dtype)
+            # 逐块编码的结果与先归一化整个矩阵再编码一致
+            quantizer = QUANTIZERS[dtype]
+            params = {'codebooks': store.vectors.codebooks} if dtype == 'pq' else {}
+            np.testing.assert_array_equal(store.vectors.codes, quantizer.encode(self.normalized, **params).codes)
+            store.save(self.tmp_dir)
+            loaded = EmbeddingStore.load(self.tmp_dir, dtype, mmap=True)
+            self.assertEqual(loaded.count(SOURCE_QA), 500)
+            np.testing.assert_array_equal(loaded.vectors.codes, store.vectors.codes)
+            segment = loaded.segment(SOURCE_QA)
+            query = normalize_rows(self.queries[:1])[0]
+            np.testing.assert_allclose(segment.inner_product(query), store.segment(SOURCE_QA).inner_product(query), rtol=1e-5)
+
+            ivf = IVFIndex(loaded.segment(SOURCE_LAW), nlist=8, normalized=True)
+            _, indices = ivf.search(self.queries[0], 5, nprobe=8)
+            _, exact = FlatIndex(loaded.segment(SOURCE_LAW), normalized=True).search(self.queries[0], 5)
+            np.testing.assert_array_equal(indices, exact)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+# test_retrieve_batch.py
+import csv
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from benchmark import synthetic_corpus
+from data_processor import DataProcessor
+from embedding_backends import HashingEmbedding
+
+
+class TestRetrieveBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.law, cls.qa = synthetic_corpus(law_count=300, qa_count=100)
+        for filename, texts in (('law_data_3k.csv', cls.law), ('law_QA.csv', cls.qa)):
+            with open(os.path.join(cls.tmp_dir, filename), 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['data'])
+                writer.writerows([text] for text in texts)
+        cls.embedding = HashingEmbedding(dim=64)
+        cls.queries = [cls.law[5][:20], cls.qa[7][:20], cls.law[5][:20], '劳动合同解除', '']
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def processor(self, **params):
+        return DataProcessor(text_embedding=self.embedding, data_dir=self.tmp_dir, **params)
+
+    def test_01_batch_matches_single_queries(self):
+        """测试批量检索的结构化结果与逐条检索一致，重复查询只计算一次"""
+        for mode in ('dense', 'hybrid'):
+            batch_processor = self.processor(retrieval_mode=mode, chunk_max_chars=40)
+            results = batch_processor.retrieve_batch(self.queries, law_top_k=3, qa_top_k=2, similarity_threshold=0.1)
+            self.assertEqual(batch_processor.query_cache.stats()['misses'], 4)
+
+            single_processor = self.processor(retrieval_mode=mode, chunk_max_chars=40)
+            self.assertEqual(len(results), len(self.queries))
+            for query, hits in zip(self.queries, results):
+                expected = single_processor.retrieve(query, 3, 2, 0.1)
+                # 矩阵乘法与逐条内积的得分只有浮点舍入差异
+                self.assertEqual([(hit['source'], hit['row'], hit['text']) for hit in hits],
+                                 [(hit['source'], hit['row'], hit['text']) for hit in expected])
+                for hit, expected_hit in zip(hits, expected):
+                    self.assertAlmostEqual(hit['score'], expected_hit['score'], places=5)
+            self.assertEqual({hit['source'] for hit in results[0]}, {'law', 'qa'})
+            self.assertEqual(set(results[0][0]), {'source', 'row', 'score', 'text'})
+            self.assertEqual(batch_processor.retrieve_batch([]), [])
+
+    def test_02_batch_results_are_cached(self):
+        """测试批量检索与逐条检索共用结果缓存"""
+        processor = self.processor()
+        hits = processor.retrieve(self.queries[0])
+        hits[0]['text'] = '修改返回值不影响缓存'
+        results = processor.retrieve_batch(self.queries[:2])
+        self.assertEqual(processor.result_cache.stats()['hits'], 1)
+        self.assertEqual(results[0], processor.retrieve(self.queries[0]))
+        self.assertEqual(results[1], processor.retrieve(self.queries[1]))
+
+
+    def test_03_closed_when_unreferenced(self):
+        """测试热更新后的旧实例不再被引用时关闭微批调度线程"""
+        with mock.patch.dict(os.environ, {'QUERY_BATCH_MAX_SIZE': '4'}):
+            processor = self.processor()
+        batcher = processor.query_batcher
+        processor.retrieve(self.queries[0])
+        self.assertEqual(batcher.stats()['items'], 1)
+        processor.close_when_unreferenced()
+        self.assertTrue(batcher._worker.is_alive())
+        del processor
+        gc.collect()
+        batcher._worker.join(timeout=5)
+        self.assertFalse(batcher._worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,179 @@
+# test_session_store.py
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from session_store import MemorySessionStore, SQLiteSessionStore, sync_client_messages
+
+
+class SessionStoreCases:
+    """两种会话存储共用的测试用例"""
+
+    def make_store(self, **kwargs):
+        raise NotImplementedError
+
+    def test_01_create_and_update(self):
+        """测试创建会话和更新设置"""
+        store = self.make_store()
+        store.create('s1')
+        self.assertIn('s1', store)
+        self.assertNotIn('s2', store)
+        self.assertIsNone(store['s1']['system_prompt'])
+        self.assertEqual(store['s1']['messages'], [])
+
+        store.update('s1', system_prompt='你是一名律师', is_law_mode=True, law_cases_count=5)
+        settings = store.get_settings('s1')
+        self.assertEqual(settings['system_prompt'], '你是一名律师')
+        self.assertTrue(settings['is_law_mode'])
+        self.assertEqual(settings['law_cases_count'], 5)
+        self.assertEqual(settings['qa_cases_count'], 3)
+        self.assertTrue(settings['semantic_cache'])
+        store.update('s1', semantic_cache=False)
+        self.assertFalse(store.get_settings('s1')['semantic_cache'])
+
+    def test_02_append_only_history(self):
+        """测试历史只追加，并可按窗口读取最近的消息"""
+        store = self.make_store()
+        store.create('s1')
+        for i in range(5):
+            store.append_messages('s1', [{'role': 'user', 'content': f'问题{i}'},
+                                         {'role': 'assistant', 'content': f'回答{i}'}])
+        self.assertEqual(store.message_count('s1'), 10)
+        window = store.get_history('s1', limit=3)
+        self.assertEqual([msg['content'] for msg in window], ['回答3', '问题4', '回答4'])
+        self.assertEqual(len(store.get_history('s1')), 10)
+        store.create('s2')
+        self.assertEqual(store.stats(), {'sessions': 2, 'messages': 10, 'content_chars': 30})
+
+    def chat(self, store, client, turns):
+        """模拟前端：每轮发送完整历史，模型回答后客户端和会话都追加回答"""
+        for question in turns:
+            client.append({'role': 'user', 'content': question})
+            sync_client_messages(store, 's1', client)
+            reply = {'role': 'assistant', 'content': question.replace('q', 'a')}
+            store.append_messages('s1', [reply])
+            client.append(reply)
+
+    def contents(self, store):
+        return [msg['content'] for msg in store.get_history('s1')]
+
+    def test_06_client_history_beyond_cap(self):
+        """测试客户端每轮发送完整历史，超过历史条数上限后不会重复追加早期消息"""
+        store = self.make_store(max_messages=6)
+        store.create('s1')
+        self.chat(store, [], [f'q{turn}' for turn in range(1, 6)])
+        self.assertEqual(self.contents(store), ['q3', 'a3', 'q4', 'a4', 'q5', 'a5'])
+        self.assertEqual(store.message_count('s1'), 6)
+        self.assertEqual(store.appended_count('s1'), 10)
+
+    def test_07_client_cleared_history(self):
+        """测试客户端清空对话或修改了之前的消息时，以客户端历史替换会话历史"""
+        store = self.make_store()
+        store.create('s1')
+        client = []
+        self.chat(store, client, ['q1', 'q2'])
+        # 前端重新设置系统提示词后清空对话
+        client = []
+        self.chat(store, client, ['q3'])
+        self.assertEqual(self.contents(store), ['q3', 'a3'])
+        self.assertEqual(store.appended_count('s1'), 2)
+
+        # 与会话历史不一致的前缀
+        sync_client_messages(store, 's1', [{'role': 'user', 'content': 'q0'}, client[1],
+                                           {'role': 'user', 'content': 'q4'}])
+        self.assertEqual(self.contents(store), ['q0', 'a3', 'q4'])
+        self.assertEqual(store.appended_count('s1'), 3)
+
+    def test_08_retry_after_failure(self):
+        """测试模型调用失败后客户端重发同一个问题，不重复追加用户消息"""
+        store = self.make_store()
+        store.create('s1')
+        client = []
+        self.chat(store, client, ['q1'])
+        client.append({'role': 'user', 'content': 'q2'})
+        sync_client_messages(store, 's1', client)
+        # 原样重发
+        sync_client_messages(store, 's1', client)
+        self.assertEqual(self.contents(store), ['q1', 'a1', 'q2'])
+        # 前端在失败提示之后再次提问
+        client.append({'role': 'assistant', 'content': '发生错误：API调用失败'})
+        client.append({'role': 'user', 'content': 'q2'})
+        sync_client_messages(store, 's1', client)
+        self.assertEqual(self.contents(store), ['q1', 'a1', 'q2'])
+        self.assertEqual(store.appended_count('s1'), 3)
+
+    def test_03_idle_ttl(self):
+        """测试空闲超时的会话过期"""
+        store = self.make_store(idle_ttl=0.05)
+        store.create('s1')
+        time.sleep(0.1)
+        self.assertNotIn('s1', store)
+        with self.assertRaises(KeyError):
+            store.append_messages('s1', [{'role': 'user', 'content': '你好'}])
+
+
+class TestMemorySessionStore(SessionStoreCases, unittest.TestCase):
+    def make_store(self, **kwargs):
+        return MemorySessionStore(**kwargs)
+
+    def test_04_lru_bounds(self):
+        """测试会话数量和每个会话的历史条数都有上限"""
+        store = MemorySessionStore(max_sessions=2, max_messages=4)
+        store.create('a')
+        store.create('b')
+        store.get_settings('a')  # a 变为最近活动
+        store.create('c')
+        self.assertIn('a', store)
+        self.assertNotIn('b', store)
+        self.assertEqual(len(store), 2)
+
+        store.append_messages('a', [{'role': 'user', 'content': str(i)} for i in range(10)])
+        self.assertEqual([msg['content'] for msg in store.get_history('a')], ['6', '7', '8', '9'])
+
+
+class TestSQLiteSessionStore(SessionStoreCases, unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'sessions.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_store(self, **kwargs):
+        return SQLiteSessionStore(self.db_path, **kwargs)
+
+    def test_04_shared_between_instances(self):
+        """测试不同实例（对应不同工作进程）看到同一个会话"""
+        first = self.make_store()
+        second = self.make_store()
+        first.create('s1')
+        first.append_messages('s1', [{'role': 'user', 'content': '你好'}])
+        second.append_messages('s1', [{'role': 'assistant', 'content': '您好'}])
+        self.assertEqual([msg['role'] for msg in first.get_history('s1')], ['user', 'assistant'])
+
+    def test_05_migrate_old_schema(self):
+        """测试旧版本的数据库打开时补充 semantic_cache 和 appended 列，已有会话默认启用语义缓存"""
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute(
+                "CREATE TABLE sessions (session_id TEXT PRIMARY KEY, system_prompt TEXT, is_law_mode INTEGER NOT NULL, "
+                "law_cases_count INTEGER NOT NULL, qa_cases_count INTEGER NOT NULL, last_active REAL NOT NULL)"
+            )
+            conn.execute("INSERT INTO sessions VALUES ('old', NULL, 1, 3, 3, ?)", (time.time(),))
+            conn.execute(
+                "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL)"
+            )
+            conn.execute("INSERT INTO messages (session_id, role, content) VALUES ('old', 'user', '你好')")
+        conn.close()
+        store = self.make_store()
+        self.assertTrue(store.get_settings('old')['semantic_cache'])
+        self.assertEqual(store.appended_count('old'), 1)
+        store.create('new', semantic_cache=False)
+        self.assertFalse(store.get_settings('new')['semantic_cache'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
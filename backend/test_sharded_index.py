@@ -0,0 +1,64 @@
+# test_sharded_index.py
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from embedding_store import EmbeddingStore, SOURCE_LAW, SOURCE_QA
+from sharded_index import ShardPool, ShardedIndex, default_start_method
+from vector_index import FlatIndex
+
+
+class TestShardedIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.law = rng.normal(size=(1003, 16)).astype(np.float32)
+        cls.qa = rng.normal(size=(200, 16)).astype(np.float32)
+        cls.queries = rng.normal(size=(20, 16)).astype(np.float32)
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.store = EmbeddingStore.build({SOURCE_LAW: cls.law, SOURCE_QA: cls.qa})
+        cls.store.save(cls.tmp_dir)
+        cls.pool = ShardPool(cls.tmp_dir, cls.store.dtype, [len(cls.law), len(cls.qa)], processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_01_merged_results_match_flat_index(self):
+        """测试各分片局部 top-k 合并后与单进程精确检索的结果一致，工作进程不由主进程直接 fork"""
+        self.assertIn(self.pool.start_method, ('forkserver', 'spawn'))
+        self.assertEqual(self.pool.start_method, default_start_method())
+        for source in (SOURCE_LAW, SOURCE_QA):
+            flat = FlatIndex(self.store.segment(source), normalized=True)
+            sharded = ShardedIndex(flat, self.pool, source, shards=3)
+            self.assertEqual(len(sharded.ranges), 3)
+            self.assertEqual(len(sharded), len(flat))
+            for query in self.queries:
+                scores, indices = sharded.search(query, 7)
+                expected_scores, expected_indices = flat.search(query, 7)
+                np.testing.assert_array_equal(indices, expected_indices)
+                np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_02_candidates_and_fallback(self):
+        """测试候选子集检索在当前进程中完成，进程池不可用时退回到被包装的索引"""
+        flat = FlatIndex(self.store.segment(SOURCE_LAW), normalized=True)
+        candidates = np.array([5, 50, 500, 1000])
+        expected = flat.search(self.queries[0], 2, candidates=candidates)
+        broken = ShardedIndex(flat, None, SOURCE_LAW, shards=4)
+        np.testing.assert_array_equal(broken.search(self.queries[0], 2, candidates=candidates)[1], expected[1])
+        np.testing.assert_array_equal(broken.search(self.queries[0], 5)[1], flat.search(self.queries[0], 5)[1])
+
+    def test_03_batch_search(self):
+        """测试批量检索在各分片中一次计算全部查询，合并后与逐条检索一致"""
+        flat = FlatIndex(self.store.segment(SOURCE_LAW), normalized=True)
+        sharded = ShardedIndex(flat, self.pool, SOURCE_LAW, shards=3)
+        batch = sharded.search_batch(self.queries, 5)
+        self.assertEqual(len(batch), len(self.queries))
+        for query, (scores, indices) in zip(self.queries, batch):
+            np.testing.assert_array_equal(indices, sharded.search(query, 5)[1])
+            np.testing.assert_allclose(scores, flat.search(query, 5)[0], rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
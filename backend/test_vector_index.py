@@ -0,0 +1,131 @@
+# test_vector_index.py
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from vector_index import FlatIndex, IVFIndex, RerankIndex, load_or_build_index, index_path, search_batch, top_k_indices
+from embedding_store import EmbeddingStore, SOURCE_LAW, SOURCE_QA
+
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 32))
+        self.embeddings = (centers[rng.integers(20, size=2000)] + 0.2 * rng.normal(size=(2000, 32))).astype(np.float32)
+        self.queries = self.embeddings[:50]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.embeddings_path = os.path.join(self.tmp_dir, 'law_data_embeddings.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_01_flat_matches_cosine(self):
+        """测试精确索引与余弦相似度排序一致"""
+        index = FlatIndex(self.embeddings)
+        query = self.queries[0]
+        scores, indices = index.search(query, 5)
+
+        normed = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        expected = normed @ (query / np.linalg.norm(query))
+        np.testing.assert_array_equal(indices, np.argsort(expected)[-5:][::-1])
+        np.testing.assert_allclose(scores, expected[indices], rtol=1e-5)
+
+    def test_02_ivf_recall_grows_with_nprobe(self):
+        """测试近似索引召回率随 nprobe 增大而提高，扫描全部簇时等价于精确检索"""
+        flat = FlatIndex(self.embeddings)
+        ivf = IVFIndex(self.embeddings, nlist=16)
+
+        def recall(nprobe):
+            hits = 0
+            for query in self.queries:
+                _, exact = flat.search(query, 10)
+                _, approx = ivf.search(query, 10, nprobe=nprobe)
+                hits += len(set(exact) & set(approx))
+            return hits / (10 * len(self.queries))
+
+        self.assertLessEqual(recall(1), recall(4))
+        self.assertEqual(recall(16), 1.0)
+
+    def test_03_ivf_persistence(self):
+        """测试近似索引保存在 .npy 旁边并可重新加载"""
+        built = load_or_build_index(self.embeddings, self.embeddings_path, kind='ivf', nprobe=4)
+        path = index_path(self.embeddings_path, 'ivf')
+        self.assertTrue(os.path.exists(path))
+
+        loaded = load_or_build_index(self.embeddings, self.embeddings_path, kind='ivf', nprobe=4)
+        np.testing.assert_array_equal(built.list_ids, loaded.list_ids)
+        np.testing.assert_array_equal(built.search(self.queries[0], 5)[1], loaded.search(self.queries[0], 5)[1])
+
+        # 嵌入向量数量变化时重新构建
+        rebuilt = load_or_build_index(self.embeddings[:1000], self.embeddings_path, kind='ivf', nprobe=4)
+        self.assertEqual(len(rebuilt.list_ids), 1000)
+
+    def test_04_top_k_indices(self):
+        """测试 argpartition 选出的 top-k 与完整排序一致"""
+        scores = np.random.default_rng(1).normal(size=1000)
+        np.testing.assert_array_equal(top_k_indices(scores, 10), np.argsort(scores)[-10:][::-1])
+        self.assertEqual(len(top_k_indices(scores, 5000)), 1000)
+        self.assertEqual(len(top_k_indices(scores, 0)), 0)
+
+    def test_05_embedding_store(self):
+        """测试嵌入向量存储的拼接、来源切片和 float16 精度"""
+        law, qa = self.embeddings[:1200], self.embeddings[1200:]
+        store = EmbeddingStore.build({SOURCE_LAW: law, SOURCE_QA: qa}, dtype='float16')
+        self.assertEqual(store.count(SOURCE_LAW), 1200)
+        self.assertEqual(store.count(SOURCE_QA), 800)
+        self.assertEqual(store.vectors.dtype, np.float16)
+        self.assertTrue(np.shares_memory(store.segment(SOURCE_QA), store.vectors))
+
+        store.save(self.tmp_dir)
+        loaded = EmbeddingStore.load(self.tmp_dir, 'float16')
+        np.testing.assert_array_equal(loaded.sources, store.sources)
+
+        exact = FlatIndex(qa)
+        compact = FlatIndex(loaded.segment(SOURCE_QA), normalized=True)
+        for query in self.queries[:10]:
+            exact_scores, exact_ids = exact.search(query, 5)
+            compact_scores, compact_ids = compact.search(query, 5)
+            np.testing.assert_allclose(compact_scores, exact_scores, atol=1e-2)
+            self.assertGreaterEqual(len(set(exact_ids) & set(compact_ids)), 4)
+
+    def test_06_search_batch_matches_single_queries(self):
+        """测试批量检索与逐条检索的结果一致，包括按查询分块计算和不支持批量的索引"""
+        store = EmbeddingStore.build({SOURCE_LAW: self.embeddings, SOURCE_QA: self.embeddings[:10]}, dtype='float16')
+        indexes = [
+            FlatIndex(self.embeddings),
+            FlatIndex(store.segment(SOURCE_LAW), normalized=True),
+            IVFIndex(self.embeddings, nlist=16),
+            RerankIndex(FlatIndex(store.segment(SOURCE_LAW), normalized=True), self.embeddings, depth=20),
+        ]
+        for index in indexes:
+            batch = search_batch(index, self.queries, 5, nprobe=4)
+            self.assertEqual(len(batch), len(self.queries))
+            for query, (scores, indices) in zip(self.queries, batch):
+                expected_scores, expected_indices = index.search(query, 5, nprobe=4)
+                np.testing.assert_array_equal(indices, expected_indices)
+                np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+        with mock.patch('vector_index.BATCH_SCORE_ELEMENTS', 2000 * 7):
+            chunked = indexes[0].search_batch(self.queries, 3)
+        np.testing.assert_array_equal(chunked[-1][1], indexes[0].search(self.queries[-1], 3)[1])
+        self.assertEqual(indexes[0].search_batch(self.queries[:0], 3), [])
+
+
+    def test_07_ivf_fingerprint(self):
+        """测试向量行数和维度不变但内容变化（指纹不一致）时重新构建"""
+        load_or_build_index(self.embeddings, self.embeddings_path, kind='ivf', nprobe=4, fingerprint='v1')
+        loaded = load_or_build_index(self.embeddings, self.embeddings_path, kind='ivf', nprobe=4, fingerprint='v1')
+        self.assertEqual(loaded.fingerprint, 'v1')
+
+        # 行数和维度不变，但行的顺序变化
+        changed = self.embeddings[::-1].copy()
+        rebuilt = load_or_build_index(changed, self.embeddings_path, kind='ivf', nprobe=4, fingerprint='v2')
+        self.assertEqual(rebuilt.fingerprint, 'v2')
+        np.testing.assert_array_equal(rebuilt.list_ids, IVFIndex(changed, nprobe=4).list_ids)
+        self.assertEqual(IVFIndex.load(index_path(self.embeddings_path, 'ivf'), changed).fingerprint, 'v2')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
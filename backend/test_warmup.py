@@ -0,0 +1,75 @@
+# test_warmup.py
+import threading
+import unittest
+from unittest import mock
+import data_processor
+from data_processor import peek_data_processor, start_warmup, wait_for_data_processor, warmup_status
+
+
+class SlowProcessor:
+    """加载过程可由测试控制的数据处理器"""
+    release = None
+    fail = False
+
+    def __init__(self, progress=None):
+        progress('embedding', done=1, total=2)
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError('模型加载失败')
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        SlowProcessor.release = threading.Event()
+        SlowProcessor.fail = False
+        self.patcher = mock.patch.object(data_processor, 'DataProcessor', SlowProcessor)
+        self.patcher.start()
+        self.reset()
+
+    def tearDown(self):
+        SlowProcessor.release.set()
+        if data_processor._warmup_thread is not None:
+            data_processor._warmup_thread.join(5)
+        self.patcher.stop()
+        self.reset()
+
+    def reset(self):
+        data_processor._data_processor = None
+        data_processor._warmup_thread = None
+        data_processor._warmup_done.clear()
+        data_processor._warmup.update(state='idle', stage=None, detail={}, started_at=None, finished_at=None, error=None)
+
+    def test_01_background_warmup_reports_progress(self):
+        """测试后台预热立即返回，加载中报告进度，等待超时返回 None，加载完成后就绪"""
+        start_warmup()
+        self.assertIsNone(peek_data_processor())
+        self.assertIsNone(wait_for_data_processor(timeout=0.05))
+        status = warmup_status()
+        self.assertFalse(status['ready'])
+        self.assertEqual(status['state'], 'loading')
+        self.assertEqual(status['stage'], 'embedding')
+        self.assertEqual(status['detail'], {'done': 1, 'total': 2})
+
+        SlowProcessor.release.set()
+        processor = wait_for_data_processor(timeout=5)
+        self.assertIsInstance(processor, SlowProcessor)
+        self.assertIs(data_processor.get_data_processor(), processor)
+        status = warmup_status()
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['state'], 'ready')
+        self.assertGreaterEqual(status['elapsed'], 0)
+
+    def test_02_failed_warmup(self):
+        """测试加载失败后报告错误，等待方立即返回 None 而不是等到超时"""
+        SlowProcessor.fail = True
+        SlowProcessor.release.set()
+        start_warmup()
+        data_processor._warmup_thread.join(5)
+        status = warmup_status()
+        self.assertEqual(status['state'], 'failed')
+        self.assertIn('模型加载失败', status['error'])
+        self.assertIsNone(wait_for_data_processor(timeout=5))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,366 @@
+import logging
+import os
+import numpy as np
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# 低精度矩阵按块转换为 float32 后再计算内积，避免一次性复制整个矩阵
+SCORE_CHUNK_ROWS = 8192
+# 批量检索时得分矩阵（行数 × 查询数）的最大元素数，超过时按查询分块计算
+BATCH_SCORE_ELEMENTS = 1 << 25
+
+
+def normalize_rows(embeddings, dtype=np.float32):
+    """将嵌入向量整理为二维矩阵并做 L2 归一化"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2:
+        embeddings = embeddings.reshape(len(embeddings), -1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (embeddings / norms).astype(dtype, copy=False)
+
+
+def normalize_query(query):
+    """将单个查询向量整理为一维 float32 向量并做 L2 归一化"""
+    return normalize_rows(np.reshape(query, (1, -1)))[0]
+
+
+def inner_product(matrix, query):
+    """
+    计算矩阵每一行与查询向量（或查询矩阵的每一列）的内积
+    float32 矩阵直接做一次矩阵乘法；float16 等低精度矩阵分块转换后计算；
+    量化矩阵（quantization.Int8Matrix / PQMatrix）由其自身以全精度查询做非对称计算
+    """
+    if hasattr(matrix, 'inner_product'):
+        return matrix.inner_product(query)
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    chunks = [
+        np.asarray(matrix[start:start + SCORE_CHUNK_ROWS], dtype=np.float32) @ query
+        for start in range(0, len(matrix), SCORE_CHUNK_ROWS)
+    ]
+    if not chunks:
+        return np.empty((0,) + np.shape(query)[1:], dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+def top_k_indices(scores, top_k):
+    """返回得分最高的 top_k 个位置，按得分从高到低排序"""
+    top_k = min(int(top_k), len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        # argpartition 只做部分排序，复杂度 O(n)，再对选出的 top_k 个排序
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def search_batch(index, queries, top_k, **kwargs):
+    """
+    批量检索
+    索引实现了 search_batch 时用矩阵乘法一次计算全部查询的相似度，否则逐条检索
+    :param queries: 形状为 (查询数, dim) 的查询矩阵
+    :return: 与 queries 每一行对应的 (scores, indices) 列表
+    """
+    if hasattr(index, 'search_batch'):
+        return index.search_batch(queries, top_k, **kwargs)
+    return [index.search(query, top_k, **kwargs) for query in queries]
+
+
+def search_candidates(embeddings, query, candidates, top_k):
+    """
+    只在给定的候选行中精确检索，例如由词法检索预筛选出的子集
+    :param query: 已归一化的查询向量
+    :return: (scores, indices)，均按相似度从高到低排序
+    """
+    # 候选 id 排序后按行号顺序读取向量，访问更连续
+    candidates = np.unique(np.asarray(candidates, dtype=np.int64))
+    with timed('similarity_scoring'):
+        scores = inner_product(embeddings[candidates], query)
+    with timed('top_k_selection'):
+        order = top_k_indices(scores, top_k)
+    return scores[order], candidates[order]
+
+
+class FlatIndex:
+    """精确检索：对全部向量做内积（归一化后即余弦相似度）"""
+    kind = 'flat'
+
+    def __init__(self, embeddings, normalized=False, **params):
+        # normalized=True 时直接引用传入的矩阵（例如 EmbeddingStore 中的切片），不再复制
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def search(self, query, top_k, candidates=None, **kwargs):
+        """
+        检索与查询最相似的向量
+        :param query: 查询向量
+        :param top_k: 返回数量
+        :param candidates: 只在这些行号中检索，为 None 时检索全部向量
+        :return: (scores, indices)，均按相似度从高到低排序
+        """
+        query = normalize_query(query)
+        if candidates is not None:
+            return search_candidates(self.embeddings, query, candidates, top_k)
+        with timed('similarity_scoring'):
+            scores = inner_product(self.embeddings, query)
+        with timed('top_k_selection'):
+            indices = top_k_indices(scores, top_k)
+        return scores[indices], indices
+
+    def search_batch(self, queries, top_k, **kwargs):
+        """
+        批量精确检索：每块查询与全部向量做一次矩阵乘法
+        :return: 与 queries 每一行对应的 (scores, indices) 列表
+        """
+        queries = normalize_rows(queries)
+        block_size = max(1, BATCH_SCORE_ELEMENTS // max(1, len(self)))
+        results = []
+        for start in range(0, len(queries), block_size):
+            with timed('similarity_scoring'):
+                scores = inner_product(self.embeddings, queries[start:start + block_size].T)
+            with timed('top_k_selection'):
+                for column in scores.T:
+                    indices = top_k_indices(column, top_k)
+                    results.append((column[indices], indices))
+        return results
+
+    def save(self, path):
+        # 精确索引直接使用 .npy 中的向量，无需额外持久化
+        pass
+
+    @classmethod
+    def load(cls, path, embeddings, normalized=False, fingerprint=None):
+        return cls(embeddings, normalized=normalized)
+
+
+class IVFIndex:
+    """
+    倒排文件近似检索（IVF）
+    使用球面 k-means 将向量划分为 nlist 个簇，查询时只扫描与查询最接近的 nprobe 个簇。
+    nprobe 越大召回越高、延迟越大；nprobe == nlist 时等价于精确检索。
+    fingerprint 为构建索引时向量内容的指纹，随索引保存，加载时用于发现行数和维度不变但内容已变化的向量。
+    """
+    kind = 'ivf'
+
+    def __init__(self, embeddings, nlist=None, nprobe=8, n_iter=20, seed=0, train=True, normalized=False):
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+        self.nlist = int(nlist or max(1, int(np.sqrt(len(self.embeddings)))))
+        self.nlist = max(1, min(self.nlist, len(self.embeddings)))
+        self.nprobe = int(nprobe)
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+        self.fingerprint = None
+        if train and len(self.embeddings) > 0:
+            self._train(n_iter, seed)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def _train(self, n_iter, seed):
+        """训练聚类中心并建立倒排列表"""
+        rng = np.random.default_rng(seed)
+        vectors = self.embeddings
+        # 大语料只用采样数据训练聚类中心
+        sample_size = min(len(vectors), self.nlist * 256)
+        sample_ids = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+        sample = np.asarray(vectors[sample_ids], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(self.nlist):
+                members = sample[assignments == cluster]
+                if len(members) == 0:
+                    # 空簇重新随机选取中心
+                    centroids[cluster] = sample[rng.integers(len(sample))]
+                else:
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = normalize_rows(centroids)
+
+        self.centroids = centroids
+        self._build_lists(np.argmax(inner_product(vectors, centroids.T), axis=1))
+
+    def _build_lists(self, assignments):
+        """按簇编号排序向量 id，list_offsets[c]:list_offsets[c+1] 为第 c 个簇的成员"""
+        self.list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=self.nlist)
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def search(self, query, top_k, nprobe=None, candidates=None):
+        """
+        近似检索与查询最相似的向量
+        :param query: 查询向量
+        :param top_k: 返回数量
+        :param nprobe: 本次查询扫描的簇数量，默认使用 self.nprobe
+        :param candidates: 只在这些行号中精确检索（不再按簇筛选），为 None 时按簇检索
+        :return: (scores, indices)，均按相似度从高到低排序
+        """
+        if self.centroids is None:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        query = normalize_query(query)
+        if candidates is not None:
+            return search_candidates(self.embeddings, query, candidates, top_k)
+        nprobe = max(1, min(int(nprobe or self.nprobe), self.nlist))
+        with timed('similarity_scoring'):
+            probe_lists = top_k_indices(self.centroids @ query, nprobe)
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe_lists
+        ])
+        return search_candidates(self.embeddings, query, candidates, top_k)
+
+    @classmethod
+    def from_centroids(cls, path, embeddings, normalized=False, fingerprint=None):
+        """
+        复用已保存索引的聚类中心，按新的向量重新分配倒排列表，不重新训练。
+        适用于增量更新语料：新增或修改的行被分配到最近的簇。
+        :param fingerprint: 新向量内容的指纹
+        """
+        data = np.load(path)
+        index = cls(
+            embeddings, nlist=len(data['centroids']), nprobe=int(data['nprobe']),
+            train=False, normalized=normalized
+        )
+        if data['centroids'].shape[1] != index.embeddings.shape[1]:
+            raise ValueError(f"索引文件与嵌入向量维度不一致: {path}")
+        index.centroids = data['centroids']
+        index._build_lists(np.argmax(inner_product(index.embeddings, index.centroids.T), axis=1))
+        index.fingerprint = fingerprint
+        return index
+
+    def save(self, path):
+        # 先写临时文件再替换，避免其它进程读到写了一半的索引
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_ids=self.list_ids,
+                nprobe=self.nprobe,
+                fingerprint=self.fingerprint or '',
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, embeddings, normalized=False, fingerprint=None):
+        """
+        加载已保存的索引
+        :param fingerprint: 当前向量内容的指纹，与保存的指纹不一致（包括旧版本没有保存指纹的索引）时报错
+        """
+        data = np.load(path)
+        saved = str(data['fingerprint']) if 'fingerprint' in data.files else ''
+        if fingerprint is not None and saved != fingerprint:
+            raise ValueError(f"索引文件与嵌入向量内容不一致: {path}")
+        index = cls(
+            embeddings, nlist=len(data['centroids']), nprobe=int(data['nprobe']),
+            train=False, normalized=normalized
+        )
+        index.centroids = data['centroids']
+        index.list_offsets = data['list_offsets']
+        index.list_ids = data['list_ids']
+        if len(index.list_ids) != len(index.embeddings) or index.centroids.shape[1] != index.embeddings.shape[1]:
+            raise ValueError(f"索引文件与嵌入向量不匹配: {path}")
+        index.fingerprint = saved or None
+        return index
+
+
+class RerankIndex:
+    """
+    在量化向量上检索后，对前 depth 个候选用全精度向量重新计算相似度并排序
+    全精度向量通常是以 mmap 方式加载的原始 .npy（未归一化），只有候选行会被读入内存。
+    """
+
+    def __init__(self, index, full_vectors, depth=50):
+        self.index = index
+        self.full_vectors = full_vectors
+        self.depth = int(depth)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getattr__(self, name):
+        # nprobe、kind 等属性沿用被包装的索引
+        return getattr(self.index, name)
+
+    def search(self, query, top_k, **kwargs):
+        """参数与被包装索引的 search 相同，返回的得分为全精度余弦相似度"""
+        _, indices = self.index.search(query, max(int(top_k), self.depth), **kwargs)
+        return self.rerank(query, indices, top_k)
+
+    def search_batch(self, queries, top_k, **kwargs):
+        """批量检索候选后逐条重排"""
+        candidates = search_batch(self.index, queries, max(int(top_k), self.depth), **kwargs)
+        return [self.rerank(query, indices, top_k) for query, (_, indices) in zip(queries, candidates)]
+
+    def rerank(self, query, indices, top_k):
+        query = normalize_query(query)
+        # 按行号顺序读取，mmap 访问更连续
+        indices = np.sort(indices)
+        with timed('rerank'):
+            scores = normalize_rows(self.full_vectors[indices]) @ query
+            order = top_k_indices(scores, top_k)
+        return scores[order], indices[order]
+
+
+INDEX_TYPES = {
+    FlatIndex.kind: FlatIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def index_path(embeddings_path, kind):
+    """索引文件与 .npy 放在同一目录，例如 law_data_embeddings.ivf.npz"""
+    base, _ = os.path.splitext(embeddings_path)
+    return f"{base}.{kind}.npz"
+
+
+def build_index(embeddings, kind='flat', **params):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型: {kind}，可选: {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](embeddings, **params)
+
+
+def load_or_build_index(embeddings, embeddings_path, kind='flat', rebuild=False, normalized=False,
+                        patch=False, fingerprint=None, **params):
+    """
+    加载与嵌入向量文件对应的索引，不存在或不匹配时重新构建并保存
+    :param embeddings: 嵌入向量矩阵
+    :param embeddings_path: 嵌入向量 .npy 文件路径
+    :param kind: 索引类型 flat / ivf
+    :param rebuild: 是否强制重建
+    :param normalized: 传入的向量是否已经归一化
+    :param patch: 向量有增删改时复用已保存的聚类中心，只重新分配倒排列表
+    :param fingerprint: 向量内容的指纹（例如清单中的内容哈希），与已保存索引的指纹不一致时重新构建
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型: {kind}，可选: {', '.join(INDEX_TYPES)}")
+    index_cls = INDEX_TYPES[kind]
+    path = index_path(embeddings_path, kind)
+    if not rebuild and kind != FlatIndex.kind and os.path.exists(path):
+        try:
+            if patch:
+                index = index_cls.from_centroids(path, embeddings, normalized=normalized, fingerprint=fingerprint)
+                index.save(path)
+                logger.info("向量索引已增量更新: %s", os.path.basename(path))
+            else:
+                index = index_cls.load(path, embeddings, normalized=normalized, fingerprint=fingerprint)
+                logger.info("加载向量索引: %s", os.path.basename(path))
+            if params.get('nprobe'):
+                index.nprobe = int(params['nprobe'])
+            return index
+        except Exception as e:
+            logger.warning("索引文件无效，重新构建: %s", e)
+
+    index = build_index(embeddings, kind, normalized=normalized, **params)
+    if kind != FlatIndex.kind:
+        index.fingerprint = fingerprint
+        index.save(path)
+        logger.info("向量索引已保存: %s", os.path.basename(path))
+    return index